@@ -1,3 +1,7 @@
+-- Base schema of songs_database.db. Later changes (lookup indexes, token and prediction caches,
+-- ingestion_log, model_version of emotional_result, skipped_song) are the migrations of
+-- data_source/sql/migrations, applied in order by scripts/migrate_db.py and scripts/model_run.py.
+
 CREATE TABLE song(song_id INTEGER PRIMARY KEY NOT NULL, 
                   song_name TEXT NOT NULL, 
                   lyrics TEXT NOT NULL, 
@@ -0,0 +1,9 @@
+-- Secondary indexes for the joins and filters issued by the scripts.
+CREATE INDEX IF NOT EXISTS idx_artist_song_id ON artist(song_id);
+
+CREATE INDEX IF NOT EXISTS idx_emotional_result_song_model_emotion 
+    ON emotional_result(song_id, model_name, emotion);
+
+CREATE INDEX IF NOT EXISTS idx_inputs_source_emotion_id ON inputs(source, emotion_id);
+
+CREATE INDEX IF NOT EXISTS idx_inputs_emotion_id ON inputs(emotion_id);
@@ -0,0 +1,11 @@
+-- Side table of libs.token_cache.TokenCache.
+CREATE TABLE IF NOT EXISTS token_cache(
+    text_hash TEXT NOT NULL,
+    tokenizer_name TEXT NOT NULL,
+    max_length INTEGER NOT NULL,
+    input_ids BLOB NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY(text_hash, tokenizer_name, max_length)
+);
+
+CREATE INDEX IF NOT EXISTS idx_token_cache_last_used ON token_cache(last_used);
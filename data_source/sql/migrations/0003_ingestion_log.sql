@@ -0,0 +1,12 @@
+-- Checkpoint of scripts/get_and_save_lyrics.py: one row per song of the music list already searched.
+CREATE TABLE IF NOT EXISTS ingestion_log(
+    artist_name TEXT NOT NULL,
+    music_name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    song_id INTEGER,
+    updated_at DATETIME NOT NULL,
+    PRIMARY KEY(artist_name, music_name),
+    FOREIGN KEY(song_id) REFERENCES song(song_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_song_vagalume_song_id ON song(vagalume_song_id);
@@ -0,0 +1,11 @@
+-- Model version of each result, and the key of the incremental upsert of scripts/model_run.py.
+ALTER TABLE emotional_result ADD COLUMN model_version TEXT NOT NULL DEFAULT '';
+
+DELETE FROM emotional_result WHERE emotinal_result_id NOT IN (
+    SELECT MAX(emotinal_result_id) FROM emotional_result
+    GROUP BY song_id, model_name, model_version, emotion);
+
+DROP INDEX IF EXISTS idx_emotional_result_song_model_emotion;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_emotional_result_key
+    ON emotional_result(song_id, model_name, model_version, emotion);
@@ -0,0 +1,11 @@
+-- Side table of libs.prediction_cache.PredictionCache.
+CREATE TABLE IF NOT EXISTS prediction_cache(
+    lyrics_hash TEXT NOT NULL,
+    model_hash TEXT NOT NULL,
+    config_hash TEXT NOT NULL,
+    predicts BLOB NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY(lyrics_hash, model_hash, config_hash)
+);
+
+CREATE INDEX IF NOT EXISTS idx_prediction_cache_last_used ON prediction_cache(last_used);
@@ -0,0 +1,10 @@
+-- Songs a model version cannot score, e.g. lyrics dropped by the preprocessing, so scripts/model_run.py
+-- does not select them again on every run.
+CREATE TABLE IF NOT EXISTS skipped_song(
+    song_id INTEGER NOT NULL,
+    model_name TEXT NOT NULL,
+    model_version TEXT NOT NULL,
+    reason TEXT NOT NULL,
+    PRIMARY KEY(song_id, model_name, model_version),
+    FOREIGN KEY(song_id) REFERENCES song(song_id)
+);
@@ -4,4 +4,5 @@ git config --global core.excludesFile '~/.gitignore'
 
 pip3 install bert-for-tf2
 pip3 install sentencepiece
-pip3 install tensorflow=='2.2.0-rc3'
\ No newline at end of file
+pip3 install tensorflow=='2.2.0-rc3'
+pip3 install aiohttp
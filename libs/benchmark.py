@@ -0,0 +1,166 @@
+from datetime import datetime, timezone
+from time import perf_counter
+import json, platform, sqlite3, subprocess
+import os, sys
+import numpy as np
+import pandas as pd
+
+path = os.path.abspath(__file__)
+path = path[:path.find('/libs')]
+sys.path.insert(1, path)
+
+
+class Benchmark:
+    """
+    Reproducible timing harness: runs each case a fixed number of times on fixed data and
+    collects the results, with the environment they were measured on, as JSON.
+    -------
+
+    Each case is timed after `warmup` untimed runs. The result holds the median, mean, minimum,
+    p95 and standard deviation of the run times, the latency per row and the throughput in rows
+    per second. If the function returns a dict, its values (e.g. an accuracy) are stored too.
+    A case that raises is recorded with its error and does not stop the suite.
+
+    Attributes:
+        - repeats (int): Timed runs of each case.
+        - warmup (int): Untimed runs before the timed ones.
+        - results (list): One dict per case.
+
+    Example:
+
+        >>> benchmark = Benchmark(repeats=5)
+        >>> benchmark.measure('tokenize_batch', lambda: pp.tokenize_batch(texts, 64), rows=len(texts), group='tokenization')
+        >>> benchmark.save('benchmark.json')
+        >>> compare(benchmark.report(), load_report('benchmarks/baseline.json'))
+    """
+    def __init__(self, repeats=5, warmup=1) -> None:
+        self.repeats = repeats
+        self.warmup = warmup
+        self.results = []
+
+
+    def measure(self, name, function, rows=None, group=None, repeats=None, warmup=None) -> dict:
+        """
+        Times a case and stores its result.
+        -------
+
+        Args:
+            - name (str): Unique name of the case, used to compare with the baseline.
+            - function (callable): The case, without arguments.
+            - rows (int): Rows processed by one run, for the latency per row and the throughput.
+            - group (str): Stage of the case, e.g. 'preprocessing', 'tokenization', 'database', 'inference'.
+            - repeats (int): Timed runs, overriding the suite default (e.g. 1 for a training).
+            - warmup (int): Untimed runs, overriding the suite default.
+
+        Returns:
+            - dict: The result of the case.
+        """
+        repeats = repeats or self.repeats
+        warmup = self.warmup if warmup is None else warmup
+        result = {'name': name, 'group': group, 'rows': rows, 'repeats': repeats}
+        try:
+            for _ in range(warmup):
+                function()
+            times, metrics = [], None
+            for _ in range(repeats):
+                start = perf_counter()
+                metrics = function()
+                times.append(perf_counter() - start)
+        except Exception as error:
+            print(f"{name}: {error}")
+            result['error'] = f"{type(error).__name__}: {error}"
+            self.results.append(result)
+            return result
+
+        times = np.array(times)
+        median = float(np.median(times))
+        result.update({'median_s': median, 'mean_s': float(times.mean()), 'min_s': float(times.min()),
+                       'p95_s': float(np.percentile(times, 95)), 'stdev_s': float(times.std())})
+        if rows:
+            result.update({'latency_ms_per_row': median / rows * 1000, 'rows_per_s': rows / median if median else None})
+        if isinstance(metrics, dict):
+            result.update(metrics)
+        print(f"{name}: {median:.4f}s" + (f" ({result['rows_per_s']:.0f} rows/s)" if rows and median else ""))
+        self.results.append(result)
+        return result
+
+
+    def report(self, **metadata) -> dict:
+        """
+        Returns the JSON-serializable report: environment, metadata (e.g. sample sizes) and results.
+        """
+        return {'environment': environment(), 'metadata': metadata, 'results': self.results}
+
+
+    def save(self, file, **metadata) -> dict:
+        report = self.report(**metadata)
+        os.makedirs(os.path.dirname(os.path.abspath(file)), exist_ok=True)
+        with open(file, 'w') as output:
+            json.dump(report, output, indent=2, ensure_ascii=False, default=str)
+        return report
+
+
+def _version(package) -> str|None:
+    from importlib import metadata
+    try:
+        return metadata.version(package)
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def environment() -> dict:
+    """
+    Returns the metadata of the machine and of the code a benchmark ran on.
+    """
+    try:
+        commit = subprocess.run(['git', '-C', path, 'rev-parse', 'HEAD'], capture_output=True,
+                                text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {'timestamp': datetime.now(timezone.utc).isoformat(),
+            'git_commit': commit,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            'sqlite': sqlite3.sqlite_version,
+            'packages': {package: _version(package) for package in
+                         ('numpy', 'pandas', 'scikit-learn', 'tensorflow', 'keras', 'transformers', 'nltk')},
+            'offline': os.environ.get('AFFECTIVE_OFFLINE', '0')}
+
+
+def load_report(file) -> dict|None:
+    if not os.path.exists(file):
+        return None
+    with open(file, 'r') as report:
+        return json.load(report)
+
+
+def compare(report, baseline, tolerance=0.2) -> pd.DataFrame:
+    """
+    Compares the median time of every case with a baseline report.
+    -------
+
+    Args:
+        - report (dict): The current report, from Benchmark.report.
+        - baseline (dict): The baseline report.
+        - tolerance (float): Relative slowdown accepted before a case is flagged, e.g. 0.2 for 20%.
+
+    Returns:
+        - pd.DataFrame: One row per case of both reports with the baseline and current medians,
+          their ratio and a regression flag; a case that failed but has a baseline is a regression.
+    """
+    def medians(results):
+        return {result['name']: result.get('median_s') for result in results}
+
+    current, previous = medians(report['results']), medians(baseline['results'])
+    rows = []
+    for name in current:
+        if name not in previous: continue
+        baseline_s, current_s = previous[name], current[name]
+        ratio = current_s / baseline_s if baseline_s and current_s is not None else None
+        rows.append({'name': name, 'baseline_s': baseline_s, 'current_s': current_s, 'ratio': ratio,
+                     'regression': (ratio is not None and ratio > 1 + tolerance) or
+                                   (current_s is None and baseline_s is not None)})
+    return pd.DataFrame(rows, columns=['name', 'baseline_s', 'current_s', 'ratio', 'regression'])
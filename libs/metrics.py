@@ -0,0 +1,375 @@
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import wraps
+from time import perf_counter
+from threading import Lock
+import inspect, json
+import os, sys
+import numpy as np
+import pandas as pd
+
+path = os.path.abspath(__file__)
+path = path[:path.find('/libs')]
+sys.path.insert(1, path)
+
+
+FIELDS = ('calls', 'seconds', 'max_seconds', 'rows_in', 'rows_out', 'bytes', 'errors')
+
+
+class Metrics:
+    """
+    Opt-in, per-stage instrumentation of the preprocessing, tokenization, SQLite and model stages.
+    -------
+
+    Each stage accumulates its wall time, calls, rows in and out and bytes produced (in-memory
+    size of its output: nbytes of arrays, deep memory usage of DataFrames, UTF-8 size of texts).
+    Stages may nest, e.g. 'tokenization.tokenizer' runs inside 'tokenization.encode_full', so
+    the time of a stage includes the time of the stages it calls.
+
+    Disabled, the instrumented functions only pay an attribute lookup per call, and nothing is
+    measured or computed. Metrics of worker processes are not collected, except the per-stage
+    time of the Pipeline, which is sent back with its statistics.
+
+    Configuration (environment variables):
+    -------
+    - AFFECTIVE_METRICS: '1' enables the collection from the start of the process.
+    - AFFECTIVE_PROFILE, AFFECTIVE_METRICS_PATH: See session(), used by the scripts.
+
+    Attributes:
+        - enabled (bool): If the stages are measured.
+        - stages (dict): The totals of each stage, keyed by name.
+
+    Example:
+
+        >>> metrics.enable()
+        >>> with metrics.stage('model.DCNN.predict', rows_in=len(input_ids)) as stage:
+        ...     stage.output(model.predict(input_ids))
+        >>> metrics.save('run')                      # run.json and run.prom
+        >>> with metrics.profile('run'):             # run.prof and run.memory.txt
+        ...     main()
+    """
+    def __init__(self, enabled=None) -> None:
+        if enabled is None:
+            enabled = _flag('AFFECTIVE_METRICS')
+        self.enabled = enabled
+        self.stages = {}
+        self._profilers = None
+        self._lock = Lock()
+
+
+    def enable(self, enabled=True) -> None:
+        self.enabled = enabled
+
+
+    def reset(self) -> None:
+        with self._lock:
+            self.stages = {}
+
+
+    def record(self, name, seconds, calls=1, rows_in=0, rows_out=0, bytes=0, errors=0) -> None:
+        """
+        Adds a measure to the totals of a stage. Thread-safe.
+        -------
+
+        Args:
+            - name (str): The stage, as '<component>.<operation>', e.g. 'sqlite.insert_many'.
+            - seconds (float): Wall time of the measure.
+            - calls (int): Calls covered by the measure. Only single-call measures update max_seconds,
+              since the slowest of several calls measured together is unknown.
+            - rows_in (int), rows_out (int): Rows (texts, songs, windows) received and produced.
+            - bytes (int): In-memory size of the output.
+            - errors (int): Calls that raised.
+        """
+        with self._lock:
+            totals = self.stages.get(name)
+            if totals is None:
+                totals = self.stages[name] = dict.fromkeys(FIELDS, 0)
+            totals['calls'] += calls
+            totals['seconds'] += seconds
+            if calls == 1: totals['max_seconds'] = max(totals['max_seconds'], seconds)
+            totals['rows_in'] += rows_in
+            totals['rows_out'] += rows_out
+            totals['bytes'] += bytes
+            totals['errors'] += errors
+
+
+    def stage(self, name, rows_in=0):
+        """
+        Returns a context manager measuring a block, or a shared no-op one when disabled.
+        Call its output(data) method with the result of the block to count the rows out and bytes.
+        """
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name, rows_in)
+
+
+    def timed(self, name, argument=None):
+        """
+        Decorator measuring every call of a function as a stage. The rows out and bytes are taken
+        from the returned value, and the rows in from the `argument` parameter, if given.
+        """
+        def decorator(function):
+            parameters = list(inspect.signature(function).parameters)
+            position = parameters.index(argument) if argument in parameters else None
+
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                data = args[position] if position is not None and position < len(args) else kwargs.get(argument)
+                with _Stage(self, name, count_rows(data) if argument else 0) as stage:
+                    result = function(*args, **kwargs)
+                    stage.output(result)
+                return result
+            return wrapper
+        return decorator
+
+
+    def snapshot(self) -> dict:
+        """
+        Returns a copy of the totals of each stage, with the throughput in rows per second.
+        """
+        with self._lock:
+            stages = {name: dict(totals) for name, totals in self.stages.items()}
+        for totals in stages.values():
+            rows = totals['rows_out'] or totals['rows_in']
+            totals['rows_per_s'] = rows / totals['seconds'] if rows and totals['seconds'] else None
+        return stages
+
+
+    def dataframe(self) -> pd.DataFrame:
+        """
+        Returns one row per stage, the slowest first.
+        """
+        frame = pd.DataFrame.from_dict(self.snapshot(), orient='index')
+        if frame.empty: return frame
+        return frame.rename_axis('stage').sort_values('seconds', ascending=False)
+
+
+    def to_json(self, file) -> dict:
+        report = {'timestamp': datetime.now(timezone.utc).isoformat(), 'pid': os.getpid(),
+                  'argv': sys.argv, 'stages': self.snapshot()}
+        _write(file, json.dumps(report, indent=2, ensure_ascii=False))
+        return report
+
+
+    def to_prometheus(self, file=None, prefix='affective') -> str:
+        """
+        Returns the totals in the Prometheus text exposition format and, if a file is given, writes
+        them atomically, e.g. to the directory of the node_exporter textfile collector.
+        """
+        series = [('calls', 'counter', 'Calls of the stage.'),
+                  ('seconds', 'counter', 'Wall time spent in the stage, in seconds.'),
+                  ('max_seconds', 'gauge', 'Slowest single call of the stage, in seconds; 0 if only measured in aggregate.'),
+                  ('rows_in', 'counter', 'Rows received by the stage.'),
+                  ('rows_out', 'counter', 'Rows produced by the stage.'),
+                  ('bytes', 'counter', 'Bytes produced by the stage.'),
+                  ('errors', 'counter', 'Calls of the stage that raised.')]
+        stages = self.snapshot()
+        lines = []
+        for field, kind, description in series:
+            metric = f"{prefix}_stage_{field}" + ("_total" if kind == 'counter' else "")
+            lines += [f"# HELP {metric} {description}", f"# TYPE {metric} {kind}"]
+            for name, totals in sorted(stages.items()):
+                label = name.replace('\\', '\\\\').replace('"', '\\"')
+                lines.append(f'{metric}{{stage="{label}"}} {float(totals[field]):.9g}')
+        text = "\n".join(lines) + "\n"
+        if file is not None:
+            _write(file, text)
+        return text
+
+
+    def save(self, prefix) -> None:
+        """
+        Writes the totals to <prefix>.json and <prefix>.prom.
+        """
+        self.to_json(prefix + '.json')
+        self.to_prometheus(prefix + '.prom')
+
+
+    @contextmanager
+    def profile(self, prefix, top=30):
+        """
+        Captures a single run with cProfile and tracemalloc, and enables the stage metrics meanwhile.
+        -------
+
+        Writes <prefix>.prof (open with pstats or snakeviz) and <prefix>.memory.txt, with the peak
+        traced memory and the lines that allocated the most memory still alive at the end.
+        cProfile only follows the thread that entered the block; wrap thread targets with
+        profiled() to include them.
+
+        Args:
+            - prefix (str): Path of the output files, without extension.
+            - top (int): Allocation sites listed in the memory report.
+        """
+        import cProfile, pstats, tracemalloc
+        enabled = self.enabled
+        self.enabled, self._profilers = True, []
+        tracemalloc.start()
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield self
+        finally:
+            profiler.disable()
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            profilers, self._profilers, self.enabled = self._profilers, None, enabled
+
+            stats = pstats.Stats(profiler)
+            for thread_profiler in profilers:
+                stats.add(thread_profiler)
+            os.makedirs(os.path.dirname(os.path.abspath(prefix)), exist_ok=True)
+            stats.dump_stats(prefix + '.prof')
+
+            lines = [f"Peak traced memory: {peak / 2**20:.1f} MiB", f"Traced memory at the end: {current / 2**20:.1f} MiB", ""]
+            lines += [str(statistic) for statistic in snapshot.statistics('lineno')[:top]]
+            _write(prefix + '.memory.txt', "\n".join(lines) + "\n")
+            print(f"PROFILE: {prefix}.prof, {prefix}.memory.txt (peak {peak / 2**20:.1f} MiB)")
+
+
+    @contextmanager
+    def session(self, name):
+        """
+        Instruments a whole script run, as configured by the environment, and writes the results at the end.
+        -------
+
+        Configuration (environment variables):
+        -------
+        - AFFECTIVE_METRICS: '1' records the stages and writes <prefix>.json and <prefix>.prom.
+        - AFFECTIVE_PROFILE: '1' also captures the run with profile(), writing <prefix>.prof and
+          <prefix>.memory.txt.
+        - AFFECTIVE_METRICS_PATH: The prefix of the files. Default is '<repository>/metrics/<name>'.
+
+        Args:
+            - name (str): The name of the script.
+
+        Example:
+
+            >>> if __name__ == "__main__":
+            ...     with metrics.session('model_run'): main()
+        """
+        profile = _flag('AFFECTIVE_PROFILE')
+        if not (self.enabled or profile):
+            yield self
+            return
+        prefix = os.environ.get('AFFECTIVE_METRICS_PATH') or os.path.join(path, 'metrics', name)
+        self.enabled = True
+        try:
+            if profile:
+                with self.profile(prefix):
+                    yield self
+            else:
+                yield self
+        finally:
+            self.save(prefix)
+            if self.stages:
+                print(self.dataframe().to_string())
+            print(f"METRICS: {prefix}.json, {prefix}.prom")
+
+
+    def profiled(self, function):
+        """
+        Wraps a thread target so it is followed by cProfile when it starts inside profile().
+        """
+        import cProfile
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            profilers = self._profilers
+            if profilers is None:
+                return function(*args, **kwargs)
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                profiler.disable()
+                with self._lock:
+                    profilers.append(profiler)
+        return wrapper
+
+
+class _Stage:
+    __slots__ = ('metrics', 'name', 'rows_in', 'rows_out', 'bytes', 'start')
+
+    def __init__(self, metrics, name, rows_in=0) -> None:
+        self.metrics = metrics
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = 0
+        self.bytes = 0
+
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.metrics.record(self.name, perf_counter() - self.start, 1, self.rows_in, self.rows_out,
+                            self.bytes, int(exc_type is not None))
+
+
+    def output(self, data=None, rows=None) -> None:
+        self.rows_out += count_rows(data) if rows is None else rows
+        self.bytes += size_of(data)
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        pass
+
+    def output(self, data=None, rows=None) -> None:
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+def count_rows(data) -> int:
+    """
+    Rows of a result: its length, the length of the first item of a tuple (e.g. input_ids and
+    attention_mask), or the value of an int (e.g. the rows written by insert_many).
+    """
+    if data is None: return 0
+    if isinstance(data, tuple): return count_rows(data[0]) if data else 0
+    if isinstance(data, (int, np.integer)): return int(data)
+    if isinstance(data, str): return 1
+    return len(data) if hasattr(data, '__len__') else 1
+
+
+def size_of(data) -> int:
+    """
+    In-memory size of a result in bytes; 0 for types without a meaningful size.
+    """
+    if isinstance(data, np.ndarray): return int(data.nbytes)
+    if isinstance(data, (pd.DataFrame, pd.Series)):
+        usage = data.memory_usage(index=False, deep=True)
+        return int(usage.sum() if isinstance(data, pd.DataFrame) else usage)
+    if isinstance(data, str): return len(data.encode('utf-8'))
+    if isinstance(data, bytes): return len(data)
+    if isinstance(data, (list, tuple)): return sum(size_of(item) for item in data)
+    if isinstance(data, dict): return sum(size_of(item) for item in data.values())
+    return 0
+
+
+def _flag(name) -> bool:
+    return os.environ.get(name, '0').lower() in ('1', 'true', 'yes')
+
+
+def _write(file, text) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(file)), exist_ok=True)
+    temporary = f"{file}.{os.getpid()}.tmp"
+    with open(temporary, 'w') as output:
+        output.write(text)
+    os.replace(temporary, file)
+
+
+metrics = Metrics()
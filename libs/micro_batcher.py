@@ -0,0 +1,144 @@
+from concurrent.futures import Future
+from queue import Queue, Empty, Full
+from threading import Thread, Lock
+from collections import deque
+from time import monotonic
+import os, sys
+import numpy as np
+
+path = os.path.abspath(__file__)
+path = path[:path.find('/libs')]
+sys.path.insert(1, path)
+
+
+class MicroBatcher:
+    """
+    Groups concurrent requests into micro-batches processed by a single worker thread.
+    -------
+
+    Each call to submit queues one item and returns a Future. The worker takes the first waiting
+    item, keeps collecting items until max_batch_size is reached or max_wait seconds have passed
+    since the first one, and calls `function` once with the whole batch. Under light load a request
+    waits at most max_wait; under heavy load batches fill up and throughput grows with the batch size.
+    The queue is bounded, so an overloaded batcher rejects requests instead of growing its latency.
+    If `function` raises, or returns a different number of results than items, every item of the
+    batch still waiting gets the error and the worker goes on with the next batch.
+
+    Attributes:
+        - function (callable): Receives a list of items and returns a list of results in the same order.
+        - max_batch_size (int): Maximum number of items per batch.
+        - max_wait (float): Maximum seconds the first item of a batch waits for more items.
+        - batches (int): Number of batches processed.
+        - items (int): Number of items processed.
+
+    Example:
+
+        >>> with MicroBatcher(score_texts, max_batch_size=32, max_wait=0.005) as batcher:
+        ...     emotions = batcher.submit(txt).result(timeout=5)
+        ...     batcher.latency()
+    """
+    def __init__(self, function, max_batch_size=32, max_wait=0.005, max_queue=1024, window=10000) -> None:
+        self.function = function
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batches = 0
+        self.items = 0
+        self._queue = Queue(maxsize=max_queue)
+        self._latencies = deque(maxlen=window)
+        self._lock = Lock()
+        self._worker = Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._worker.start()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+    def submit(self, item, timeout=None) -> Future:
+        """
+        Queues an item for the next batch.
+        -------
+
+        Args:
+            - item: The item passed to function inside a batch.
+            - timeout (float): Seconds to wait for room in the queue; None waits forever.
+
+        Returns:
+            - concurrent.futures.Future: Resolves to the result of the item.
+
+        Raises:
+            - queue.Full: If the queue is still full after timeout.
+        """
+        future = Future()
+        self._queue.put((item, future, monotonic()), timeout=timeout)
+        return future
+
+
+    def _collect(self) -> list|bool:
+        first = self._queue.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        deadline = monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - monotonic()
+            try:
+                entry = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except Empty:
+                break
+            if entry is None:
+                return batch, True
+            batch.append(entry)
+        return batch, False
+
+
+    def _run(self) -> None:
+        closed = False
+        while not closed:
+            batch, closed = self._collect()
+            if not batch: continue
+            items, futures, submitted = zip(*batch)
+            try:
+                results = list(self.function(list(items)))
+                if len(results) != len(items):
+                    raise ValueError(f"function returned {len(results)} results for a batch of {len(items)} items")
+                for future, result in zip(futures, results):
+                    if not future.done(): future.set_result(result)
+            except Exception as error:
+                for future in futures:
+                    if not future.done(): future.set_exception(error)
+            now = monotonic()
+            with self._lock:
+                self.batches += 1
+                self.items += len(batch)
+                self._latencies.extend(now - start for start in submitted)
+
+
+    def latency(self) -> dict:
+        """
+        Summarizes the latency, from submit to result, of the most recent items.
+        -------
+
+        Returns:
+            - dict: Items, batches, mean batch size and p50/p95/p99/max latency in milliseconds.
+        """
+        with self._lock:
+            latencies = np.array(self._latencies, dtype=np.float64) * 1000
+            summary = {'items': self.items, 'batches': self.batches,
+                       'mean_batch_size': self.items / self.batches if self.batches else 0.0}
+        for name, q in (('p50_ms', 50), ('p95_ms', 95), ('p99_ms', 99), ('max_ms', 100)):
+            summary[name] = float(np.percentile(latencies, q)) if len(latencies) else 0.0
+        return summary
+
+
+    def close(self) -> None:
+        """
+        Stops the worker after the items already queued are processed.
+        """
+        if self._worker.is_alive():
+            self._queue.put(None)
+            self._worker.join()
@@ -0,0 +1,182 @@
+import os, sys
+import numpy as np
+
+path = os.path.abspath(__file__)
+path = path[:path.find('/libs')]
+sys.path.insert(1, path)
+from libs.prediction_cache import PredictionCache
+from libs.metrics import metrics
+
+
+class RegisteredModel:
+    """
+    A trained model of the model/ directory, with the features it expects.
+    -------
+
+    Features:
+    -------
+    - 'token_ids': int32 matrix of token ids padded (and truncated) to max_length. With a windows
+      configuration, Keras models score whole texts in packed windows instead.
+    - 'token_text': The untruncated token ids joined by spaces, as fed to the Naive Bayes vectorizer.
+
+    Attributes:
+        - name (str): The model_name of its results.
+        - file (str): File name in the model/ directory, saved with joblib.dump.
+        - kind (str): 'keras' (predict returns the emotion probabilities) or 'sklearn' (predict_proba).
+        - feature (str): The feature the model is fed with.
+        - max_length (int): The width of the 'token_ids' feature.
+        - windowed (bool): If the model accepts variable-length inputs and can score windows.
+
+    Example:
+
+        >>> spec = MODEL_REGISTRY['LSTM']
+        >>> model = spec.load()
+        >>> features = build_features(pp, ids, [spec.feature_key()])
+        >>> predicts = spec.predict(model, features[spec.feature_key()], n_emotions=28)
+    """
+    def __init__(self, name, file, kind='keras', feature='token_ids', max_length=64, windowed=False) -> None:
+        self.name = name
+        self.file = file
+        self.kind = kind
+        self.feature = feature
+        self.max_length = max_length
+        self.windowed = windowed
+
+
+    @property
+    def model_path(self) -> str:
+        return os.path.join(path, 'model', self.file)
+
+
+    def load(self):
+        from joblib import load
+        with metrics.stage(f"model.{self.name}.load"):
+            return load(self.model_path)
+
+
+    def fingerprint(self) -> str:
+        return PredictionCache.file_hash(self.model_path)
+
+
+    def feature_key(self, windows=None) -> tuple:
+        """
+        Returns the key of the features of the model, shared by every model with the same key.
+        """
+        if self.feature == 'token_text':
+            return ('token_text',)
+        if windows is not None and self.windowed:
+            return ('windows', windows['window'], windows['stride'], windows['batch_size'], windows['min_width'])
+        return ('token_ids', self.max_length)
+
+
+    def config(self) -> dict:
+        return {'name': self.name, 'kind': self.kind, 'feature': self.feature, 'max_length': self.max_length}
+
+
+    def predict(self, model, features, n_emotions, batch_size=32, aggregation='mean') -> np.ndarray:
+        """
+        Predicts the (texts, emotions) probability matrix of a chunk of texts.
+        -------
+
+        Args:
+            - model: The loaded model.
+            - features: The features of feature_key, from build_features.
+            - n_emotions (int): Number of emotions; sklearn classes missing from the model get 0.
+            - batch_size (int): Batch size of Keras predict.
+            - aggregation (str): How window predictions are merged per text: 'mean', 'max' or 'weighted'.
+
+        Returns:
+            - np.ndarray: The float64 prediction matrix.
+        """
+        rows = features.n_texts if isinstance(features, WindowBatches) else len(features)
+        with metrics.stage(f"model.{self.name}.predict", rows) as stage:
+            predicts = self._predict(model, features, n_emotions, batch_size, aggregation)
+            stage.output(predicts)
+        return predicts
+
+
+    def _predict(self, model, features, n_emotions, batch_size, aggregation) -> np.ndarray:
+        if isinstance(features, WindowBatches):
+            return predict_windows(model, features.batches, features.n_texts, aggregation)
+        if self.kind == 'keras':
+            return np.asarray(model.predict(features, batch_size=batch_size, verbose=0), dtype=np.float64)
+
+        width = getattr(model, 'n_features_in_', None)
+        if self.feature == 'token_ids' and width and width != features.shape[1]:
+            features = np.pad(features[:, :width], ((0, 0), (0, max(0, width - features.shape[1]))))
+        probabilities = np.asarray(model.predict_proba(features), dtype=np.float64)
+        predicts = np.zeros((len(probabilities), n_emotions), dtype=np.float64)
+        predicts[:, np.asarray(model.classes_, dtype=int)] = probabilities
+        return predicts
+
+
+class WindowBatches:
+    """
+    Packed window batches of a chunk of texts, from PreProcessing.pack_windows.
+    """
+    def __init__(self, batches, n_texts) -> None:
+        self.batches = batches
+        self.n_texts = n_texts
+
+
+MODEL_REGISTRY = {spec.name: spec for spec in [
+    RegisteredModel('DCNN', 'DCNN.keras', 'keras', 'token_ids', max_length=512, windowed=True),
+    RegisteredModel('LSTM', 'LSTM.keras', 'keras', 'token_ids', max_length=64),
+    RegisteredModel('KNN', 'KNN.keras', 'sklearn', 'token_ids', max_length=64),
+    RegisteredModel('Random_Forest', 'Random_Forest.keras', 'sklearn', 'token_ids', max_length=64),
+    RegisteredModel('Naive_Bayes', 'Naive_Bayes.keras', 'sklearn', 'token_text'),
+]}
+
+
+def build_features(pp, input_ids, keys) -> dict:
+    """
+    Builds every feature a set of models needs from a single untruncated tokenization.
+    -------
+
+    Args:
+        - pp (PreProcessing): Instance used to pad and pack the token ids.
+        - input_ids (list): Untruncated token ids of each text, from PreProcessing.encode_full.
+        - keys (iterable): Feature keys, from RegisteredModel.feature_key.
+
+    Returns:
+        - dict: The features of each key.
+    """
+    features = {}
+    for key in set(keys):
+        if key[0] == 'token_text':
+            features[key] = [" ".join(map(str, ids.tolist())) for ids in input_ids]
+        elif key[0] == 'windows':
+            _, window, stride, batch_size, min_width = key
+            features[key] = WindowBatches(list(pp.pack_windows(input_ids, window, stride, batch_size, min_width)),
+                                          len(input_ids))
+        else:
+            features[key] = pp.pad_ids(input_ids, key[1])
+    return features
+
+
+def predict_windows(model, batches, n_texts, aggregation='mean') -> np.ndarray:
+    """
+    Predicts the packed window batches of PreProcessing.pack_windows and aggregates them into one emotion
+    vector per text.
+
+    Parameters:
+    - model: The Keras model.
+    - batches (list): The (text_indices, lengths, input_ids) batches.
+    - n_texts (int): Number of texts of the chunk.
+    - aggregation (str): 'mean', 'max' or 'weighted' (mean weighted by the number of tokens of each window).
+
+    Returns:
+    - np.ndarray: The (texts, emotions) prediction matrix.
+    """
+    totals, weights = None, np.zeros(n_texts, dtype=np.float64)
+    for text_indices, lengths, input_ids in batches:
+        predicts = np.asarray(model.predict(input_ids, batch_size=len(input_ids), verbose=0), dtype=np.float64)
+        if totals is None:
+            totals = np.full((n_texts, predicts.shape[1]), -np.inf if aggregation == 'max' else 0.0)
+        if aggregation == 'max':
+            np.maximum.at(totals, text_indices, predicts)
+            continue
+        weight = lengths.astype(np.float64) if aggregation == 'weighted' else np.ones(len(lengths))
+        np.add.at(totals, text_indices, predicts * weight[:, None])
+        np.add.at(weights, text_indices, weight)
+    return totals if aggregation == 'max' else totals / weights[:, None]
@@ -0,0 +1,352 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import multiprocessing
+from collections import deque
+from time import perf_counter
+import os, sys
+import pandas as pd
+
+path = os.path.abspath(__file__)
+path = path[:path.find('/libs')]
+sys.path.insert(1, path)
+from libs.pre_processing import PreProcessing
+from libs.resources import resources
+from libs.metrics import metrics
+
+
+DEFAULT_STAGES = ['dropnan_and_lowercase', 'change_abbreviations', ('drop_size', {'n_size': 3}),
+                  'apply_regex', 'remove_stopwords']
+
+# Lyrics are stored with '|' between the lines.
+LYRICS_STAGES = [('replace', {'old': '|', 'new': ' '})] + DEFAULT_STAGES
+
+
+class Pipeline:
+    """
+    Declarative preprocessing pipeline that compiles the selected PreProcessing stages
+    into a single per-text function.
+    -------
+
+    Each text goes through every stage once, in order, and the DataFrame is only rebuilt
+    at the end. The result is the same as chaining the PreProcessing *_dataframe methods.
+    With n_jobs > 1 the texts are split in chunks and processed by a pool of worker processes,
+    each one compiling the stages once; results keep the original order. The workers are started
+    with forkserver (spawn where it is not available), never forked from a threaded parent, and
+    start() keeps one pool for every following run instead of one pool per call.
+
+    Stages:
+    -------
+    - 'replace' (old, new): Replaces a substring, e.g. the '|' line separator of the lyrics.
+    - 'dropnan_and_lowercase': Drops NaN texts and converts to lowercase.
+    - 'change_abbreviations': Replaces abbreviations.
+    - 'drop_size' (n_size): Drops texts with less than n_size tokens.
+    - 'apply_regex': Applies the regular expressions of PreProcessing.values_regex.
+    - 'remove_stopwords': Removes Portuguese stopwords.
+
+    Attributes:
+    -------
+    - pre_processing (PreProcessing): Instance providing abbreviations and regular expressions.
+    - stages (list): Stage names or (name, kwargs) tuples, in execution order.
+    - stats (list): Rows in, rows out and rows dropped of each stage in the last run, and its
+      seconds when libs.metrics is enabled (summed over the worker processes with n_jobs > 1).
+
+    Example:
+
+        >>> pipeline = Pipeline(DEFAULT_STAGES)
+        >>> dataframe = pipeline.run(dataframe, column='text_name')
+        >>> pd.DataFrame(pipeline.stats)
+        >>> dataframe = pipeline.run(dataframe, column='text_name', n_jobs=8)
+        >>> with pipeline.start(n_jobs=8):
+        ...     for chunk in chunks: chunk = pipeline.run(chunk, column='lyrics')
+    """
+    def __init__(self, stages=DEFAULT_STAGES, pre_processing=None) -> None:
+        self.pre_processing = pre_processing if pre_processing is not None else PreProcessing()
+        self.stages = [(stage, {}) if isinstance(stage, str) else stage for stage in stages]
+        self.stats = []
+        self._functions = self._compile()
+        self._executor = None
+        self._n_jobs = 1
+        self.reset_stats()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+    def start(self, n_jobs=None):
+        """
+        Starts a pool of worker processes used by every following run and imap until close, so
+        processing many chunks pays the start of the workers once. While it is open the n_jobs
+        of run and imap are ignored.
+
+        Parameters:
+        - n_jobs (int): Number of worker processes; 1 keeps running in the current process and None uses every core.
+
+        Returns:
+        - Pipeline: This pipeline, to be used in a with block.
+        """
+        self.close()
+        n_jobs = n_jobs or os.cpu_count()
+        if n_jobs > 1:
+            self._executor = self._new_executor(n_jobs)
+            self._n_jobs = n_jobs
+        return self
+
+
+    def close(self) -> None:
+        """
+        Shuts down the worker processes started by start, if any.
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+            self._n_jobs = 1
+
+
+    def _new_executor(self, n_jobs) -> ProcessPoolExecutor:
+        pre_processing = self.pre_processing
+        initargs = (self.stages, pre_processing.abbreviations, pre_processing.values_regex, metrics.enabled)
+        return ProcessPoolExecutor(n_jobs, mp_context=_mp_context(), initializer=_init_worker, initargs=initargs)
+
+
+    def _compile(self) -> list:
+        """
+        Builds the function of each stage, skipping the lowercase calls once the text is known to be lowercase.
+
+        Returns:
+        - list: The (name, function) pairs. Each function returns the new text, or None to drop it.
+        """
+        functions = []
+        lowered = False
+        for name, kwargs in self.stages:
+            factory = getattr(self, f'_stage_{name}', None)
+            if factory is None:
+                raise ValueError(f"Unknown stage: {name}")
+            functions.append((name, factory(lowered, **kwargs)))
+            lowered = lowered or name in ('dropnan_and_lowercase', 'change_abbreviations', 'apply_regex')
+        return functions
+
+
+    def _stage_replace(self, lowered, old, new):
+        def replace(txt):
+            return txt.replace(old, new) if type(txt) == str else txt
+        return replace
+
+
+    def _stage_dropnan_and_lowercase(self, lowered):
+        def dropnan_and_lowercase(txt):
+            if type(txt) == float: return None
+            txt = txt.lower()
+            return None if txt == 'nan' else txt
+        return dropnan_and_lowercase
+
+
+    def _stage_change_abbreviations(self, lowered):
+        regex = self.pre_processing.abbreviations_regex
+        lookup = self.pre_processing.abbreviations_lookup
+        replacement = lambda match: lookup[match.group(0)]
+        def change_abbreviations(txt):
+            txt = txt.replace("  ", ' ')
+            if not lowered: txt = txt.lower()
+            return regex.sub(replacement, txt).replace("  ", ' ').strip()
+        return change_abbreviations
+
+
+    def _stage_drop_size(self, lowered, n_size):
+        punctuation = resources.regex(r'[^\w\s]')
+        def drop_size(txt):
+            if type(txt) == float: return txt
+            list_token = punctuation.sub(' ', txt).replace("  ", ' ').split(' ')
+            if '' in list_token: list_token.remove('')
+            return None if len(list_token) < n_size else txt
+        return drop_size
+
+
+    def _stage_apply_regex(self, lowered):
+        regexes = [(resources.regex(key), values) for key, values in self.pre_processing.values_regex.items()]
+        def apply_regex(txt):
+            if not lowered: txt = txt.lower()
+            for key, values in regexes:
+                txt = key.sub(values, txt)
+            return txt
+        return apply_regex
+
+
+    def _stage_remove_stopwords(self, lowered):
+        stopwords_pt = resources.stopwords('portuguese')
+        def remove_stopwords(txt):
+            return " ".join([token for token in txt.split() if token.lower() not in stopwords_pt])
+        return remove_stopwords
+
+
+    def reset_stats(self) -> None:
+        """
+        Clears the statistics of the previous run.
+        """
+        self.stats = [{'stage': name, 'rows_in': 0, 'rows_out': 0, 'rows_dropped': 0, 'seconds': 0.0}
+                      for name, _ in self._functions]
+        self.seconds = 0.0
+
+
+    def process(self, txt) -> str|None:
+        """
+        Runs every stage over a single text, updating the statistics.
+
+        Parameters:
+        - txt (str): The text to be processed.
+
+        Returns:
+        - str: The processed text, or None if a stage dropped it.
+        """
+        if metrics.enabled:
+            return self._process_timed(txt)
+        stats = self.stats
+        for index, (_, function) in enumerate(self._functions):
+            stats[index]['rows_in'] += 1
+            txt = function(txt)
+            if txt is None:
+                stats[index]['rows_dropped'] += 1
+                return None
+            stats[index]['rows_out'] += 1
+        return txt
+
+
+    def _process_timed(self, txt) -> str|None:
+        """
+        Same as process, also adding the time of each stage to its statistics.
+        """
+        stats = self.stats
+        for index, (_, function) in enumerate(self._functions):
+            stats[index]['rows_in'] += 1
+            start = perf_counter()
+            txt = function(txt)
+            stats[index]['seconds'] += perf_counter() - start
+            if txt is None:
+                stats[index]['rows_dropped'] += 1
+                return None
+            stats[index]['rows_out'] += 1
+        return txt
+
+
+    def imap(self, texts, n_jobs=1, chunk_size=2000):
+        """
+        Lazily runs the pipeline over an iterable of texts, in the original order.
+
+        Parameters:
+        - texts (iterable): The texts to be processed.
+        - n_jobs (int): Number of worker processes; 1 runs in the current process and None uses every core.
+          Ignored while the pool of start is open.
+        - chunk_size (int): Number of texts sent to a worker at a time.
+
+        Returns:
+        - generator: The processed text, or None if a stage dropped it, for each input text.
+        """
+        if self._executor is not None:
+            yield from self._imap_executor(self._executor, texts, self._n_jobs, chunk_size)
+            return
+        n_jobs = n_jobs or os.cpu_count()
+        if n_jobs == 1:
+            yield from map(self.process, texts)
+            return
+        with self._new_executor(n_jobs) as executor:
+            yield from self._imap_executor(executor, texts, n_jobs, chunk_size)
+
+
+    def _imap_executor(self, executor, texts, n_jobs, chunk_size):
+        """
+        Sends the texts to the workers of an executor in chunks, keeping at most 2 * n_jobs chunks in flight.
+        """
+        texts = iter(texts)
+        pending = deque()
+        while True:
+            chunk = list(islice(texts, chunk_size))
+            if chunk:
+                pending.append(executor.submit(_process_chunk, chunk))
+            if pending and (len(pending) >= 2 * n_jobs or not chunk):
+                processed, stats = pending.popleft().result()
+                self._merge_stats(stats)
+                yield from processed
+            elif not chunk:
+                break
+
+
+    def _merge_stats(self, stats) -> None:
+        for total, partial in zip(self.stats, stats):
+            for key in ('rows_in', 'rows_out', 'rows_dropped', 'seconds'):
+                total[key] += partial[key]
+
+
+    @metrics.timed('pipeline.run', 'dataframe')
+    def run(self, dataframe, column, n_jobs=1, chunk_size=2000) -> pd.DataFrame:
+        """
+        Runs the pipeline over a DataFrame column in a single traversal. With libs.metrics enabled,
+        each stage is also recorded as a 'pipeline.<stage>' stage, with one call per text.
+
+        Parameters:
+        - dataframe (pd.DataFrame): The DataFrame to be processed.
+        - column (str): The name of the column to be processed.
+        - n_jobs (int): Number of worker processes; 1 runs in the current process and None uses every core.
+          Ignored while the pool of start is open.
+        - chunk_size (int): Number of texts sent to a worker at a time.
+
+        Returns:
+        - pd.DataFrame: The rows kept by every stage, with the processed column and a new index.
+        """
+        try:
+            self.reset_stats()
+            start = perf_counter()
+            texts = list(self.imap(dataframe[column].tolist(), n_jobs, chunk_size))
+            keep = [txt is not None for txt in texts]
+
+            dataframe = dataframe.loc[keep].reset_index(drop=True)
+            dataframe[column] = [txt for txt in texts if txt is not None]
+            self.seconds = perf_counter() - start
+            if metrics.enabled:
+                for stats in self.stats:
+                    metrics.record(f"pipeline.{stats['stage']}", stats['seconds'], stats['rows_in'],
+                                   stats['rows_in'], stats['rows_out'])
+            return dataframe
+        except Exception as error:
+            print(error)
+
+
+_worker_pipeline = None
+
+
+def _mp_context():
+    """
+    Returns the forkserver start method where available, otherwise spawn: forking a process that runs
+    other threads (e.g. the producer of scripts/model_run.py) can copy locks held by them.
+    """
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(method)
+
+
+def _init_worker(stages, abbreviations, values_regex, timed=False) -> None:
+    """
+    Builds the pipeline of a worker process once, with the same abbreviations and regular expressions as the parent,
+    timing the stages if the metrics of the parent are enabled.
+    """
+    global _worker_pipeline
+    metrics.enable(timed)
+    pre_processing = PreProcessing()
+    pre_processing.abbreviations = abbreviations
+    pre_processing.values_regex = values_regex
+    pre_processing.abbreviations_regex, pre_processing.abbreviations_lookup = \
+        pre_processing._compile_abbreviations(abbreviations)
+    _worker_pipeline = Pipeline(stages, pre_processing=pre_processing)
+
+
+def _process_chunk(texts) -> tuple:
+    """
+    Processes a chunk of texts in a worker process.
+
+    Returns:
+    - tuple: The processed texts and the statistics of the chunk.
+    """
+    _worker_pipeline.reset_stats()
+    return [_worker_pipeline.process(txt) for txt in texts], _worker_pipeline.stats
@@ -1,13 +1,14 @@
-from transformers import AutoTokenizer
-from nltk.corpus import stopwords
-import re, os, sys, nltk
+import re, os, sys
+import hashlib, json
 from os import environ
 import pandas as pd
+import numpy as np
 
 path = os.path.abspath(__file__)
 path = path[:path.find('/libs')]
 sys.path.insert(1, path)
-nltk.download('stopwords')
+from libs.resources import resources
+from libs.metrics import metrics
 
 class PreProcessing:
     """
@@ -24,24 +25,37 @@ class PreProcessing:
     
     Attributes:
     -------
+    - tokenizer_name (str): Name of the pretrained tokenizer.
+    - tokenizer (transformers.PreTrainedTokenizerBase): Tokenizer, loaded on first use through libs.resources.
+    - token_cache (libs.token_cache.TokenCache): Optional persistent cache consulted before tokenizing.
     - abbreviations (dict): Dictionary of abbreviations to be replaced.
+    - abbreviations_regex (re.Pattern): Single precompiled matcher for every abbreviation.
+    - abbreviations_lookup (dict): Replacement of each abbreviation matched by abbreviations_regex.
     - values_regex (dict): Dictionary of regular expressions to be applied.
 
     Public Methods:
     -------
     - change_abbreviations_sentence(txt): Replaces abbreviations in a single sentence.
-    - change_abbreviations_dataframe(data, column): Replaces abbreviations in a DataFrame column.
+    - change_abbreviations_dataframe(data, column, columnar): Replaces abbreviations in a DataFrame column.
     - apply_regex_sentence(txt): Applies regular expressions to a single sentence.
-    - apply_regex_dataframe(dataframe, column): Applies regular expressions to a DataFrame column.
-    - drop_size(dataframe, column, n_size): Removes rows where the number of tokens is less than n_size.
-    - dropnan_and_lowercase(dataframe, column): Removes rows with NaN values and converts to lowercase.
-    - set_category(dataframe, column): Converts values in a column to categories.
-
+    - apply_regex_dataframe(dataframe, column, columnar): Applies regular expressions to a DataFrame column.
+    - drop_size(dataframe, column, n_size, columnar): Removes rows where the number of tokens is less than n_size.
+    - dropnan_and_lowercase(dataframe, column, columnar): Removes rows with NaN values and converts to lowercase.
+    - set_category(dataframe, column, multi_hot): Converts values in a column to (multi-label) categories.
+    - tokenize_batch(texts, max_length, padding): Tokenizes many texts into a single int32 matrix.
+    - iter_token_batches(texts, max_length, batch_size): Tokenizes texts in length-bucketed batches.
+    - iter_window_batches(texts, window, stride, batch_size): Splits whole texts into token windows
+      packed in length-sorted batches.
+
+    The *_dataframe methods run row by row by default; with columnar=True they use vectorized
+    Series.str operations and boolean masks instead, producing the same result.
+
+    With libs.metrics enabled, the *_dataframe methods and the tokenization are recorded as
+    'preprocessing.*' and 'tokenization.*' stages.
     """
-    def __init__(self) -> None:
-        path = 'neuralmind/bert-base-portuguese-cased'
-        self.tokenizer = AutoTokenizer.from_pretrained(path)
-
+    def __init__(self, tokenizer_name='neuralmind/bert-base-portuguese-cased', token_cache=None) -> None:
+        self.tokenizer_name = tokenizer_name
+        self.token_cache = token_cache
 
         self.abbreviations = {'ngm': 'Ninguém', 'sdds': 'saudades', 'sdd': 'saudade', 'tao': 'tão', 
                  'td': 'tudo', 'qd': 'quando', 'flw': 'falou', 'nte': 'noite', 'mds': 'meu deus',
@@ -54,9 +68,9 @@ class PreProcessing:
                  'aff': 'irritação', 'ai': 'ai', 'mt': 'muito', 'mto': 'muito', 'hj': 'hoje', 'eh': 'é',
                  'ufa': 'alívio', 'dps': 'depois', 'qnd': 'quando', 'lt': 'luto', 'mlk': 'menino', 'la': 'lá', 
                  'serio': 'sério', 'tb': 'tudo bem', 'dms': 'demais', 'cm': 'com', 'vdd': 'verdade', 'dnv': 'de novo'}
-        
+        self.abbreviations_regex, self.abbreviations_lookup = self._compile_abbreviations(self.abbreviations)
 
-        emoji_pattern = re.compile("["
+        emoji_pattern = resources.regex("["
                                     u"\U0001F600-\U0001F64F"
                                     u"\U0001F300-\U0001F5FF"
                                     u"\U0001F680-\U0001F6FF"
@@ -69,9 +83,47 @@ class PreProcessing:
                                     u"\U00002702-\U000027B0"
                                     u"\U000024C2-\U0001F251" 
                                     "]+", flags=re.UNICODE)
-        self.values_regex = {emoji_pattern: "", r'#\S+': "", 
-                            r'@\S+': "", r'[^\w\s,.:;?!-]': "",
-                            r'\b[k]{2,}\b': "risada"}
+        self.values_regex = {emoji_pattern: "", resources.regex(r'#\S+'): "", 
+                            resources.regex(r'@\S+'): "", resources.regex(r'[^\w\s,.:;?!-]'): "",
+                            resources.regex(r'\b[k]{2,}\b'): "risada"}
+
+
+    @property
+    def tokenizer(self):
+        return resources.tokenizer(self.tokenizer_name)
+
+
+    def tokenizer_version(self) -> dict:
+        """
+        Identifies the tokenizer beyond its name, e.g. for cache keys: the transformers version and the
+        hash of the vocabulary, which changes with the revision of the pretrained model.
+
+        Returns:
+        dict: The name, the transformers version and the vocabulary hash of the tokenizer.
+        """
+        import transformers
+        vocab = json.dumps(sorted(self.tokenizer.get_vocab().items()), ensure_ascii=False)
+        return {'name': self.tokenizer_name, 'transformers': transformers.__version__,
+                'vocab': hashlib.sha256(vocab.encode('utf-8')).hexdigest()}
+
+
+    def _compile_abbreviations(self, abbreviations) -> re.Pattern|dict:
+        """
+        Builds a single matcher for every abbreviation.
+
+        Parameters:
+        - abbreviations (dict): Dictionary of abbreviations to be replaced.
+
+        Returns:
+        - tuple: The compiled alternation of all keys (longest first) and the lookup table
+          with the lowercased replacement of each key.
+        """
+        keys = sorted(abbreviations, key=len, reverse=True)
+        pattern = resources.regex(r"\b(?:" + "|".join(re.escape(key) for key in keys) + r")\b")
+        lookup = {key.lower(): values.lower() for key, values in abbreviations.items()}
+        return pattern, lookup
+
+
     def decode_ids(self, token_ids):
         tokenizer = self.tokenizer
         return tokenizer.convert_ids_to_tokens(token_ids, skip_special_tokens=True)
@@ -86,28 +138,35 @@ class PreProcessing:
         Returns:
         - str: The sentence after abbreviation substitution.
         """
-        abbreviations = self.abbreviations
+        lookup = self.abbreviations_lookup
         try:
-            txt = txt.replace("  ", ' ')
-            for key, values in abbreviations.items():
-                txt = re.sub(fr"\b{key}\b", values, txt.lower())
+            txt = txt.replace("  ", ' ').lower()
+            txt = self.abbreviations_regex.sub(lambda match: lookup[match.group(0)], txt)
             return txt.replace("  ", ' ').strip()
         except Exception as error:
             print(error)
     
 
-    def change_abbreviations_dataframe(self, data, column) -> pd.DataFrame:
+    @metrics.timed('preprocessing.change_abbreviations', 'data')
+    def change_abbreviations_dataframe(self, data, column, columnar=False) -> pd.DataFrame:
         """
         Replaces abbreviations in a DataFrame column.
 
         Parameters:
         - data (pd.DataFrame): The DataFrame to be processed.
         - column (str): The name of the column to be processed.
+        - columnar (bool): Use vectorized Series.str operations instead of the row loop.
 
         Returns:
         - pd.DataFrame: The DataFrame after abbreviation substitution.
         """
         try:
+            if columnar:
+                lookup = self.abbreviations_lookup
+                txt = data[column].str.replace("  ", ' ', regex=False).str.lower()
+                txt = txt.str.replace(self.abbreviations_regex, lambda match: lookup[match.group(0)], regex=True)
+                data[column] = txt.str.replace("  ", ' ', regex=False).str.strip()
+                return data
             for i in range(data.shape[0]):
                 txt = data[column][i]
                 data.at[i, column] = self.change_abbreviations_sentence(txt)
@@ -135,18 +194,26 @@ class PreProcessing:
             print(error)
     
 
-    def apply_regex_dataframe(self, dataframe, column) -> pd.DataFrame:
+    @metrics.timed('preprocessing.apply_regex', 'dataframe')
+    def apply_regex_dataframe(self, dataframe, column, columnar=False) -> pd.DataFrame:
         """
         Applies regular expressions to a DataFrame column.
 
         Parameters:
         - dataframe (pd.DataFrame): The DataFrame to be processed.
         - column (str): The name of the column to be processed.
+        - columnar (bool): Use vectorized Series.str operations instead of the row loop.
 
         Returns:
         - pd.DataFrame: The DataFrame after applying regular expressions to the specified column.
         """
         try:
+            if columnar:
+                txt = dataframe[column].str.lower()
+                for key, values in self.values_regex.items():
+                    txt = txt.str.replace(key, values, regex=True).str.lower()
+                dataframe[column] = txt
+                return dataframe
             for i in range(dataframe.shape[0]):
                 txt = dataframe[column][i]
                 dataframe.at[i, column] = self.apply_regex_sentence(txt)
@@ -156,7 +223,8 @@ class PreProcessing:
 
     
 
-    def drop_size(self, dataframe, column, n_size) -> pd.DataFrame:
+    @metrics.timed('preprocessing.drop_size', 'dataframe')
+    def drop_size(self, dataframe, column, n_size, columnar=False) -> pd.DataFrame:
         """
         Removes rows where the number of tokens is less than n_size in a DataFrame column.
 
@@ -164,11 +232,19 @@ class PreProcessing:
         - dataframe (pd.DataFrame): The DataFrame to be processed.
         - column (str): The name of the column to be processed.
         - n_size (int): The minimum number of tokens required.
+        - columnar (bool): Use a vectorized boolean mask instead of the row loop.
 
         Returns:
         - pd.DataFrame: The DataFrame after removing rows based on token count.
         """
         try:
+            if columnar:
+                txt = dataframe[column].str.replace(r'[^\w\s]', ' ', regex=True).str.replace("  ", ' ', regex=False)
+                has_empty = (txt.str.len().eq(0) | txt.str.startswith(' ') | txt.str.endswith(' ') 
+                             | txt.str.contains("  ", regex=False))
+                n_tokens = txt.str.count(' ') + 1 - has_empty.astype(int)
+                keep = ~n_tokens.lt(n_size).fillna(False).astype(bool)
+                return dataframe.loc[keep.to_numpy()].reset_index(drop=True)
             index_rm = []
             for i in range(dataframe.shape[0]):
                 txt = dataframe[column][i]
@@ -184,18 +260,26 @@ class PreProcessing:
             print(error)
     
 
-    def dropnan_and_lowercase(self, dataframe, column) -> pd.DataFrame:
+    @metrics.timed('preprocessing.dropnan_and_lowercase', 'dataframe')
+    def dropnan_and_lowercase(self, dataframe, column, columnar=False) -> pd.DataFrame:
         """
         Removes rows with NaN values and converts text in a DataFrame column to lowercase.
 
         Parameters:
         - dataframe (pd.DataFrame): The DataFrame to be processed.
         - column (str): The name of the column to be processed.
+        - columnar (bool): Use vectorized Series.str operations and a boolean mask instead of the row loop.
 
         Returns:
         - pd.DataFrame: The DataFrame after removing NaN rows and converting text to lowercase.
         """
         try:
+            if columnar:
+                txt = dataframe[column].str.lower()
+                keep = (txt.notna() & txt.ne('nan')).fillna(False).astype(bool).to_numpy()
+                dataframe = dataframe.loc[keep].reset_index(drop=True)
+                dataframe[column] = txt[keep].to_numpy()
+                return dataframe
             index_rm = []
             for i in range(dataframe.shape[0]):
                 txt = dataframe[column][i]
@@ -211,38 +295,48 @@ class PreProcessing:
             print(error)
 
 
-    def set_category(self, dataframe, column) -> pd.DataFrame:
+    @metrics.timed('preprocessing.set_category', 'dataframe')
+    def set_category(self, dataframe, column, multi_hot=False, n_classes=None) -> pd.DataFrame|tuple:
         """
         Converts values in a column to categories.
 
+        Comma-separated values are multi-label: the row is repeated once per label, in a single
+        split and explode pass. Rows with NaN values are removed.
+
         Parameters:
         - dataframe (pd.DataFrame): The DataFrame to be processed.
         - column (str): The name of the column to be processed.
+        - multi_hot (bool): Keep one row per text and also return a sparse multi-hot label matrix.
+        - n_classes (int): Number of columns of the multi-hot matrix. Default is the highest label + 1,
+          or 0 when no row has a label.
 
         Returns:
         - pd.DataFrame: The DataFrame after converting values to categories.
+        - tuple: With multi_hot, the DataFrame with the list of labels of each row and the
+          scipy.sparse.csr_matrix of shape (rows, n_classes).
         """
         try:
-            index_rm = []
-            for i in range(dataframe.shape[0]):
-                txt = dataframe[column][i]
-                if type(txt) == float or str(txt.lower()) == 'nan': 
-                    index_rm.append(i)
-                    continue
-                elif ',' in txt:
-                    categories = txt.split(',')
-                    dataframe.at[i, column] = int(categories[0])
-                    values = dataframe.loc[i].to_dict()
-                    values[column] = int(categories[-1])
-                    df = pd.DataFrame([values])
-                    dataframe = pd.concat([dataframe, df])
-                else:
-                    dataframe.at[i, column] = int(txt)
-            dataframe.drop(index_rm, inplace=True)
-            dataframe.index = range(len(dataframe))
-            return dataframe
+            labels = dataframe[column].astype(str).str.strip()
+            keep = (dataframe[column].notna() & labels.str.lower().ne('nan')).to_numpy()
+            dataframe = dataframe.loc[keep].reset_index(drop=True)
+            labels = labels[keep].reset_index(drop=True).str.split(',').explode().str.strip()
+            labels = labels[labels.ne('')].astype(int)
+
+            if not multi_hot:
+                dataframe = dataframe.loc[labels.index].reset_index(drop=True)
+                dataframe[column] = labels.to_numpy()
+                return dataframe
+
+            from scipy.sparse import csr_matrix
+            pairs = labels.rename('label').rename_axis('row').reset_index().drop_duplicates()
+            dataframe = dataframe.loc[pairs.row.unique()].reset_index(drop=True)
+            n_classes = n_classes or (int(pairs.label.max()) + 1 if len(pairs) else 0)
+            matrix = csr_matrix((np.ones(len(pairs), dtype=np.int8), (pd.factorize(pairs.row)[0], pairs.label)),
+                                shape=(len(dataframe), n_classes))
+            dataframe[column] = pairs.groupby('row').label.agg(list).to_numpy()
+            return dataframe, matrix
         except Exception as error:
-            print(f'--> {dataframe[column][i]}', error)
+            print(f'--> {column}', error)
 
 
     def _encode_sentence(self, txt) -> list: 
@@ -251,8 +345,197 @@ class PreProcessing:
 
 
     def convert_to_tokenizer(self, text, max_length=64) -> list:
-        inputs = self.tokenizer(text, max_length=max_length, padding='max_length', truncation=True, return_tensors='tf')
-        return inputs['input_ids'].numpy().flatten()
+        if self.token_cache is not None:
+            return self.tokenize_batch([text], max_length, padding='max_length')[0]
+        inputs = self.tokenizer(text, max_length=max_length, padding='max_length', truncation=True, return_tensors='np')
+        return inputs['input_ids'].astype(np.int32).flatten()
+
+
+    def _encode_batch(self, texts, max_length) -> list:
+        texts = list(texts)
+        cache = self.token_cache
+        if cache is None:
+            return self._encode_uncached(texts, max_length)
+
+        hashes = [cache.text_hash(txt) for txt in texts]
+        found = cache.get_many(hashes, self.tokenizer_name, max_length or 0)
+        missing = {text_hash: txt for text_hash, txt in zip(hashes, texts) if text_hash not in found}
+        if missing:
+            input_ids = self._encode_uncached(list(missing.values()), max_length)
+            cache.put_many(list(missing), input_ids, self.tokenizer_name, max_length or 0)
+            found.update(zip(missing, input_ids))
+        return [found[text_hash] for text_hash in hashes]
+
+
+    @metrics.timed('tokenization.tokenizer', 'texts')
+    def _encode_uncached(self, texts, max_length) -> list:
+        inputs = self.tokenizer(texts, max_length=max_length, truncation=max_length is not None,
+                                padding=False, return_attention_mask=False)
+        return inputs['input_ids']
+
+
+    def _pad_batch(self, input_ids, width, return_attention_mask) -> np.ndarray|tuple:
+        pad_id = self.tokenizer.pad_token_id or 0
+        matrix = np.full((len(input_ids), width), pad_id, dtype=np.int32)
+        attention_mask = np.zeros((len(input_ids), width), dtype=np.int32) if return_attention_mask else None
+        for row, ids in enumerate(input_ids):
+            matrix[row, :len(ids)] = ids
+            if return_attention_mask: attention_mask[row, :len(ids)] = 1
+        return (matrix, attention_mask) if return_attention_mask else matrix
+
+
+    @metrics.timed('tokenization.tokenize_batch', 'texts')
+    def tokenize_batch(self, texts, max_length=64, padding='longest', return_attention_mask=False) -> np.ndarray|tuple:
+        """
+        Tokenizes many texts at once into a single contiguous int32 matrix, without TensorFlow.
+
+        Parameters:
+        - texts (iterable): The texts to be tokenized.
+        - max_length (int): Maximum number of tokens per text; longer texts are truncated.
+        - padding (str): 'longest' pads to the longest text of the batch, 'max_length' pads to max_length.
+        - return_attention_mask (bool): Also return the int32 attention mask.
+
+        Returns:
+        - np.ndarray: The input_ids matrix, or the (input_ids, attention_mask) tuple.
+        """
+        input_ids = self._encode_batch(texts, max_length)
+        width = max_length if padding == 'max_length' else max(map(len, input_ids), default=0)
+        return self._pad_batch(input_ids, width, return_attention_mask)
+
+
+    def iter_token_batches(self, texts, max_length=64, batch_size=256, bucket=True, return_attention_mask=False):
+        """
+        Tokenizes texts in length-bucketed batches, each one padded only to its own longest text.
+
+        Parameters:
+        - texts (iterable): The texts to be tokenized.
+        - max_length (int): Maximum number of tokens per text; longer texts are truncated.
+        - batch_size (int): Number of texts per batch.
+        - bucket (bool): Group texts of similar length in the same batch; False keeps the input order.
+        - return_attention_mask (bool): Also yield the int32 attention mask.
+
+        Returns:
+        - generator: (indices, input_ids) or (indices, input_ids, attention_mask) per batch, where indices
+          are the positions of the batch rows in texts.
+
+        Example:
+
+            >>> for indices, input_ids in pp.iter_token_batches(texts, 512):
+            ...     predicts[indices] = model.predict(input_ids)
+        """
+        input_ids = self._encode_batch(texts, max_length)
+        lengths = np.fromiter(map(len, input_ids), dtype=np.int32, count=len(input_ids))
+        order = np.argsort(lengths, kind='stable') if bucket else np.arange(len(input_ids))
+        for start in range(0, len(order), batch_size):
+            indices = order[start:start + batch_size]
+            batch = self._pad_batch([input_ids[i] for i in indices], int(lengths[indices].max()), return_attention_mask)
+            yield (indices, *batch) if return_attention_mask else (indices, batch)
+
+
+    @metrics.timed('tokenization.encode_full', 'texts')
+    def encode_full(self, texts) -> list:
+        """
+        Tokenizes whole texts, without truncation, so several models can derive their inputs from a
+        single tokenization with truncate_ids, pack_windows or the ids themselves.
+
+        Returns:
+        - list: The int32 token ids of each text, with special tokens.
+        """
+        return [np.asarray(ids, dtype=np.int32) for ids in self._encode_batch(texts, None)]
+
+
+    @staticmethod
+    def truncate_ids(input_ids, max_length) -> np.ndarray:
+        """
+        Truncates untruncated token ids as the tokenizer does with truncation=True: the first
+        max_length - 1 ids followed by the last one ([SEP]).
+        """
+        input_ids = np.asarray(input_ids, dtype=np.int32)
+        if len(input_ids) <= max_length:
+            return input_ids
+        return np.concatenate([input_ids[:max_length - 1], input_ids[-1:]])
+
+
+    @metrics.timed('tokenization.pad_ids', 'input_ids')
+    def pad_ids(self, input_ids, width) -> np.ndarray:
+        """
+        Pads (or truncates) many token id sequences into a single int32 matrix of the given width.
+        """
+        return self._pad_batch([self.truncate_ids(ids, width) for ids in input_ids], width, False)
+
+
+    @staticmethod
+    def split_windows(input_ids, window=64, stride=32) -> list:
+        """
+        Splits the token ids of a whole text into overlapping windows of at most `window` tokens.
+
+        The first and last ids ([CLS] and [SEP]) are kept at the edges of every window, and the last
+        window is aligned to the end of the text so every token is covered.
+
+        Parameters:
+        - input_ids (list): The untruncated token ids of the text, with special tokens.
+        - window (int): Maximum number of tokens per window, special tokens included.
+        - stride (int): Number of tokens between the starts of two windows.
+
+        Returns:
+        - list: The int32 token ids of each window.
+        """
+        input_ids = np.asarray(input_ids, dtype=np.int32)
+        size = window - 2
+        if len(input_ids) <= window or size <= 0:
+            return [input_ids[:window]]
+        head, body, tail = input_ids[:1], input_ids[1:-1], input_ids[-1:]
+        starts = list(range(0, len(body) - size + 1, stride))
+        if starts[-1] + size < len(body):
+            starts.append(len(body) - size)
+        return [np.concatenate([head, body[start:start + size], tail]) for start in starts]
+
+
+    def iter_window_batches(self, texts, window=64, stride=32, batch_size=256, min_width=1):
+        """
+        Scores whole texts instead of truncating them: each text is split into token windows, and the
+        windows of all texts are sorted by length and packed in batches padded only to their longest window.
+
+        Parameters:
+        - texts (iterable): The texts to be tokenized.
+        - window (int): Maximum number of tokens per window.
+        - stride (int): Number of tokens between the starts of two windows of the same text.
+        - batch_size (int): Number of windows per batch.
+        - min_width (int): Minimum width of a batch, e.g. the kernel size of a convolutional model.
+
+        Returns:
+        - generator: (text_indices, lengths, input_ids) per batch, where text_indices are the positions in
+          texts of the text of each window and lengths are the number of real tokens of each window.
+
+        Example:
+
+            >>> for text_indices, lengths, input_ids in pp.iter_window_batches(texts, 64, 32):
+            ...     np.add.at(totals, text_indices, model.predict(input_ids))
+        """
+        yield from self.pack_windows(self._encode_batch(texts, None), window, stride, batch_size, min_width)
+
+
+    def pack_windows(self, input_ids, window=64, stride=32, batch_size=256, min_width=1):
+        """
+        Same as iter_window_batches, from the untruncated token ids of the texts, e.g. of encode_full.
+        """
+        windows, owners = [], []
+        with metrics.stage('tokenization.split_windows', len(input_ids)) as stage:
+            for index, ids in enumerate(input_ids):
+                text_windows = self.split_windows(ids, window, stride)
+                windows.extend(text_windows)
+                owners.extend([index] * len(text_windows))
+            owners = np.asarray(owners, dtype=np.int64)
+            lengths = np.fromiter(map(len, windows), dtype=np.int32, count=len(windows))
+            order = np.argsort(lengths, kind='stable')
+            stage.output(windows)
+        for start in range(0, len(order), batch_size):
+            indices = order[start:start + batch_size]
+            with metrics.stage('tokenization.pack_windows', len(indices)) as stage:
+                width = max(int(lengths[indices].max()), min_width)
+                batch = owners[indices], lengths[indices], self._pad_batch([windows[i] for i in indices], width, False)
+                stage.output(batch)
+            yield batch
         
 
     def shuffled_dataframe(self, dataframe) -> pd.DataFrame:
@@ -270,31 +553,43 @@ class PreProcessing:
         str: The input text with stopwords removed.
 
         Raises:
+        LookupError: If the stopwords are not available (see libs.resources.ResourceManager).
         Exception: Any exception that may occur during the process.
         """
+        stopwords_pt = resources.stopwords('portuguese')
         try:
-            stopwords_pt = set(stopwords.words('portuguese'))
             removed_stopwords = [token for token in txt.split() if token.lower() not in stopwords_pt]
             return " ".join(removed_stopwords)
         except Exception as error:
             print(error)
 
 
-    def remove_stopwords_dataframe(self, dataframe, column) -> pd.DataFrame:
+    @metrics.timed('preprocessing.remove_stopwords', 'dataframe')
+    def remove_stopwords_dataframe(self, dataframe, column, columnar=False) -> pd.DataFrame:
         """
         Remove stopwords from a specific column in a DataFrame.
 
         Parameters:
         - dataframe (pd.DataFrame): The input DataFrame.
         - column (str): The name of the column from which stopwords will be removed.
+        - columnar (bool): Split, filter and join the tokens of the whole column at once instead of the row loop.
 
         Returns:
         pd.DataFrame: The DataFrame with stopwords removed from the specified column.
 
         Raises:
+        LookupError: If the stopwords are not available (see libs.resources.ResourceManager).
         Exception: Any exception that may occur during the process.
         """
+        stopwords_pt = resources.stopwords('portuguese')
         try:
+            if columnar:
+                txt = dataframe[column].reset_index(drop=True)
+                tokens = txt.str.split().explode().dropna()
+                tokens = tokens[~tokens.str.lower().isin(stopwords_pt)]
+                txt = tokens.groupby(level=0).agg(" ".join).reindex(txt.index, fill_value='')
+                dataframe[column] = txt.to_numpy()
+                return dataframe
             for i in range(dataframe.shape[0]):
                 txt = dataframe[column][i]
                 txt = self.remove_stopwords_sentence(txt)
@@ -0,0 +1,153 @@
+from time import time
+import hashlib, json, os, sys
+import numpy as np
+
+path = os.path.abspath(__file__)
+path = path[:path.find('/libs')]
+sys.path.insert(1, path)
+from libs.sqlite_manager import SqlitePool
+from libs.metrics import metrics
+
+
+class PredictionCache:
+    """
+    Persistent cache of model predictions, kept in the 'prediction_cache' side table of the SQLite database.
+    -------
+
+    Entries are keyed by the hash of the lyrics, the fingerprint of the model file and the hash of the
+    preprocessing and scoring configuration, and store the emotion vector as float32 bytes. Any change
+    to the model or the configuration misses the cache, while unrelated changes keep hitting it.
+    When the table grows past max_entries the least recently used entries are evicted.
+    Lookups use the read connection of the current thread and every write goes through the single
+    writer of the pool, so the cache can be shared between threads and with the writes of a script.
+
+    Attributes:
+        - pool (libs.sqlite_manager.SqlitePool): Connections to the database holding the cache.
+        - model_hash (str): Fingerprint of the model file.
+        - config_hash (str): Hash of the preprocessing and scoring configuration.
+        - max_entries (int): Maximum number of cached predictions.
+        - hits (int): Number of lyrics found in the cache.
+        - misses (int): Number of lyrics not found in the cache.
+
+    Example:
+
+        >>> cache = PredictionCache(path+'/songs_database.db', PredictionCache.file_hash(model_path),
+        ...                         PredictionCache.config_hash({'stages': stages, 'max_length': 512}))
+        >>> found = cache.get_many(hashes)
+        >>> cache.put_many(missing_hashes, model.predict(inputs))
+        >>> cache.hit_rate()
+    """
+    _batch = 500
+
+    def __init__(self, database, model_hash, config_hash, max_entries=500000) -> None:
+        """
+        Args:
+            - database (str|libs.sqlite_manager.SqlitePool): The path to the database, or the pool of the script.
+            - model_hash (str): Fingerprint of the model file.
+            - config_hash (str): Hash of the preprocessing and scoring configuration.
+            - max_entries (int): Maximum number of cached predictions.
+        """
+        self.pool = database if isinstance(database, SqlitePool) else SqlitePool(database)
+        self.model_hash = model_hash
+        self.config_hash = config_hash
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        with self.pool.writer() as slq3_instance, slq3_instance.conn:
+            slq3_instance.cur.execute("""CREATE TABLE IF NOT EXISTS prediction_cache(
+                                              lyrics_hash TEXT NOT NULL,
+                                              model_hash TEXT NOT NULL,
+                                              config_hash TEXT NOT NULL,
+                                              predicts BLOB NOT NULL,
+                                              last_used REAL NOT NULL,
+                                              PRIMARY KEY(lyrics_hash, model_hash, config_hash))""")
+
+
+    @staticmethod
+    def text_hash(txt) -> str:
+        return hashlib.sha1(str(txt).encode('utf-8')).hexdigest()
+
+
+    @staticmethod
+    def file_hash(file_path) -> str:
+        """
+        Returns the SHA-256 of the content of a file, e.g. the model, read in blocks of 1 MB.
+        """
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+
+    @staticmethod
+    def config_hash(config) -> str:
+        """
+        Returns the SHA-256 of a JSON-serializable configuration; compiled regular expressions
+        and other objects are hashed by their repr.
+        """
+        encoded = json.dumps(config, sort_keys=True, ensure_ascii=False,
+                             default=lambda value: getattr(value, 'pattern', repr(value)))
+        return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+    @metrics.timed('prediction_cache.get_many', 'hashes')
+    def get_many(self, hashes) -> dict:
+        """
+        Looks up the predictions of many lyrics.
+        -------
+
+        Args:
+            - hashes (list): Hashes of the lyrics, from PredictionCache.text_hash.
+
+        Returns:
+            - dict: The float32 emotion vector of each cached hash.
+        """
+        conn = self.pool.reader().conn
+        found = {}
+        unique = list(dict.fromkeys(hashes))
+        for start in range(0, len(unique), self._batch):
+            chunk = unique[start:start + self._batch]
+            marks = ",".join("?" * len(chunk))
+            rows = conn.execute(f"SELECT lyrics_hash, predicts FROM prediction_cache WHERE model_hash = ? "
+                                f"AND config_hash = ? AND lyrics_hash IN ({marks})", [self.model_hash, self.config_hash, *chunk])
+            found.update((lyrics_hash, np.frombuffer(blob, dtype=np.float32)) for lyrics_hash, blob in rows)
+
+        if found:
+            with self.pool.writer() as slq3_instance, slq3_instance.conn:
+                slq3_instance.cur.executemany("UPDATE prediction_cache SET last_used = ? WHERE lyrics_hash = ? "
+                                              "AND model_hash = ? AND config_hash = ?",
+                                              [(time(), lyrics_hash, self.model_hash, self.config_hash)
+                                               for lyrics_hash in found])
+        hit = sum(lyrics_hash in found for lyrics_hash in hashes)
+        self.hits += hit
+        self.misses += len(hashes) - hit
+        return found
+
+
+    @metrics.timed('prediction_cache.put_many', 'hashes')
+    def put_many(self, hashes, predicts) -> None:
+        """
+        Stores the predictions of many lyrics and evicts the least recently used entries above max_entries.
+        -------
+
+        Args:
+            - hashes (list): Hashes of the lyrics, from PredictionCache.text_hash.
+            - predicts (np.ndarray): The (lyrics, emotions) prediction matrix.
+        """
+        now = time()
+        rows = [(lyrics_hash, self.model_hash, self.config_hash, np.asarray(vector, dtype=np.float32).tobytes(), now)
+                for lyrics_hash, vector in zip(hashes, predicts)]
+        with self.pool.writer() as slq3_instance, slq3_instance.conn:
+            cur = slq3_instance.cur
+            cur.executemany("INSERT OR REPLACE INTO prediction_cache (lyrics_hash, model_hash, config_hash, predicts, "
+                            "last_used) VALUES (?, ?, ?, ?, ?)", rows)
+            size = cur.execute("SELECT COUNT(*) FROM prediction_cache").fetchone()[0]
+            if size > self.max_entries:
+                cur.execute("DELETE FROM prediction_cache WHERE rowid IN (SELECT rowid FROM prediction_cache "
+                            "ORDER BY last_used LIMIT ?)", (size - self.max_entries,))
+
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
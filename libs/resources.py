@@ -0,0 +1,136 @@
+from threading import Lock
+import re, os, sys
+
+path = os.path.abspath(__file__)
+path = path[:path.find('/libs')]
+sys.path.insert(1, path)
+
+
+class ResourceManager:
+    """
+    Lazy, once per process, loader of the heavy preprocessing resources.
+    -------
+
+    Nothing is loaded at import time. The tokenizer and the NLTK stopwords are first looked up
+    in the local cache directory and only downloaded when missing and offline mode is off,
+    so an unreachable server never stalls the startup of a script or worker process.
+
+    Configuration (environment variables):
+    -------
+    - AFFECTIVE_CACHE_DIR: Local cache directory. Default is '<repository>/.cache'.
+    - AFFECTIVE_OFFLINE: '1' never touches the network and only uses the local cache.
+    - AFFECTIVE_ALLOW_MISSING_STOPWORDS: '1' uses an empty stopword set when the NLTK corpus
+      is not available, instead of raising LookupError.
+
+    Attributes:
+        - cache_dir (str): Directory where the tokenizer and NLTK data are cached.
+        - offline (bool): If True, resources are only loaded from the local cache.
+        - allow_missing_stopwords (bool): If True, missing stopwords fall back to an empty set.
+
+    Example:
+
+        >>> resources.tokenizer('neuralmind/bert-base-portuguese-cased')
+        >>> resources.stopwords('portuguese')
+        >>> resources.regex(r'@\\S+')
+    """
+    def __init__(self, cache_dir=None, offline=None, allow_missing_stopwords=None) -> None:
+        self.cache_dir = cache_dir or os.environ.get('AFFECTIVE_CACHE_DIR', path+'/.cache')
+        if offline is None:
+            offline = os.environ.get('AFFECTIVE_OFFLINE', '0').lower() in ('1', 'true', 'yes')
+        if allow_missing_stopwords is None:
+            allow_missing_stopwords = os.environ.get('AFFECTIVE_ALLOW_MISSING_STOPWORDS', '0').lower() in ('1', 'true', 'yes')
+        self.offline = offline
+        self.allow_missing_stopwords = allow_missing_stopwords
+        self._tokenizers = {}
+        self._stopwords = {}
+        self._regexes = {}
+        self._lock = Lock()
+
+
+    def tokenizer(self, name):
+        """
+        Returns the tokenizer of a pretrained model, loading it on the first call.
+        -------
+
+        Args:
+            - name (str): The name or path of the pretrained model.
+
+        Returns:
+            - transformers.PreTrainedTokenizerBase: The tokenizer.
+        """
+        if name not in self._tokenizers:
+            with self._lock:
+                if name not in self._tokenizers:
+                    self._tokenizers[name] = self._load_tokenizer(name)
+        return self._tokenizers[name]
+
+
+    def _load_tokenizer(self, name):
+        from transformers import AutoTokenizer
+        cache_dir = os.path.join(self.cache_dir, 'transformers')
+        try:
+            return AutoTokenizer.from_pretrained(name, cache_dir=cache_dir, local_files_only=True)
+        except OSError:
+            if self.offline:
+                raise
+            return AutoTokenizer.from_pretrained(name, cache_dir=cache_dir)
+
+
+    def stopwords(self, language='portuguese') -> frozenset:
+        """
+        Returns the NLTK stopwords of a language, loading them on the first call.
+        -------
+
+        Args:
+            - language (str): The language of the stopwords.
+
+        Returns:
+            - frozenset: The stopwords. Empty only if they are missing and allow_missing_stopwords is set.
+
+        Raises:
+            - LookupError: If the stopwords are not cached and cannot be downloaded.
+        """
+        if language not in self._stopwords:
+            with self._lock:
+                if language not in self._stopwords:
+                    self._stopwords[language] = self._load_stopwords(language)
+        return self._stopwords[language]
+
+
+    def _load_stopwords(self, language) -> frozenset:
+        import nltk
+        from nltk.corpus import stopwords
+        nltk_dir = os.path.join(self.cache_dir, 'nltk_data')
+        if nltk_dir not in nltk.data.path:
+            nltk.data.path.append(nltk_dir)
+        try:
+            return frozenset(stopwords.words(language))
+        except LookupError:
+            if self.offline or not nltk.download('stopwords', download_dir=nltk_dir, quiet=True):
+                if not self.allow_missing_stopwords:
+                    raise LookupError(f"Stopwords '{language}' not available in {nltk_dir}; download them "
+                                      f"or set AFFECTIVE_ALLOW_MISSING_STOPWORDS=1 to run without them")
+                print(f"Stopwords '{language}' not available in {nltk_dir}, running without stopwords")
+                return frozenset()
+            return frozenset(stopwords.words(language))
+
+
+    def regex(self, pattern, flags=0) -> re.Pattern:
+        """
+        Returns a compiled regular expression, compiling it on the first call.
+        -------
+
+        Args:
+            - pattern (str|re.Pattern): The regular expression.
+            - flags (int): The flags of re.compile.
+
+        Returns:
+            - re.Pattern: The compiled regular expression.
+        """
+        key = (pattern, flags)
+        if key not in self._regexes:
+            self._regexes[key] = re.compile(pattern, flags) if isinstance(pattern, str) else pattern
+        return self._regexes[key]
+
+
+resources = ResourceManager()
@@ -1,5 +1,28 @@
+from threading import Lock, RLock, local
+from contextlib import contextmanager, nullcontext
+from itertools import islice
+from datetime import datetime
 import pandas as pd
+import numpy as np
 import sqlite3 
+import glob, os, re, sys
+
+path = os.path.abspath(__file__)
+path = path[:path.find('/libs')]
+sys.path.insert(1, path)
+from libs.metrics import metrics
+
+
+TUNED_PRAGMAS = {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'cache_size': -65536,
+                 'mmap_size': 268435456, 'temp_store': 'MEMORY', 'busy_timeout': 5000}
+
+
+def _python_value(value):
+    """
+    Returns the Python value of a NumPy scalar, which sqlite3 cannot bind, and any other value unchanged.
+    """
+    return value.item() if isinstance(value, np.generic) else value
+
 
 class Sqlite():
     """
@@ -9,39 +32,82 @@ class Sqlite():
 
     - pandas
     - sqlite3
+    - itertools
+    - numpy
 
+    With libs.metrics enabled, reads and writes are recorded as 'sqlite.*' stages.
 
     Attributes:
         - database (str): The path to the SQLite database file.
+        - pragmas (dict): PRAGMA statements applied when connecting, e.g. TUNED_PRAGMAS.
         - conn (sqlite3.Connection): The SQLite database connection.
         - cur (sqlite3.Cursor): The SQLite database cursor.
     
     Example:
 
+    - context manager:
+
+        >>> with Sqlite(database_name.bd, pragmas=TUNED_PRAGMAS) as slq3_instance:
+
     - get_by_select():
 
         >>> Sqlite(database_name.bd).get_by_select(query=query_select)
 
+    - iter_select():
+
+        >>> for chunk in Sqlite(database_name.bd).iter_select(query=query_select, chunk_size=500):
+
     - insert():
 
         >>> Sqlite(database_name.bd).insert(query=query_insert)
 
+    - insert_many():
+
+        >>> Sqlite(database_name.bd).insert_many(table='inputs', data=dataframe, batch_size=5000)
+
+    - transaction():
+
+        >>> with slq3_instance.transaction():
+        ...     slq3_instance.insert_many(table='song', data=songs)
+        ...     slq3_instance.insert_many(table='artist', data=artists)
+
     - update():
     
         >>> Sqlite(database_name.bd).get_by_select(query=query_update)
+
+    - migrate():
+
+        >>> Sqlite(database_name.bd).migrate(directory='data_source/sql/migrations')
+
+    - explain():
+
+        >>> Sqlite(database_name.bd).explain(query=query_select)
     """ 
-    def __init__(self, database) -> None:
+    def __init__(self, database, pragmas=None, check_same_thread=True) -> None:
         """
         Initialize the Sqlite instance.
         -------
 
         Args:
             - database (str): The path to the SQLite database file.
+            - pragmas (dict): PRAGMA statements applied when connecting. Default is none.
+            - check_same_thread (bool): Only allow the connection to be used by the thread that created it.
         """
         self.database = database
+        self.pragmas = pragmas or {}
+        self.check_same_thread = check_same_thread
+        self._in_transaction = False
         self.conn, self.cur = self._connect()
 
 
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
     def _connect(self) -> sqlite3.Connection|sqlite3.Cursor:
         """
         Connect to the SQLite database.
@@ -51,60 +117,343 @@ class Sqlite():
             - tuple: A tuple containing the database connection and cursor.
         """
         try:
-            self.conn = sqlite3.connect(self.database)
+            self.conn = sqlite3.connect(self.database, check_same_thread=self.check_same_thread)
+            for key, value in self.pragmas.items():
+                self.conn.execute(f"PRAGMA {key} = {value}")
             self.cur = self.conn.cursor()
             return self.conn, self.cur
         except sqlite3.Error as error:
             print("Failed to connect:", error)
 
 
-    def get_by_select(self, query) -> pd.DataFrame:
+    def close(self) -> None:
+        """
+        Commit pending changes and close the connection.
+        -------
+        """
+        try:
+            self.conn.commit()
+            self.conn.close()
+        except sqlite3.Error as error:
+            print("Failed to close:", error)
+
+
+    @metrics.timed('sqlite.get_by_select')
+    def get_by_select(self, query, params=()) -> pd.DataFrame:
         """
         Execute a SELECT query and return the result as a DataFrame.
         -------
 
         Args:
             - query (str): The SELECT query to be executed.
+            - params (tuple|dict): The values bound to the ? placeholders of the query.
 
         Returns:
-            - data: A DataFrame containing the query result.
+            - data: A DataFrame containing the query result, or None if the query fails.
         """
         try:
-            self.cur.execute(query)
+            self.cur.execute(query, params)
             columns = [desc[0] for desc in self.cur.description]
             rows = self.cur.fetchall()
             data = pd.DataFrame(rows, columns=columns)
             return data
         except sqlite3.Error as error:
-            print("Failed to insert:", error)
-        self.cur.execute(query)
+            print("Failed to select:", error)
+            return None
+
+
+    def iter_select(self, query, params=(), chunk_size=1000, dtypes=None, records=False):
+        """
+        Execute a SELECT query and yield the result in chunks, fetching chunk_size rows at a time.
+        -------
+
+        Args:
+            - query (str): The SELECT query to be executed, with ? placeholders.
+            - params (tuple|dict): The values bound to the placeholders.
+            - chunk_size (int): Number of rows per chunk.
+            - dtypes (dict): dtype of some columns, e.g. {'song_id': 'int32', 'value': 'float32'}.
+            - records (bool): Yield NumPy record arrays instead of DataFrames.
 
+        Returns:
+            - generator: DataFrames (or NumPy record arrays) of at most chunk_size rows.
+        """
+        cur = self.conn.cursor()
+        try:
+            cur.execute(query, params)
+            columns = [desc[0] for desc in cur.description]
+            dtypes = dtypes or {}
+            while True:
+                with metrics.stage('sqlite.iter_select') as stage:
+                    rows = cur.fetchmany(chunk_size)
+                    if not rows: break
+                    if records:
+                        chunk = np.rec.array(rows, dtype=[(column, dtypes.get(column, object)) for column in columns])
+                    else:
+                        chunk = pd.DataFrame(rows, columns=columns).astype(dtypes) if dtypes else pd.DataFrame(rows, columns=columns)
+                    stage.output(chunk)
+                yield chunk
+        except sqlite3.Error as error:
+            print("Failed to select:", error)
+        finally:
+            cur.close()
 
+
+    @metrics.timed('sqlite.insert')
     def insert(self, query) -> None:
         """
         Execute an INSERT query to insert data into the database.
         -------
 
         Args:
-            - query (str): The INSERT query to be executed.
+            - query (str): The INSERT query to be executed. Committed at once, or at the end of transaction().
         """
         try:
             self.cur.execute(query)
-            self.conn.commit()
+            if not self._in_transaction: self.conn.commit()
         except sqlite3.Error as error:
             print("Failed to insert:", error)
 
 
+    @metrics.timed('sqlite.update')
     def update(self, query) -> None:
         """
         Execute an UPDATE query to update data in the database.
         -------
 
         Args:
-            - query (str): The UPDATE query to be executed.
+            - query (str): The UPDATE query to be executed. Committed at once, or at the end of transaction().
         """
         try:
             self.cur.execute(query)
-            self.conn.commit()
+            if not self._in_transaction: self.conn.commit()
         except sqlite3.Error as error:
-            print("Failed to insert:", error)
\ No newline at end of file
+            print("Failed to update:", error)
+
+
+    def insert_many(self, table, data, columns=None, batch_size=1000, on_conflict=None) -> int:
+        """
+        Insert many rows with bound parameters, using one executemany and one transaction per batch.
+        NumPy scalars, e.g. np.int64 ids or np.float32 predictions, are converted to Python values.
+        -------
+
+        Args:
+            - table (str): The table receiving the rows.
+            - data (pd.DataFrame|iterable): A DataFrame, or an iterable of tuples ordered as columns.
+            - columns (list): The columns to be filled. Default is the DataFrame columns.
+            - batch_size (int): Number of rows per executemany and transaction.
+            - on_conflict (str|list): None for a plain INSERT, 'ignore' or 'replace' for
+              INSERT OR IGNORE/REPLACE, or a list of key columns to upsert the remaining
+              columns with ON CONFLICT(...) DO UPDATE.
+
+        Returns:
+            - int: The number of rows written.
+
+        Raises:
+            - sqlite3.Error: If a batch fails. It is rolled back; the batches before it stay committed,
+              unless the call is inside transaction().
+        """
+        if isinstance(data, pd.DataFrame):
+            columns = list(columns or data.columns)
+            frame = data[columns].astype(object)
+            data = frame.where(frame.notna(), None).itertuples(index=False, name=None)
+        query = self._insert_query(table, columns, on_conflict)
+
+        written = 0
+        data = iter(data)
+        while True:
+            batch = [tuple(_python_value(value) for value in row) for row in islice(data, batch_size)]
+            if not batch: break
+            with metrics.stage('sqlite.insert_many', len(batch)) as stage, \
+                 nullcontext() if self._in_transaction else self.conn:
+                self.cur.executemany(query, batch)
+                stage.output(batch)
+            written += len(batch)
+        return written
+
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run the writes of a with block, insert, update and insert_many included, in a single transaction:
+        committed at the end of the block, or entirely rolled back if it raises. A transaction already open
+        on the connection is joined instead of begun, and a nested transaction() is part of the outer one.
+        -------
+
+        Returns:
+            - Sqlite: This instance, inside a with block.
+        """
+        if self._in_transaction:
+            yield self
+            return
+        if not self.conn.in_transaction:
+            self.conn.execute("BEGIN")
+        self._in_transaction = True
+        try:
+            yield self
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            raise
+        finally:
+            self._in_transaction = False
+
+
+    def _insert_query(self, table, columns, on_conflict) -> str:
+        names = ", ".join(f'"{column}"' for column in columns)
+        marks = ", ".join("?" for _ in columns)
+        verb = {None: "INSERT", 'ignore': "INSERT OR IGNORE", 'replace': "INSERT OR REPLACE"}
+        if isinstance(on_conflict, str) or on_conflict is None:
+            return f'{verb[on_conflict]} INTO "{table}" ({names}) VALUES ({marks})'
+        keys = ", ".join(f'"{column}"' for column in on_conflict)
+        updates = ", ".join(f'"{column}" = excluded."{column}"' for column in columns if column not in on_conflict)
+        action = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+        return f'INSERT INTO "{table}" ({names}) VALUES ({marks}) ON CONFLICT({keys}) {action}'
+
+
+    def migrate(self, directory) -> list:
+        """
+        Apply, in version order, the migrations of a directory that were not applied yet.
+        -------
+
+        Migrations are files named '<version>_<name>.sql'. Each one runs in its own transaction
+        together with its record in the schema_migrations table, so running it again is a no-op.
+
+        Args:
+            - directory (str): The directory holding the migration files.
+
+        Returns:
+            - list: The versions applied by this call.
+        """
+        self.cur.execute("""CREATE TABLE IF NOT EXISTS schema_migrations(
+                                version INTEGER PRIMARY KEY NOT NULL,
+                                name TEXT NOT NULL,
+                                applied_at DATETIME NOT NULL)""")
+        self.conn.commit()
+        applied = {row[0] for row in self.cur.execute("SELECT version FROM schema_migrations").fetchall()}
+
+        migrations = []
+        for file in glob.glob(os.path.join(directory, '*.sql')):
+            match = re.match(r'(\d+)_(.+)\.sql$', os.path.basename(file))
+            if match: migrations.append((int(match.group(1)), match.group(2), file))
+
+        versions = []
+        for version, name, file in sorted(migrations):
+            if version in applied: continue
+            with open(file, 'r') as migration:
+                script = migration.read()
+            record = f"INSERT INTO schema_migrations VALUES ({version}, '{name}', '{datetime.now().isoformat()}');"
+            try:
+                self.conn.executescript(f"BEGIN;\n{script}\n{record}\nCOMMIT;")
+                versions.append(version)
+                print("MIGRATION:", version, name)
+            except sqlite3.Error as error:
+                self.conn.rollback()
+                print("Failed to migrate:", version, name, error)
+                break
+        return versions
+
+
+    def explain(self, query, params=()) -> pd.DataFrame:
+        """
+        Return the EXPLAIN QUERY PLAN of a query, flagging the full table scans.
+        -------
+
+        Args:
+            - query (str): The query to be explained.
+            - params (tuple|dict): The values bound to the ? placeholders of the query.
+
+        Returns:
+            - pd.DataFrame: One row per plan step, with its detail and a full_scan flag.
+        """
+        plan = self.get_by_select(f"EXPLAIN QUERY PLAN {query}", params)
+        plan['full_scan'] = plan.detail.str.match(r'SCAN ') & ~plan.detail.str.contains('INDEX')
+        return plan
+
+
+class SqlitePool():
+    """
+    Thread-safe pool of SQLite connections: one read connection per thread and a single serialized writer.
+    -------
+
+    Every connection is opened with the tuned pragmas (WAL journal by default), so readers in
+    other threads or processes are not blocked while the writer ingests data.
+
+    Attributes:
+        - database (str): The path to the SQLite database file.
+        - pragmas (dict): PRAGMA statements applied to every connection, TUNED_PRAGMAS updated with the kwargs.
+
+    Example:
+
+        >>> with SqlitePool(database_name.bd, synchronous='FULL') as pool:
+        ...     data = pool.reader().get_by_select(query=query_select)
+        ...     with pool.writer() as slq3_instance:
+        ...         slq3_instance.insert_many(table='inputs', data=dataframe)
+    """
+    def __init__(self, database, **pragmas) -> None:
+        self.database = database
+        self.pragmas = {**TUNED_PRAGMAS, **pragmas}
+        self._local = local()
+        self._readers = []
+        self._readers_lock = Lock()
+        self._writer = None
+        self._writer_lock = RLock()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+    def reader(self) -> Sqlite:
+        """
+        Return the read-only connection of the current thread, opening it on the first call.
+        -------
+
+        Returns:
+            - Sqlite: The connection of the current thread.
+        """
+        reader = getattr(self._local, 'reader', None)
+        if reader is None:
+            reader = Sqlite(self.database, pragmas={**self.pragmas, 'query_only': 1}, check_same_thread=False)
+            self._local.reader = reader
+            with self._readers_lock:
+                self._readers.append(reader)
+        return reader
+
+
+    @contextmanager
+    def writer(self):
+        """
+        Lend the single write connection, holding a lock so writes from different threads are serialized.
+        -------
+
+        Returns:
+            - Sqlite: The write connection, inside a with block.
+        """
+        with metrics.stage('sqlite.writer_wait'):
+            self._writer_lock.acquire()
+        try:
+            if self._writer is None:
+                self._writer = Sqlite(self.database, pragmas=self.pragmas, check_same_thread=False)
+            yield self._writer
+        finally:
+            self._writer_lock.release()
+
+
+    def close(self) -> None:
+        """
+        Close the writer and every reader connection.
+        -------
+        """
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        with self._readers_lock:
+            for reader in self._readers:
+                reader.close()
+            self._readers.clear()
+        self._local = local()
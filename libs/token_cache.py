@@ -0,0 +1,125 @@
+from time import time
+import hashlib, os, sys
+import numpy as np
+
+path = os.path.abspath(__file__)
+path = path[:path.find('/libs')]
+sys.path.insert(1, path)
+from libs.sqlite_manager import SqlitePool
+from libs.metrics import metrics
+
+
+class TokenCache:
+    """
+    Persistent cache of token ids, kept in the 'token_cache' side table of the SQLite database.
+    -------
+
+    Entries are keyed by the hash of the text, the tokenizer name and max_length, and store the
+    unpadded int32 input_ids. When the table grows past max_entries the least recently used
+    entries are evicted. Lookups use the read connection of the current thread and every write goes
+    through the single writer of the pool, so a cache sharing the pool of a script never competes
+    with its other writes.
+
+    Attributes:
+        - pool (libs.sqlite_manager.SqlitePool): Connections to the database holding the cache.
+        - max_entries (int): Maximum number of cached texts.
+        - hits (int): Number of texts found in the cache.
+        - misses (int): Number of texts not found in the cache.
+
+    Example:
+
+        >>> cache = TokenCache(path+'/songs_database.db')  # or TokenCache(pool) to share its writer
+        >>> pp = PreProcessing(token_cache=cache)
+        >>> pp.tokenize_batch(texts, 512)
+        >>> cache.hits, cache.misses
+    """
+    _batch = 500
+
+    def __init__(self, database, max_entries=200000) -> None:
+        """
+        Args:
+            - database (str|libs.sqlite_manager.SqlitePool): The path to the database, or the pool of the script.
+            - max_entries (int): Maximum number of cached texts.
+        """
+        self.pool = database if isinstance(database, SqlitePool) else SqlitePool(database)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        with self.pool.writer() as slq3_instance, slq3_instance.conn:
+            slq3_instance.cur.execute("""CREATE TABLE IF NOT EXISTS token_cache(
+                                              text_hash TEXT NOT NULL,
+                                              tokenizer_name TEXT NOT NULL,
+                                              max_length INTEGER NOT NULL,
+                                              input_ids BLOB NOT NULL,
+                                              last_used REAL NOT NULL,
+                                              PRIMARY KEY(text_hash, tokenizer_name, max_length))""")
+
+
+    @staticmethod
+    def text_hash(txt) -> str:
+        return hashlib.sha1(txt.encode('utf-8')).hexdigest()
+
+
+    @metrics.timed('token_cache.get_many', 'hashes')
+    def get_many(self, hashes, tokenizer_name, max_length) -> dict:
+        """
+        Looks up the token ids of many texts.
+        -------
+
+        Args:
+            - hashes (list): Hashes of the texts, from TokenCache.text_hash.
+            - tokenizer_name (str): Name of the tokenizer.
+            - max_length (int): Maximum number of tokens used when tokenizing.
+
+        Returns:
+            - dict: The int32 input_ids of each cached hash.
+        """
+        conn = self.pool.reader().conn
+        found = {}
+        unique = list(dict.fromkeys(hashes))
+        for start in range(0, len(unique), self._batch):
+            chunk = unique[start:start + self._batch]
+            marks = ",".join("?" * len(chunk))
+            rows = conn.execute(f"SELECT text_hash, input_ids FROM token_cache WHERE tokenizer_name = ? "
+                                f"AND max_length = ? AND text_hash IN ({marks})", [tokenizer_name, max_length, *chunk])
+            found.update((text_hash, np.frombuffer(blob, dtype=np.int32)) for text_hash, blob in rows)
+
+        if found:
+            with self.pool.writer() as slq3_instance, slq3_instance.conn:
+                slq3_instance.cur.executemany("UPDATE token_cache SET last_used = ? WHERE text_hash = ? "
+                                              "AND tokenizer_name = ? AND max_length = ?",
+                                              [(time(), text_hash, tokenizer_name, max_length) for text_hash in found])
+        hit = sum(text_hash in found for text_hash in hashes)
+        self.hits += hit
+        self.misses += len(hashes) - hit
+        return found
+
+
+    @metrics.timed('token_cache.put_many', 'hashes')
+    def put_many(self, hashes, input_ids, tokenizer_name, max_length) -> None:
+        """
+        Stores the token ids of many texts and evicts the least recently used entries above max_entries.
+        -------
+
+        Args:
+            - hashes (list): Hashes of the texts, from TokenCache.text_hash.
+            - input_ids (list): Unpadded token ids of each text.
+            - tokenizer_name (str): Name of the tokenizer.
+            - max_length (int): Maximum number of tokens used when tokenizing.
+        """
+        now = time()
+        rows = [(text_hash, tokenizer_name, max_length, np.asarray(ids, dtype=np.int32).tobytes(), now)
+                for text_hash, ids in zip(hashes, input_ids)]
+        with self.pool.writer() as slq3_instance, slq3_instance.conn:
+            cur = slq3_instance.cur
+            cur.executemany("INSERT OR REPLACE INTO token_cache (text_hash, tokenizer_name, max_length, input_ids, "
+                            "last_used) VALUES (?, ?, ?, ?, ?)", rows)
+            size = cur.execute("SELECT COUNT(*) FROM token_cache").fetchone()[0]
+            if size > self.max_entries:
+                cur.execute("DELETE FROM token_cache WHERE rowid IN (SELECT rowid FROM token_cache "
+                            "ORDER BY last_used LIMIT ?)", (size - self.max_entries,))
+
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
@@ -0,0 +1,305 @@
+from datetime import datetime, timezone
+import hashlib, json, shutil
+import os, sys
+import numpy as np
+
+path = os.path.abspath(__file__)
+path = path[:path.find('/libs')]
+sys.path.insert(1, path)
+from libs.metrics import metrics
+
+
+TRAINING_DATA_PATH = path+'/training_data'
+FORMAT_VERSION = 1
+
+
+class TrainingData:
+    """
+    Read-only, memory-mapped view of a training set exported by scripts/export_training_data.py.
+    -------
+
+    Every array is a .npy file opened with mmap_mode='r': nothing is read until it is used, and
+    processes training on the same export share one copy in the page cache. The rows are stored
+    train first, then validation, each in a fixed shuffled order, so the arrays of a split are
+    slices (views) of the files, not copies.
+
+    Files:
+    -------
+    - inputs_id.npy (int64), labels.npy (int32 emotion_id), sources.npy (uint8 index of manifest['sources']).
+    - input_ids_<max_length>.npy: int32 token ids padded (and truncated) to max_length, as PreProcessing.pad_ids.
+    - token_values.npy, token_offsets.npy: the untruncated token ids of every row, concatenated (int32),
+      and where each row starts (int64, rows + 1).
+    - texts.npy, text_offsets.npy: the preprocessed texts, concatenated in UTF-8 (uint8), and their offsets.
+    - manifest.json: version, configuration, emotions, splits, and the dtype, shape and sha256 of each file.
+
+    Attributes:
+        - directory (str): The directory of the export.
+        - manifest (dict): The content of manifest.json.
+        - version (str): The version of the export, a hash of its data and configuration.
+
+    Example:
+
+        >>> data = TrainingData.open()                          # the latest export
+        >>> x_train, y_train = data.input_ids(64, 'train'), data.labels('train')
+        >>> x_val, y_val = data.input_ids(64, 'validation'), data.labels('validation')
+        >>> model.fit(x_train, y_train, validation_data=(x_val, y_val))
+        >>> vectorizer.fit_transform(data.token_text('train'))  # Naive Bayes
+    """
+    def __init__(self, directory) -> None:
+        self.directory = directory
+        with open(os.path.join(directory, 'manifest.json'), 'r') as manifest:
+            self.manifest = json.load(manifest)
+        if self.manifest.get('format_version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported training data format: {self.manifest.get('format_version')}")
+        self.version = self.manifest['version']
+        self._arrays = {}
+
+
+    @classmethod
+    def open(cls, version=None, root=TRAINING_DATA_PATH):
+        """
+        Opens an export of the root directory, by default the latest one.
+        """
+        if version is None:
+            latest = os.path.join(root, 'LATEST')
+            if not os.path.exists(latest):
+                raise FileNotFoundError(f"No training data in {root}, run scripts/export_training_data.py")
+            with open(latest, 'r') as file:
+                version = file.read().strip()
+        return cls(os.path.join(root, version))
+
+
+    def __len__(self) -> int:
+        return self.manifest['rows']
+
+
+    def array(self, name) -> np.ndarray:
+        """
+        Returns a read-only memory map of <name>.npy, opened on the first call.
+        """
+        if name not in self._arrays:
+            if name not in self.manifest['files']:
+                raise KeyError(f"{name} is not in the export, available: {', '.join(self.manifest['files'])}")
+            self._arrays[name] = np.load(os.path.join(self.directory, name + '.npy'), mmap_mode='r')
+        return self._arrays[name]
+
+
+    def rows(self, split=None) -> slice:
+        """
+        Returns the rows of a split ('train' or 'validation'), or of every row if split is None.
+        """
+        if split is None:
+            return slice(0, len(self))
+        if split not in self.manifest['splits']:
+            raise KeyError(f"Unknown split: {split}")
+        start, stop = self.manifest['splits'][split]
+        return slice(start, stop)
+
+
+    def input_ids(self, max_length, split=None) -> np.ndarray:
+        return self.array(f'input_ids_{max_length}')[self.rows(split)]
+
+
+    def labels(self, split=None) -> np.ndarray:
+        return self.array('labels')[self.rows(split)]
+
+
+    def inputs_id(self, split=None) -> np.ndarray:
+        return self.array('inputs_id')[self.rows(split)]
+
+
+    def sources(self, split=None) -> np.ndarray:
+        """
+        Returns the source ('tweets', 'ChatGPT', ...) of each row.
+        """
+        return np.asarray(self.manifest['sources'], dtype=object)[self.array('sources')[self.rows(split)]]
+
+
+    def token_ids(self, index) -> np.ndarray:
+        """
+        Returns the untruncated token ids of a row, as a view of token_values.
+        """
+        offsets = self.array('token_offsets')
+        return self.array('token_values')[offsets[index]:offsets[index + 1]]
+
+
+    def iter_token_ids(self, split=None):
+        """
+        Yields the untruncated token ids of each row of a split, e.g. for PreProcessing.pack_windows.
+        """
+        offsets, values = self.array('token_offsets'), self.array('token_values')
+        rows = self.rows(split)
+        for index in range(rows.start, rows.stop):
+            yield values[offsets[index]:offsets[index + 1]]
+
+
+    def token_text(self, split=None) -> list:
+        """
+        Returns the untruncated token ids of each row joined by spaces, the feature of the Naive Bayes vectorizer.
+        """
+        return [" ".join(map(str, ids.tolist())) for ids in self.iter_token_ids(split)]
+
+
+    def texts(self, split=None) -> list:
+        """
+        Returns the preprocessed texts of a split, decoded from texts.npy.
+        """
+        offsets, data = self.array('text_offsets'), self.array('texts')
+        rows = self.rows(split)
+        return [data[offsets[index]:offsets[index + 1]].tobytes().decode('utf-8')
+                for index in range(rows.start, rows.stop)]
+
+
+    def verify(self) -> bool:
+        """
+        Checks the sha256 of every file against the manifest.
+        """
+        valid = True
+        for name, description in self.manifest['files'].items():
+            if _file_hash(os.path.join(self.directory, name + '.npy')) != description['sha256']:
+                print(f"{self.version}: {name}.npy does not match the manifest")
+                valid = False
+        return valid
+
+
+def split_rows(inputs_id, validation_size=0.2, seed=42) -> np.ndarray|int:
+    """
+    Deterministic train/validation split and order of the rows.
+    -------
+
+    A row is in the validation split when the hash of (seed, inputs_id) falls below validation_size,
+    so each row stays in the same split when rows are added to or removed from the inputs table.
+    The rows of each split are then shuffled with the seed.
+
+    Args:
+        - inputs_id (np.ndarray): The inputs_id of each row.
+        - validation_size (float): Expected fraction of the rows in the validation split.
+        - seed (int): Seed of the split and of the order.
+
+    Returns:
+        - tuple: The positions of the rows in the export order, and the number of train rows.
+    """
+    inputs_id = np.asarray(inputs_id, dtype=np.int64)
+    buckets = np.fromiter((int.from_bytes(hashlib.sha1(f"{seed}:{value}".encode()).digest()[:8], 'big')
+                           for value in inputs_id.tolist()), dtype=np.uint64, count=len(inputs_id))
+    validation = buckets / 2.0**64 < validation_size
+    rng = np.random.default_rng(seed)
+    train_rows, validation_rows = [rng.permutation(np.flatnonzero(mask)) for mask in (~validation, validation)]
+    return np.concatenate([train_rows, validation_rows]), len(train_rows)
+
+
+def content_hash(inputs_id, labels, sources, texts, config) -> str:
+    """
+    Hash of the rows, in inputs_id order, and of the export configuration: the version of an export.
+    """
+    digest = hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode('utf-8'))
+    for row in np.argsort(inputs_id, kind='stable'):
+        digest.update(f"{inputs_id[row]}\x1f{labels[row]}\x1f{sources[row]}\x1f{texts[row]}\x1e".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def export(inputs_id, labels, sources, texts, input_ids, pp, max_lengths=(64,), emotions=None,
+           validation_size=0.2, seed=42, config=None, root=TRAINING_DATA_PATH, force=False, chunk_size=10000) -> str:
+    """
+    Writes a versioned, memory-mapped training set, readable with TrainingData.
+    -------
+
+    The export is written to a temporary directory and renamed to <root>/<version> once complete,
+    and <root>/LATEST is pointed at it. An export with the same data and configuration is not written twice.
+
+    Args:
+        - inputs_id (np.ndarray): The inputs_id of each row.
+        - labels (np.ndarray): The emotion_id of each row.
+        - sources (list): The source of each row.
+        - texts (list): The preprocessed text of each row.
+        - input_ids (list): The untruncated token ids of each row, from PreProcessing.encode_full.
+        - pp (PreProcessing): Instance used to pad the token ids.
+        - max_lengths (iterable): Widths of the padded input_ids matrices.
+        - emotions (list): The emotion name of each emotion_id.
+        - validation_size (float): Expected fraction of the rows in the validation split.
+        - seed (int): Seed of the split and of the order.
+        - config (dict): Configuration recorded in the manifest and in the version, e.g. the tokenizer.
+        - root (str): The directory holding the exports.
+        - force (bool): Rewrite the export if it already exists.
+        - chunk_size (int): Rows padded at a time.
+
+    Returns:
+        - str: The directory of the export.
+    """
+    inputs_id = np.asarray(inputs_id, dtype=np.int64)
+    max_lengths = sorted({int(max_length) for max_length in max_lengths})
+    config = {**(config or {}), 'max_lengths': max_lengths, 'validation_size': validation_size, 'seed': seed}
+    version = content_hash(inputs_id, labels, sources, texts, config)[:12]
+    directory = os.path.join(root, version)
+    if os.path.exists(directory) and not force:
+        print(f"TRAINING DATA: {directory} already exported")
+        _set_latest(root, version)
+        return directory
+
+    order, n_train = split_rows(inputs_id, validation_size, seed)
+    source_names = sorted(set(sources))
+    source_codes = {name: code for code, name in enumerate(source_names)}
+    encoded = [texts[row].encode('utf-8') for row in order]
+    ordered_ids = [np.asarray(input_ids[row], dtype=np.int32) for row in order]
+
+    temporary = f"{directory}.{os.getpid()}.tmp"
+    shutil.rmtree(temporary, ignore_errors=True)
+    os.makedirs(temporary)
+    with metrics.stage('training_data.write', len(order)) as stage:
+        arrays = {'inputs_id': inputs_id[order],
+                  'labels': np.asarray(labels, dtype=np.int32)[order],
+                  'sources': np.asarray([source_codes[sources[row]] for row in order], dtype=np.uint8),
+                  'token_offsets': _offsets(map(len, ordered_ids), len(order)),
+                  'token_values': np.concatenate(ordered_ids) if ordered_ids else np.zeros(0, dtype=np.int32),
+                  'text_offsets': _offsets(map(len, encoded), len(order)),
+                  'texts': np.frombuffer(b"".join(encoded), dtype=np.uint8)}
+        for name, array in arrays.items():
+            np.save(os.path.join(temporary, name + '.npy'), array)
+        for max_length in max_lengths:
+            matrix = np.lib.format.open_memmap(os.path.join(temporary, f'input_ids_{max_length}.npy'), mode='w+',
+                                               dtype=np.int32, shape=(len(order), max_length))
+            for start in range(0, len(order), chunk_size):
+                matrix[start:start + chunk_size] = pp.pad_ids(ordered_ids[start:start + chunk_size], max_length)
+            matrix.flush()
+            del matrix
+        stage.output(rows=len(order))
+
+    files = {}
+    for file in sorted(os.listdir(temporary)):
+        array = np.load(os.path.join(temporary, file), mmap_mode='r')
+        files[file[:-len('.npy')]] = {'dtype': str(array.dtype), 'shape': list(array.shape),
+                                      'sha256': _file_hash(os.path.join(temporary, file))}
+    manifest = {'format_version': FORMAT_VERSION, 'version': version,
+                'created_at': datetime.now(timezone.utc).isoformat(),
+                'rows': len(order), 'splits': {'train': [0, n_train], 'validation': [n_train, len(order)]},
+                'config': config, 'emotions': list(emotions) if emotions is not None else None,
+                'sources': source_names, 'files': files}
+    with open(os.path.join(temporary, 'manifest.json'), 'w') as output:
+        json.dump(manifest, output, indent=2, ensure_ascii=False)
+
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(temporary, directory)
+    _set_latest(root, version)
+    print(f"TRAINING DATA: {directory} ({n_train} train, {len(order) - n_train} validation)")
+    return directory
+
+
+def _offsets(lengths, count) -> np.ndarray:
+    offsets = np.zeros(count + 1, dtype=np.int64)
+    np.cumsum(np.fromiter(lengths, dtype=np.int64, count=count), out=offsets[1:])
+    return offsets
+
+
+def _file_hash(file) -> str:
+    digest = hashlib.sha256()
+    with open(file, 'rb') as data:
+        for block in iter(lambda: data.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _set_latest(root, version) -> None:
+    temporary = os.path.join(root, f'LATEST.{os.getpid()}.tmp')
+    with open(temporary, 'w') as latest:
+        latest.write(version + "\n")
+    os.replace(temporary, os.path.join(root, 'LATEST'))
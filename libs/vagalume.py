@@ -0,0 +1,320 @@
+from time import monotonic, time
+import asyncio, random, unicodedata
+import hashlib, json
+import os, sys
+
+path = os.path.abspath(__file__)
+path = path[:path.find('/libs')]
+sys.path.insert(1, path)
+from libs.metrics import metrics
+
+
+API_URL = 'https://api.vagalume.com.br/search.php'
+TRANSIENT_STATUS = {429, 500, 502, 503, 504}
+
+
+def normalize_name(name) -> str:
+    """
+    Normalizes an artist or song name for matching: lowercase, without accents and extra spaces.
+    """
+    name = unicodedata.normalize('NFKD', str(name))
+    name = "".join(char for char in name if not unicodedata.combining(char))
+    return " ".join(name.lower().split())
+
+
+def is_not_found(results) -> bool:
+    return results.get('type') in ('song_notfound', 'notfound')
+
+
+def parse_song(results) -> dict|dict:
+    """
+    Extracts the song and artist information from a response of the Vagalume search API.
+    -------
+
+    Args:
+        - results (dict): The decoded JSON response.
+
+    Returns:
+        - tuple: The song dictionary (song_name, vagalume_song_id, vagalume_song_url, lyrics) and
+          the artist dictionary (artist_full_name, vagalume_artist_id).
+        - If the song is not found, it returns (False, False).
+    """
+    if is_not_found(results):
+        print("NOT FOUND!!!")
+        return False, False
+    txt = results['mus'][0]
+    list_lyrics = [i.strip() for i in txt['text'].split('\n') if len(i) > 0]
+    dict_song = {"song_name": txt['name'],
+                 "vagalume_song_id": txt['id'],
+                 "vagalume_song_url": txt['url'],
+                 "lyrics": "|".join(list_lyrics)}
+
+    dict_artist = {"artist_full_name": results['art']['name'],
+                   "vagalume_artist_id": results['art']['id']}
+    return dict_song, dict_artist
+
+
+class ResponseCache:
+    """
+    Content-addressed on-disk cache of the Vagalume search API responses.
+    -------
+
+    Responses are stored as JSON files named after the hash of the normalized artist and song
+    names; the API key is not part of the key. 'song_notfound' responses are cached too, with
+    their own TTL, unless retry_not_found asks to search them again. When the cache grows past
+    max_bytes the least recently used files are removed.
+
+    Attributes:
+        - directory (str): The cache directory.
+        - ttl (float): Seconds a found song stays valid.
+        - negative_ttl (float): Seconds a not-found song stays valid.
+        - max_bytes (int): Maximum size of the cache.
+        - offline (bool): Cache-only mode: a miss is never fetched from the API.
+        - retry_not_found (bool): Treat the cached not-found responses as misses, so they are fetched again.
+          Ignored in offline mode, where they could not be fetched.
+        - hits (int): Number of responses read from the cache.
+        - misses (int): Number of responses not found or expired in the cache.
+
+    Example:
+
+        >>> cache = ResponseCache(path+'/.cache/vagalume', offline=True)
+        >>> fetcher = AsyncLyricsFetcher(environ['API_VAGALUME'], cache=cache)
+    """
+    def __init__(self, directory, ttl=90*24*3600, negative_ttl=7*24*3600, max_bytes=512*1024**2, offline=False,
+                 retry_not_found=False) -> None:
+        self.directory = directory
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.retry_not_found = retry_not_found
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self.size = sum(os.path.getsize(file) for file in self._files())
+
+
+    def _files(self) -> list:
+        return [os.path.join(root, name) for root, _, names in os.walk(self.directory)
+                for name in names if name.endswith('.json')]
+
+
+    def _file(self, artist_name, song_name) -> str:
+        key = json.dumps([normalize_name(artist_name), normalize_name(song_name)])
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest + '.json')
+
+
+    def get(self, artist_name, song_name) -> dict|None:
+        """
+        Returns the cached response of a search, or None if it is missing, malformed or expired, or a
+        not-found response with retry_not_found.
+        """
+        file = self._file(artist_name, song_name)
+        try:
+            with open(file, 'r') as cached:
+                entry = json.load(cached)
+            not_found = is_not_found(entry['results'])
+            expired = time() - entry['stored_at'] > (self.negative_ttl if not_found else self.ttl)
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            self.misses += 1
+            return None
+        if expired or (not_found and self.retry_not_found and not self.offline):
+            self.misses += 1
+            return None
+        os.utime(file)
+        self.hits += 1
+        return entry['results']
+
+
+    def put(self, artist_name, song_name, results) -> None:
+        """
+        Stores the response of a search, evicting the least recently used files above max_bytes.
+        """
+        file = self._file(artist_name, song_name)
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        previous = os.path.getsize(file) if os.path.exists(file) else 0
+        with open(file + '.tmp', 'w') as cached:
+            json.dump({'stored_at': time(), 'artist_name': artist_name, 'song_name': song_name,
+                       'results': results}, cached)
+        os.replace(file + '.tmp', file)
+        self.size += os.path.getsize(file) - previous
+        if self.size > self.max_bytes:
+            self._evict()
+
+
+    def _evict(self) -> None:
+        files = sorted(self._files(), key=os.path.getmtime)
+        self.size = sum(os.path.getsize(file) for file in files)
+        for file in files:
+            if self.size <= self.max_bytes * 0.9: break
+            self.size -= os.path.getsize(file)
+            os.remove(file)
+
+
+class TokenBucket:
+    """
+    Asyncio token-bucket rate limiter.
+    -------
+
+    Attributes:
+        - rate (float): Tokens added per second, i.e. the sustained requests per second.
+        - capacity (float): Maximum number of tokens, i.e. the allowed burst.
+    """
+    def __init__(self, rate, capacity=None) -> None:
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = monotonic()
+        self._lock = asyncio.Lock()
+
+
+    async def acquire(self) -> None:
+        """
+        Waits until a token is available and takes it.
+        """
+        async with self._lock:
+            while True:
+                now = monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class _TransientStatus(Exception):
+    pass
+
+
+class AsyncLyricsFetcher:
+    """
+    Concurrent client of the Vagalume search API.
+    -------
+
+    Keeps up to `concurrency` requests in flight over a pool of keep-alive connections,
+    limited by a token bucket to the API quota. Transient errors (connection errors, timeouts,
+    429 and 5xx) are retried with exponential backoff and jitter.
+
+    Required modules:
+
+    - aiohttp
+
+    Attributes:
+        - api_key (str): The Vagalume API key.
+        - api_url (str): The URL of the search API, e.g. a local stub server in tests.
+        - concurrency (int): Maximum number of requests in flight.
+        - bucket (TokenBucket): The rate limiter.
+        - max_retries (int): Retries of a request after a transient error.
+        - backoff (float): Base delay, in seconds, of the exponential backoff.
+        - timeout (float): Total timeout of a request, in seconds.
+        - cache (ResponseCache): Optional on-disk cache consulted before the API.
+
+    Example:
+
+        >>> fetcher = AsyncLyricsFetcher(environ['API_VAGALUME'], concurrency=8, rate=5)
+        >>> async for i, dict_song, dict_artist in fetcher.fetch_all(zip(artists, songs)):
+    """
+    def __init__(self, api_key, api_url=API_URL, concurrency=8, rate=5.0, burst=None,
+                 max_retries=3, backoff=1.0, timeout=30.0, cache=None) -> None:
+        self.api_key = api_key
+        self.api_url = api_url
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate, burst)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.cache = cache
+
+
+    async def fetch(self, session, artist_name, song_name) -> dict|dict:
+        """
+        Retrieves the lyrics of a song, retrying transient errors.
+        -------
+
+        Args:
+            - session (aiohttp.ClientSession): The session holding the keep-alive connections.
+            - artist_name (str): The name of the artist.
+            - song_name (str): The name of the song.
+
+        Returns:
+            - tuple: The song and artist dictionaries of parse_song, (False, False) if the song
+              is not found, or (None, None) if the request failed. Only responses that parse are cached;
+              a cached response that does not parse is fetched again.
+        """
+        import aiohttp
+        cache = self.cache
+        if cache is not None:
+            try:
+                results = cache.get(artist_name, song_name)
+                if results is not None: return parse_song(results)
+            except Exception as error:
+                print(artist_name, song_name, "invalid cached response:", error)
+            if cache.offline: return None, None
+
+        params = {'art': artist_name, 'mus': song_name, 'apikey': self.api_key}
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            try:
+                with metrics.stage('vagalume.request') as stage:
+                    async with session.get(self.api_url, params=params) as response:
+                        if response.status in TRANSIENT_STATUS:
+                            raise _TransientStatus(f"HTTP {response.status}")
+                        response.raise_for_status()
+                        results = await response.json(content_type=None)
+                    stage.output(results, rows=1)
+                dict_song, dict_artist = parse_song(results)
+                if cache is not None: cache.put(artist_name, song_name, results)
+                return dict_song, dict_artist
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError, _TransientStatus) as error:
+                if attempt == self.max_retries:
+                    print(artist_name, song_name, error)
+                    return None, None
+                await asyncio.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+            except Exception as error:
+                print(artist_name, song_name, error)
+                return None, None
+
+
+    async def fetch_all(self, pairs):
+        """
+        Retrieves many songs concurrently, yielding each one as soon as it arrives.
+        -------
+
+        Args:
+            - pairs (iterable): (artist_name, song_name) pairs.
+
+        Returns:
+            - async generator: (index, dict_song, dict_artist), where index is the position of the pair,
+              in completion order.
+
+        Raises:
+            - Exception: The error of a worker, after the other workers are cancelled.
+        """
+        import aiohttp
+        pairs = enumerate(pairs)
+        results = asyncio.Queue(maxsize=2 * self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            async def worker():
+                for i, (artist_name, song_name) in pairs:
+                    await results.put((i, *await self.fetch(session, artist_name, song_name)))
+
+            async def run_workers():
+                workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+                try:
+                    await asyncio.gather(*workers)
+                finally:
+                    for task in workers: task.cancel()
+                    await results.put(None)
+
+            runner = asyncio.create_task(run_workers())
+            try:
+                while (item := await results.get()) is not None:
+                    yield item
+                await runner
+            finally:
+                runner.cancel()
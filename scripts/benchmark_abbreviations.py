@@ -0,0 +1,68 @@
+from time import perf_counter
+import re, os, sys
+
+path = os.path.abspath(__file__)
+path = path[:path.find('/scripts')]
+sys.path.insert(1, path)
+from libs.pre_processing import PreProcessing
+from libs.sqlite_manager import Sqlite as slq3
+
+
+
+def _legacy_change_abbreviations(abbreviations, txt) -> str:
+    """
+    Previous implementation of PreProcessing.change_abbreviations_sentence, one regex per abbreviation.
+    -------
+
+    Args:
+        - abbreviations (dict): Dictionary of abbreviations to be replaced.
+        - txt (str): The sentence to be processed.
+
+    Returns:
+        - str: The sentence after abbreviation substitution.
+    """
+    txt = txt.replace("  ", ' ')
+    for key, values in abbreviations.items():
+        txt = re.sub(fr"\b{key}\b", values, txt.lower())
+    return txt.replace("  ", ' ').strip()
+
+
+def _timeit(function, texts) -> float|list:
+    """
+    Applies a function to every text and measures the elapsed time.
+    -------
+
+    Args:
+        - function (callable): Function receiving a single text.
+        - texts (list): Texts to be processed.
+
+    Returns:
+        - tuple: The elapsed time in seconds and the list of outputs.
+    """
+    start = perf_counter()
+    outputs = [function(txt) for txt in texts]
+    return perf_counter() - start, outputs
+
+
+def main() -> None:
+    """
+    Compares the legacy and the compiled abbreviation replacement over the 'inputs' table,
+    checking that both produce the same output.
+    """
+    pp = PreProcessing()
+    slq3_instance = slq3(database=path+'/songs_database.db')
+    texts = slq3_instance.get_by_select(query="SELECT text_name FROM inputs;").text_name.tolist()
+
+    legacy_time, legacy_outputs = _timeit(lambda txt: _legacy_change_abbreviations(pp.abbreviations, txt), texts)
+    compiled_time, compiled_outputs = _timeit(pp.change_abbreviations_sentence, texts)
+
+    mismatches = sum(legacy != compiled for legacy, compiled in zip(legacy_outputs, compiled_outputs))
+    print(f"ROWS: {len(texts)}")
+    print(f"LEGACY: {legacy_time:.3f}s")
+    print(f"COMPILED: {compiled_time:.3f}s")
+    print(f"SPEEDUP: {legacy_time / compiled_time:.1f}x")
+    print(f"MISMATCHES: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
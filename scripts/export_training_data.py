@@ -0,0 +1,90 @@
+from warnings import filterwarnings
+import argparse
+import numpy as np
+import os, sys
+filterwarnings("ignore")
+
+
+path = os.path.abspath(__file__)
+path = path[:path.find('/scripts')]
+sys.path.insert(1, path)
+from libs.pre_processing import PreProcessing
+from libs.sqlite_manager import SqlitePool
+from libs.token_cache import TokenCache
+from libs.model_registry import MODEL_REGISTRY
+from libs.training_data import TRAINING_DATA_PATH, export
+from libs.metrics import metrics
+
+
+INPUTS_QUERY = "SELECT inputs_id, text_name, source, emotion_id FROM inputs{where} ORDER BY inputs_id;"
+
+
+def _read_inputs(slq3_instance, pp, sources=None, chunk_size=5000) -> tuple:
+    """
+    Reads the inputs table in chunks and tokenizes each chunk whole, without truncation. The reader is
+    a WAL connection of SqlitePool, so the token cache can be written while the rows are read.
+
+    Returns:
+    - tuple: The inputs_id, emotion_id, source and text of each row, and its untruncated token ids.
+    """
+    where, params = '', ()
+    if sources:
+        where, params = f" WHERE source IN ({','.join('?' * len(sources))})", tuple(sources)
+    inputs_id, labels, source, texts, input_ids = [], [], [], [], []
+    for chunk in slq3_instance.iter_select(INPUTS_QUERY.format(where=where), params, chunk_size=chunk_size):
+        chunk_texts = chunk['text_name'].astype(str).tolist()
+        inputs_id.extend(chunk['inputs_id'].tolist())
+        labels.extend(chunk['emotion_id'].tolist())
+        source.extend(chunk['source'].tolist())
+        texts.extend(chunk_texts)
+        input_ids.extend(pp.encode_full(chunk_texts))
+        print(f"TOKENIZED: {len(texts)} inputs")
+    return np.asarray(inputs_id, dtype=np.int64), np.asarray(labels, dtype=np.int32), source, texts, input_ids
+
+
+def main(argv=None) -> None:
+    """
+    Exports the inputs table as a versioned, memory-mapped training set (see libs.training_data.TrainingData):
+    the preprocessed texts, their token ids padded to each --max-lengths and untruncated, the labels, and a
+    deterministic train/validation split, with a manifest. The texts of 'inputs' are stored already
+    preprocessed by scripts/insert_inputs_in_db.py, so they are only tokenized.
+
+    The version is a hash of the rows and the configuration: exporting unchanged data again only points
+    training_data/LATEST at the existing export.
+
+    Example:
+
+        $ python scripts/export_training_data.py --sources tweets --max-lengths 64,512
+        >>> data = TrainingData.open()
+        >>> model.fit(data.input_ids(64, 'train'), data.labels('train'))
+    """
+    max_lengths = sorted({spec.max_length for spec in MODEL_REGISTRY.values() if spec.feature == 'token_ids'})
+    parser = argparse.ArgumentParser(description="Exports the inputs table as memory-mapped training tensors.")
+    parser.add_argument('--sources', default='', help="Comma-separated sources of the inputs, e.g. 'tweets'. Default is all.")
+    parser.add_argument('--max-lengths', default=','.join(map(str, max_lengths)),
+                        help="Comma-separated widths of the padded input_ids matrices.")
+    parser.add_argument('--validation-size', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default=TRAINING_DATA_PATH, help="Directory holding the exports.")
+    parser.add_argument('--force', action='store_true', help="Rewrite an existing export of the same version.")
+    args = parser.parse_args(argv)
+
+    database_path = path+'/songs_database.db'
+    sources = [source.strip() for source in args.sources.split(',') if source.strip()]
+    with SqlitePool(database_path) as pool:
+        pp = PreProcessing(token_cache=TokenCache(pool))
+        inputs_id, labels, source, texts, input_ids = _read_inputs(pool.reader(), pp, sources)
+        emotions = pool.reader().get_by_select("SELECT emotion_id, name_emotion FROM emotion ORDER BY emotion_id;")
+    if len(inputs_id) == 0:
+        sys.exit(f"No inputs{' of ' + ', '.join(sources) if sources else ''} in {database_path}")
+
+    config = {'sources': sources or None, 'tokenizer': pp.tokenizer_name}
+    export(inputs_id, labels, source, texts, input_ids, pp,
+           max_lengths=[int(max_length) for max_length in args.max_lengths.split(',') if max_length.strip()],
+           emotions=emotions['name_emotion'].tolist(), validation_size=args.validation_size, seed=args.seed,
+           config=config, root=args.output, force=args.force)
+    print(f"TOKEN CACHE: {pp.token_cache.hits} hits, {pp.token_cache.misses} misses")
+
+
+if __name__ == "__main__":
+    with metrics.session('export_training_data'): main()
@@ -1,17 +1,22 @@
 from os import environ
+from datetime import datetime
 from time import sleep
 import pandas as pd
 import requests 
+import asyncio
+import sqlite3
 import os, sys
 
 path = os.path.abspath(__file__)
 path = path[:path.find('/scripts')]
 sys.path.insert(1, path)
 from libs.sqlite_manager import Sqlite as slq3
+from libs.vagalume import AsyncLyricsFetcher, ResponseCache, API_URL, parse_song, normalize_name
+from libs.metrics import metrics
 
 
 
-def _get_song(artist_name, song_name, api_url='https://api.vagalume.com.br/search.php') -> dict:
+def _get_song(artist_name, song_name, api_url=API_URL, cache=None) -> dict:
     """
     Retrieves the lyrics of a specific song by an artist using the Vagalume API.
     -------
@@ -20,53 +25,148 @@ def _get_song(artist_name, song_name, api_url='https://api.vagalume.com.br/searc
         - artist_name (str): The name of the artist.
         - song_name (str): The name of the song.
         - api_url (str): The URL of the Vagalume API. Default is 'https://api.vagalume.com.br/search.php'.
+        - cache (libs.vagalume.ResponseCache): Optional on-disk cache consulted before the API.
     
     Returns:
         - tuple: A tuple containing two dictionaries. The first dictionary contains information about the song, including the song name, the Vagalume song ID, the Vagalume song URL, and the lyrics of the song. The second dictionary contains information about the artist, including the artist's full name and the Vagalume artist ID.
-        - If the song is not found, it returns (False, False).
+        - If the song is not found, it returns (False, False); if the request fails, it returns (None, None).
     """
     try:
+        if cache is not None:
+            try:
+                results = cache.get(artist_name, song_name)
+                if results is not None: return parse_song(results)
+            except Exception as error:
+                print(artist_name, song_name, "invalid cached response:", error)
+            if cache.offline: return None, None
         params = {
             'art': artist_name,
             'mus': song_name,
             'apikey': environ['API_VAGALUME']
         }
-        response = requests.get(api_url, params=params)
+        with metrics.stage('vagalume.request') as stage:
+            response = requests.get(api_url, params=params)
+            stage.output(response.content, rows=1)
         sleep(2)
 
         print(response.url)
         results = response.json()
-        if results['type'] == "song_notfound":
-            print("NOT FOUND!!!")
-        txt = results['mus'][0]
-        music_name, music_id, music_href = txt['name'], txt['id'], txt['url']
-        lyrics = txt['text']
-        art_name, art_id = results['art']['name'], results['art']['id']
-        list_lyrics = [i.strip() for i in lyrics.split('\n') if len(i) > 0]
-        dict_song = {"song_name": music_name,
-                     "vagalume_song_id": music_id,
-                     "vagalume_song_url": music_href,
-                     "lyrics": "|".join(list_lyrics)}
-        
-        dict_artist = {"artist_full_name": art_name,
-                       "vagalume_artist_id": art_id}
+        dict_song, dict_artist = parse_song(results)
+        if cache is not None: cache.put(artist_name, song_name, results)
         return dict_song, dict_artist
     except Exception as error:
         print(error)
-        return False, False
+        return None, None
 
 
-def _insert_and_search(dataframe, slq3_instance) -> None:
+SONG_COLS = ["song_id", "song_name", "lyrics", "vagalume_song_url", "vagalume_song_id"]
+ARTIST_COLS = ["artist_id", "song_id", "artist_full_name", "vagalume_artist_id"]
+
+
+def _song_row(song_id, dict_song) -> tuple:
+    return tuple([song_id] + [dict_song[column] for column in SONG_COLS[1:]])
+
+
+def _artist_row(song_id, dict_artist) -> tuple:
+    return tuple([song_id, song_id] + [dict_artist[column] for column in ARTIST_COLS[2:]])
+
+
+LOG_COLS = ["artist_name", "music_name", "status", "song_id", "updated_at"]
+MIGRATIONS_PATH = path+'/data_source/sql/migrations'
+
+
+def _pending_songs(dataframe, slq3_instance, retry_not_found=False) -> pd.DataFrame:
     """
-    Inserts the song and artist information into the SQLite database and performs a search for each song using the get_song function.
+    Removes from the music list the songs already searched, so only new songs are fetched.
     ------
     Args:
         - dataframe (pandas.DataFrame): The DataFrame containing the list of songs and artists.
+        - slq3_instance (libs.sqlite_manager.Sqlite): An instance of the Sqlite class from the libs package.
+        - retry_not_found (bool): Search again the songs recorded as not found.
+
+    Returns:
+        - pandas.DataFrame: The songs not found in ingestion_log nor, by artist and title, in song/artist.
+    """
+    log = slq3_instance.get_by_select("SELECT artist_name, music_name, status FROM ingestion_log;")
+    stored = slq3_instance.get_by_select("SELECT artist.artist_full_name, song.song_name FROM song "
+                                         "INNER JOIN artist ON song.song_id = artist.song_id;")
+    done = {(normalize_name(artist), normalize_name(music)) for artist, music, status in log.itertuples(index=False)
+            if status == 'found' or not retry_not_found}
+    done |= {(normalize_name(artist), normalize_name(music)) for artist, music in stored.itertuples(index=False)}
+
+    keys = pd.Series([(normalize_name(artist), normalize_name(music)) 
+                      for artist, music in zip(dataframe.artist_name, dataframe.music_name)])
+    pending = ~keys.isin(done) & ~keys.duplicated()
+    print(f"PENDING: {int(pending.sum())} of {dataframe.shape[0]} songs")
+    return dataframe.loc[pending.to_numpy()].reset_index(drop=True)
+
+
+class _Checkpoint:
+    """
+    Buffers the found songs and the ingestion_log rows, writing them in bulk every batch_size songs.
+    ------
+    New songs receive stable ids, following the highest song_id already stored. A song whose
+    Vagalume id is already stored is only recorded in ingestion_log, with its existing id.
+    Songs whose request failed, or whose rows could not be written, are not recorded, so they are
+    searched again in the next run.
+    """
+    def __init__(self, slq3_instance, batch_size=50) -> None:
+        self.slq3_instance = slq3_instance
+        self.batch_size = batch_size
+        stored = slq3_instance.get_by_select("SELECT song_id, vagalume_song_id FROM song;")
+        self.known = dict(zip(stored.vagalume_song_id, stored.song_id))
+        self.next_id = int(stored.song_id.max()) + 1 if stored.shape[0] else 0
+        self.songs, self.artists, self.log = [], [], []
+
+
+    def record(self, artist_name, music_name, dict_song, dict_artist) -> None:
+        if dict_song is None: return
+        now = datetime.now().isoformat()
+        if not dict_song:
+            self.log.append((artist_name, music_name, 'not_found', None, now))
+        else:
+            song_id = self.known.get(dict_song['vagalume_song_id'])
+            if song_id is None:
+                song_id, self.next_id = self.next_id, self.next_id + 1
+                self.known[dict_song['vagalume_song_id']] = song_id
+                self.songs.append(_song_row(song_id, dict_song))
+                self.artists.append(_artist_row(song_id, dict_artist))
+            self.log.append((artist_name, music_name, 'found', int(song_id), now))
+        if len(self.log) >= self.batch_size:
+            self.flush()
+
+
+    def flush(self) -> None:
+        """
+        Writes the buffered song, artist and ingestion_log rows in bulk, in a single transaction, and
+        empties the buffers. If the transaction fails none of the rows is written and the error is raised.
+        """
+        songs, artists, log = self.songs, self.artists, self.log
+        self.songs, self.artists, self.log = [], [], []
+        try:
+            with self.slq3_instance.transaction() as slq3_instance:
+                slq3_instance.insert_many(table="song", data=songs, columns=SONG_COLS)
+                slq3_instance.insert_many(table="artist", data=artists, columns=ARTIST_COLS)
+                slq3_instance.insert_many(table="ingestion_log", data=log, columns=LOG_COLS, 
+                                          on_conflict=["artist_name", "music_name"])
+        except sqlite3.Error:
+            vagalume_song_id = SONG_COLS.index("vagalume_song_id")
+            for row in songs:
+                self.known.pop(row[vagalume_song_id], None)
+            raise
+
+
+def _insert_and_search(dataframe, slq3_instance, batch_size=50, cache=None) -> None:
+    """
+    Inserts the song and artist information into the SQLite database and performs a search for each song using the get_song function.
+    ------
+    Args:
+        - dataframe (pandas.DataFrame): The DataFrame containing the list of songs and artists still to be searched.
         - slq3_instance (libs.sqlite_manager.Sqlite): An instance of the Sqlite class from the libs package, responsible for connecting to and manipulating the SQLite database.
+        - batch_size (int): Number of searched songs written per bulk insert.
+        - cache (libs.vagalume.ResponseCache): Optional on-disk cache consulted before the API.
     """
-    song_cols = str(("song_id", "song_name", "lyrics", "vagalume_song_url", "vagalume_song_id"))
-    artist_cols = str(("artist_id", "song_id", "artist_full_name", "vagalume_artist_id"))
-    artist_cols = artist_cols.replace("\'", '')
+    checkpoint = _Checkpoint(slq3_instance, batch_size)
     try:
         for i in range(dataframe.shape[0]):
 
@@ -74,41 +174,68 @@ def _insert_and_search(dataframe, slq3_instance) -> None:
             artist_name = dataframe.artist_name[i]
             print("SONG: ", i, song_name, artist_name)
 
-
-        
-            dict_song, dict_artist = _get_song(artist_name, song_name)
-            if not dict_artist: continue
-
-
-            values_song = [i]+list(dict_song.values())
-            values_song = str(tuple(values_song))
-
-            values_artist = [i]+list(dict_artist.values())
-            values_artist.insert(1, i)
-            values_artist = str(tuple(values_artist))
-
-            song_query = f"INSERT INTO song {song_cols} VALUES {values_song};"
-            slq3_instance.insert(query=song_query)
-            artist_query = f"INSERT INTO artist {artist_cols} VALUES {values_artist};"
-            slq3_instance.insert(query=artist_query)
+            dict_song, dict_artist = _get_song(artist_name, song_name, cache=cache)
+            checkpoint.record(artist_name, song_name, dict_song, dict_artist)
             print()
-            
-            
     except Exception as error:
         print(i, error)
-        print("-->", song_query)
-        print("-->", artist_query)
         print("\n\n")
+    finally:
+        checkpoint.flush()
+
+
+async def _insert_and_search_async(dataframe, slq3_instance, fetcher, batch_size=50) -> None:
+    """
+    Fetches the songs concurrently with an AsyncLyricsFetcher and inserts them into the SQLite database as they arrive.
+    ------
+    Args:
+        - dataframe (pandas.DataFrame): The DataFrame containing the list of songs and artists still to be searched.
+        - slq3_instance (libs.sqlite_manager.Sqlite): An instance of the Sqlite class from the libs package.
+        - fetcher (libs.vagalume.AsyncLyricsFetcher): The concurrent, rate-limited Vagalume client.
+        - batch_size (int): Number of searched songs written per bulk insert.
+    """
+    checkpoint = _Checkpoint(slq3_instance, batch_size)
+    try:
+        async for i, dict_song, dict_artist in fetcher.fetch_all(zip(dataframe.artist_name, dataframe.music_name)):
+            song_name, artist_name = dataframe.music_name[i], dataframe.artist_name[i]
+            print("SONG: ", i, song_name, artist_name, "FOUND" if dict_song else "MISSING")
+            checkpoint.record(artist_name, song_name, dict_song, dict_artist)
+    except Exception as error:
+        print(error)
+        print("\n\n")
+    finally:
+        checkpoint.flush()
 
 
 def main() -> None:
     """
     The main function that initializes the database connection, reads the list of songs from a CSV file,
     calls the insert_and_search function, and inserts the song and artist information into the database.
+
+    LYRICS_CONCURRENCY (default 8) requests are kept in flight, limited to LYRICS_RATE requests per
+    second (default 5). LYRICS_CONCURRENCY=0 falls back to the sequential client.
+
+    Only the songs not searched yet are fetched; LYRICS_RETRY_NOT_FOUND=1 also searches again
+    the songs recorded as not found, bypassing their cached responses.
+
+    Responses are cached on disk in LYRICS_CACHE_DIR (default .cache/vagalume); LYRICS_CACHE_ONLY=1
+    rebuilds the tables from the cache without calling the API.
     """
     slq3_instance = slq3(database=environ['PATH_DATABASE'])
+    slq3_instance.migrate(MIGRATIONS_PATH)
     dataframe = pd.read_csv(environ['PATH_SONGS_LIST'])
-    _insert_and_search(dataframe, slq3_instance)
+    retry_not_found = environ.get('LYRICS_RETRY_NOT_FOUND') == '1'
+    dataframe = _pending_songs(dataframe, slq3_instance, retry_not_found)
+    cache = ResponseCache(environ.get('LYRICS_CACHE_DIR', path+'/.cache/vagalume'),
+                          offline=environ.get('LYRICS_CACHE_ONLY') == '1', retry_not_found=retry_not_found)
+    concurrency = int(environ.get('LYRICS_CONCURRENCY', 8))
+    if not concurrency:
+        _insert_and_search(dataframe, slq3_instance, cache=cache)
+    else:
+        fetcher = AsyncLyricsFetcher(environ.get('API_VAGALUME', ''), api_url=environ.get('API_VAGALUME_URL', API_URL),
+                                     concurrency=concurrency, rate=float(environ.get('LYRICS_RATE', 5)), cache=cache)
+        asyncio.run(_insert_and_search_async(dataframe, slq3_instance, fetcher))
+    print(f"RESPONSE CACHE: {cache.hits} hits, {cache.misses} misses")
 
 if __name__ == "__main__":
-    main()
+    with metrics.session('get_and_save_lyrics'): main()
@@ -0,0 +1,212 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingUnixStreamServer
+from concurrent.futures import TimeoutError as FutureTimeout
+from warnings import filterwarnings
+from queue import Full
+import argparse, json
+import os, sys
+filterwarnings("ignore")
+
+
+path = os.path.abspath(__file__)
+path = path[:path.find('/scripts')]
+sys.path.insert(1, path)
+from libs.pre_processing import PreProcessing
+from libs.pipeline import Pipeline, LYRICS_STAGES
+from libs.sqlite_manager import SqlitePool
+from libs.micro_batcher import MicroBatcher
+from libs.model_registry import MODEL_REGISTRY, build_features
+from libs.metrics import metrics
+
+
+class _SongNotFound(LookupError):
+    """
+    The song_id of a request is not in the song table: replied with 404.
+    """
+
+
+class _TextDropped(ValueError):
+    """
+    The text of a request was dropped by a preprocessing stage, e.g. drop_size: replied with 422.
+    """
+
+
+_ERROR_STATUS = {_SongNotFound: 404, _TextDropped: 422}
+
+
+class _Scorer:
+    """
+    Resident model, tokenizer and preprocessing state, scoring a micro-batch of requests at a time.
+    Only used from the MicroBatcher worker thread.
+    """
+    def __init__(self, spec, pool) -> None:
+        self.spec = spec
+        self.model = spec.load()
+        self.pool = pool
+        self.feature_key = spec.feature_key()
+        self.pp = PreProcessing()
+        self.pipeline = Pipeline(LYRICS_STAGES, pre_processing=self.pp)
+        emotion_name = pool.reader().get_by_select(query="SELECT name_emotion FROM emotion;")
+        emotion_name = emotion_name.to_dict()["name_emotion"]
+        self.emotions = [emotion_name[i] for i in range(len(emotion_name))]
+
+
+    def _lyrics(self, song_ids) -> dict:
+        if not song_ids: return {}
+        marks = ",".join("?" * len(song_ids))
+        songs = self.pool.reader().get_by_select(f"SELECT song_id, lyrics FROM song WHERE song_id IN ({marks});",
+                                                 tuple(song_ids))
+        return dict(zip(songs['song_id'], songs['lyrics']))
+
+
+    def __call__(self, requests) -> list:
+        """
+        Scores a batch of {'text': str} or {'song_id': int} requests with one model.predict.
+
+        Returns:
+        - list: The {emotion: value} dictionary of each request, or the _SongNotFound or _TextDropped
+          error of the requests that cannot be scored.
+        """
+        lyrics = self._lyrics(sorted({request['song_id'] for request in requests if 'song_id' in request}))
+        results, texts, positions = [None] * len(requests), [], []
+        for position, request in enumerate(requests):
+            txt = request['text'] if 'text' in request else lyrics.get(request['song_id'])
+            if txt is None:
+                results[position] = _SongNotFound(f"song_id {request['song_id']} not found")
+                continue
+            txt = self.pipeline.process(txt)
+            if txt is None:
+                results[position] = _TextDropped("text dropped by the preprocessing")
+                continue
+            texts.append(txt)
+            positions.append(position)
+
+        if texts:
+            features = build_features(self.pp, self.pp.encode_full(texts), [self.feature_key])
+            predicts = self.spec.predict(self.model, features[self.feature_key], len(self.emotions), len(texts))
+            for position, vector in zip(positions, predicts):
+                results[position] = dict(zip(self.emotions, vector.tolist()))
+        return results
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    JSON API:
+    - POST /score {"text": "..."} or {"song_id": 3}: {"emotions": {...}}.
+    - GET /health: {"status": "ok"}.
+    - GET /stats: Latency percentiles and batch sizes of the micro-batcher.
+    - GET /metrics: The stages of libs.metrics in the Prometheus text format, empty unless AFFECTIVE_METRICS=1.
+    """
+    batcher = None
+    timeout_seconds = 30.0
+
+    def _reply(self, status, body, content_type='application/json; charset=utf-8') -> None:
+        payload = (body if isinstance(body, str) else json.dumps(body, ensure_ascii=False)).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+    def do_GET(self) -> None:
+        if self.path == '/health':
+            self._reply(200, {'status': 'ok'})
+        elif self.path == '/stats':
+            self._reply(200, self.batcher.latency())
+        elif self.path == '/metrics':
+            self._reply(200, metrics.to_prometheus(), 'text/plain; version=0.0.4; charset=utf-8')
+        else:
+            self._reply(404, {'error': 'not found'})
+
+
+    def do_POST(self) -> None:
+        if self.path != '/score':
+            return self._reply(404, {'error': 'not found'})
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if 'text' in request:
+                request = {'text': str(request['text'])}
+            elif 'song_id' in request:
+                request = {'song_id': int(request['song_id'])}
+            else:
+                return self._reply(400, {'error': "expected 'text' or 'song_id'"})
+        except (ValueError, TypeError) as error:
+            return self._reply(400, {'error': str(error)})
+
+        try:
+            result = self.batcher.submit(request, timeout=1.0).result(timeout=self.timeout_seconds)
+        except Full:
+            return self._reply(503, {'error': 'server overloaded'})
+        except FutureTimeout:
+            return self._reply(504, {'error': 'timeout'})
+        except Exception as error:
+            return self._reply(500, {'error': str(error)})
+        if isinstance(result, Exception):
+            return self._reply(_ERROR_STATUS.get(type(result), 500), {'error': str(result)})
+        self._reply(200, {'emotions': result})
+
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    request_queue_size = 256
+
+
+class _UnixHTTPServer(ThreadingUnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ('local', 0)
+
+
+def main(argv=None) -> None:
+    """
+    Serves a registered model (DCNN by default) on localhost, keeping the model, tokenizer and preprocessing resident.
+    Concurrent requests are grouped in micro-batches of at most --max-batch-size texts, waiting
+    at most --max-wait-ms for a batch to fill.
+
+    Example:
+
+        $ python scripts/inference_server.py --port 8765
+        $ curl -s localhost:8765/score -d '{"text": "que saudade de você"}'
+        $ curl -s localhost:8765/score -d '{"song_id": 3}'
+        $ curl -s --unix-socket /tmp/affective.sock localhost/stats
+    """
+    parser = argparse.ArgumentParser(description="Local inference server of a registered model.")
+    parser.add_argument('--model', default=os.environ.get('INFERENCE_MODEL', 'DCNN'), choices=list(MODEL_REGISTRY))
+    parser.add_argument('--host', default=os.environ.get('INFERENCE_HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('INFERENCE_PORT', 8765)))
+    parser.add_argument('--socket', default=os.environ.get('INFERENCE_SOCKET'), help="Unix socket path instead of TCP.")
+    parser.add_argument('--max-batch-size', type=int, default=int(os.environ.get('INFERENCE_MAX_BATCH_SIZE', 32)))
+    parser.add_argument('--max-wait-ms', type=float, default=float(os.environ.get('INFERENCE_MAX_WAIT_MS', 5)))
+    parser.add_argument('--max-queue', type=int, default=int(os.environ.get('INFERENCE_MAX_QUEUE', 1024)))
+    args = parser.parse_args(argv)
+
+    with SqlitePool(path+'/songs_database.db') as pool:
+        scorer = _Scorer(MODEL_REGISTRY[args.model], pool)
+        with MicroBatcher(scorer, args.max_batch_size, args.max_wait_ms / 1000, args.max_queue) as batcher:
+            batcher.submit({'text': 'aquecendo o modelo e o tokenizador'}).result()
+            _Handler.batcher = batcher
+
+            if args.socket:
+                if os.path.exists(args.socket): os.remove(args.socket)
+                server, address = _UnixHTTPServer(args.socket, _Handler), args.socket
+            else:
+                server, address = _HTTPServer((args.host, args.port), _Handler), f"http://{args.host}:{args.port}"
+            print(f"SERVING: {args.model} on {address} (max batch {args.max_batch_size}, max wait {args.max_wait_ms} ms)")
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                server.server_close()
+                if args.socket and os.path.exists(args.socket): os.remove(args.socket)
+
+
+if __name__ == "__main__":
+    with metrics.session('inference_server'): main()
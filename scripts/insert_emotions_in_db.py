@@ -49,23 +49,15 @@ def _insert_and_search(dataframe, slq3_instance) -> None:
         - dataframe (pandas.DataFrame): The DataFrame containing the list of emotion.
         - slq3_instance (libs.sqlite_manager.Sqlite): An instance of the Sqlite class from the libs package, responsible for connecting to and manipulating the SQLite database.
     """
-    emotion_cols = str(("emotion_id", "name_emotion", "synonym_emotion"))
+    emotion_cols = ["emotion_id", "name_emotion", "synonym_emotion"]
     try:
-        for i in range(dataframe.shape[0]):
-
-            emotion = dataframe.emotion[i]
-            synonym = dataframe.synonym[i]
+        rows = [(i, emotion, str(synonym)) for i, (emotion, synonym) 
+                in enumerate(zip(dataframe.emotion, dataframe.synonym))]
+        for i, emotion, _ in rows:
             print("EMOTION: ", i, emotion)
-
-            values_emotion = str((i, emotion, str(synonym)))
-
-            emotion_query = f"INSERT INTO emotion {emotion_cols} VALUES {values_emotion};"
-            slq3_instance.insert(query=emotion_query)
-            
-            
+        slq3_instance.insert_many(table="emotion", data=rows, columns=emotion_cols)
     except Exception as error:
-        print(i, error)
-        print("-->", emotion_query)
+        print(error)
         print("\n\n")
 
 
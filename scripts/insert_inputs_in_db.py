@@ -7,8 +7,11 @@ path = path[:path.find('/scripts')]
 sys.path.insert(1, path)
 from libs.sqlite_manager import Sqlite as slq3
 from libs.pre_processing import PreProcessing
+from libs.pipeline import Pipeline, DEFAULT_STAGES
+from libs.metrics import metrics
 
 pp = PreProcessing()
+pipeline = Pipeline(DEFAULT_STAGES, pre_processing=pp)
 
 def _preprocessing(dataframe, column, source, emotion_id='emotion_id')-> pd.DataFrame:
     """
@@ -26,12 +29,9 @@ def _preprocessing(dataframe, column, source, emotion_id='emotion_id')-> pd.Data
     try: 
         if source == 'tweets':
             dataframe = pp.set_category(dataframe, emotion_id)
-        dataframe = pp.dropnan_and_lowercase(dataframe, column)
-        dataframe = pp.change_abbreviations_dataframe(dataframe, column)
-        dataframe = pp.drop_size(dataframe, column, 3)
-        dataframe = pp.apply_regex_dataframe(dataframe, column)
+        dataframe = pipeline.run(dataframe, column, n_jobs=int(environ.get('PREPROCESSING_JOBS', 1)))
+        print(pd.DataFrame(pipeline.stats))
         dataframe = pp.shuffled_dataframe(dataframe)
-        dataframe = pp.remove_stopwords_dataframe(dataframe, column)
 
         dataframe['source'] = [source for _ in range(dataframe.shape[0])]
         dataframe.rename({column: 'text_name', emotion_id: 'emotion_id'}, axis=1, inplace=True)
@@ -52,23 +52,12 @@ def _insert_and_search(dataframe, slq3_instance=0) -> None:
     Returns:
     - None - Inserts the data into the database and does not return anything.
     """
-    inputs_cols = str(("text_name", "source", "emotion_id"))
+    inputs_cols = ["text_name", "source", "emotion_id"]
     try:
-        for i in range(dataframe.shape[0]):
-
-            text_name = dataframe.text_name[i]
-            source = dataframe.source[i]
-            emotion_id = dataframe.emotion_id[i]
-
-            values_inputs = str((text_name, source, emotion_id))
-
-            inputs_query = f"INSERT INTO inputs {inputs_cols} VALUES {values_inputs};"
-            slq3_instance.insert(query=inputs_query)
-            
-            
+        written = slq3_instance.insert_many(table="inputs", data=dataframe, columns=inputs_cols, batch_size=5000)
+        print("INPUTS: ", written)
     except Exception as error:
-        print(i, error)
-        print("-->", inputs_query)
+        print(error)
         print("\n\n")
 
 
@@ -150,4 +139,4 @@ def main() -> None:
        
     
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with metrics.session('insert_inputs_in_db'): main()
\ No newline at end of file
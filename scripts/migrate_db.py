@@ -0,0 +1,70 @@
+from os import environ
+import pandas as pd
+import os, sys
+
+path = os.path.abspath(__file__)
+path = path[:path.find('/scripts')]
+sys.path.insert(1, path)
+from libs.sqlite_manager import Sqlite as slq3
+
+
+MIGRATIONS_PATH = path+'/data_source/sql/migrations'
+
+# Queries issued by the scripts, with the tables they are expected to read in full.
+CHECKED_QUERIES = [
+    ("model_run lyrics join",
+     "SELECT song.song_id, song.song_name, song.lyrics, artist.artist_full_name FROM song "
+     "INNER JOIN artist ON song.song_id = artist.song_id;", (), {'song', 'artist'}),
+    ("model_run unscored songs",
+     "SELECT song.song_id, song.song_name, song.lyrics, artist.artist_full_name FROM song "
+     "INNER JOIN artist ON song.song_id = artist.song_id WHERE (NOT EXISTS (SELECT 1 FROM emotional_result "
+     "AS result WHERE result.song_id = song.song_id AND result.model_name = ? AND result.model_version = ?) "
+     "AND NOT EXISTS (SELECT 1 FROM skipped_song AS skipped WHERE skipped.song_id = song.song_id "
+     "AND skipped.model_name = ? AND skipped.model_version = ?)) "
+     "ORDER BY song.song_id;", ('DCNN', '', 'DCNN', ''), {'song'}),
+    ("emotion names", "SELECT name_emotion FROM emotion;", (), {'emotion'}),
+    ("emotional_result lookup",
+     "SELECT value FROM emotional_result WHERE song_id = ? AND model_name = ? AND emotion = ?;",
+     (0, 'DCNN', 'alegria'), set()),
+    ("emotional_result by song", "SELECT emotion, value FROM emotional_result WHERE song_id = ?;", (0,), set()),
+    ("inputs by source", "SELECT text_name, emotion_id FROM inputs WHERE source = ?;", ('tweets',), set()),
+    ("inputs by emotion", "SELECT text_name FROM inputs WHERE emotion_id = ?;", (0,), set()),
+]
+
+
+def _check_query_plans(slq3_instance) -> pd.DataFrame:
+    """
+    Runs EXPLAIN QUERY PLAN for every query of CHECKED_QUERIES.
+    ------
+    Args:
+        - slq3_instance (libs.sqlite_manager.Sqlite): An instance of the Sqlite class from the libs package.
+
+    Returns:
+        - pd.DataFrame: One row per plan step with the query name and an unexpected_scan flag.
+    """
+    plans = []
+    for name, query, params, allowed_scans in CHECKED_QUERIES:
+        plan = slq3_instance.explain(query, params)
+        scanned = plan.detail.str.extract(r'^SCAN (\w+)', expand=False)
+        plan['unexpected_scan'] = plan.full_scan & ~scanned.isin(allowed_scans)
+        plan.insert(0, 'query', name)
+        plans.append(plan[['query', 'detail', 'full_scan', 'unexpected_scan']])
+    return pd.concat(plans, ignore_index=True)
+
+
+def main() -> None:
+    """
+    Applies the pending migrations of data_source/sql/migrations and checks the query plans
+    of the scripts, exiting with an error if any query does an unexpected full table scan.
+    """
+    slq3_instance = slq3(database=environ.get('PATH_DATABASE', path+'/songs_database.db'))
+    slq3_instance.migrate(MIGRATIONS_PATH)
+
+    plans = _check_query_plans(slq3_instance)
+    print(plans.to_string(index=False))
+    if plans.unexpected_scan.any():
+        sys.exit("Unexpected full table scan in: " + ", ".join(plans[plans.unexpected_scan]['query'].unique()))
+
+
+if __name__ == "__main__":
+    main()
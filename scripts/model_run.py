@@ -1,6 +1,8 @@
 from warnings import filterwarnings
+from threading import Thread, Event
+from queue import Queue, Full
+import argparse
 import numpy as np
-from joblib import load
 import pandas as pd
 import os, sys
 filterwarnings("ignore")
@@ -10,90 +12,350 @@ path = os.path.abspath(__file__)
 path = path[:path.find('/scripts')]
 sys.path.insert(1, path)
 from libs.pre_processing import PreProcessing 
-from libs.sqlite_manager import Sqlite as slq3
+from libs.pipeline import Pipeline, LYRICS_STAGES
+from libs.sqlite_manager import SqlitePool
+from libs.token_cache import TokenCache
+from libs.prediction_cache import PredictionCache
+from libs.model_registry import MODEL_REGISTRY, build_features
+from libs.resources import resources
+from libs.metrics import metrics
 
 
 
+MIGRATIONS_PATH = path+'/data_source/sql/migrations'
+
+SONGS_QUERY = ('SELECT song.song_id, song.song_name, song.lyrics, artist.artist_full_name '
+               'FROM song INNER JOIN artist ON song.song_id = artist.song_id{where} ORDER BY song.song_id;')
+
+# Songs without results of a model version, nor skipped by it: anti-joins on the emotional_result
+# and skipped_song keys, each bound to (model_name, model_version).
+UNSCORED_CONDITION = ('(NOT EXISTS (SELECT 1 FROM emotional_result AS result WHERE result.song_id = song.song_id '
+                      'AND result.model_name = ? AND result.model_version = ?) '
+                      'AND NOT EXISTS (SELECT 1 FROM skipped_song AS skipped WHERE skipped.song_id = song.song_id '
+                      'AND skipped.model_name = ? AND skipped.model_version = ?))')
+
+DROPPED_REASON = 'dropped by the preprocessing'
+
+
+class _Scorer:
+    """
+    A registered model loaded for a run, with its version and prediction cache.
+    """
+    def __init__(self, spec, version=None) -> None:
+        self.spec = spec
+        self.model = spec.load()
+        self.model_hash = spec.fingerprint()
+        self.version = version or self.model_hash[:12]
+        self.prediction_cache = None
+
+
+def _songs_query(scorers, rescore=False) -> str|tuple:
+    """
+    Returns the query of the songs to be scored: every song with rescore, otherwise the songs
+    missing the results of any of the (model_name, model_version) pairs and not skipped by it.
+    """
+    if rescore:
+        return SONGS_QUERY.format(where=''), ()
+    where = ' WHERE ' + ' OR '.join([UNSCORED_CONDITION] * len(scorers))
+    params = tuple(value for scorer in scorers for value in (scorer.spec.name, scorer.version) * 2)
+    return SONGS_QUERY.format(where=where), params
+
+
 def _insert_and_search(dataframe, slq3_instance) -> None:
-    inputs_cols = str(("song_id", "song_name", "model_name", 
-                       "emotion", "value")).replace("\'", "")
+    inputs_cols = ["song_id", "song_name", "model_name", "model_version", "emotion", "value"]
+    written = slq3_instance.insert_many(table="emotional_result", data=dataframe, 
+                                        columns=inputs_cols, batch_size=max(len(dataframe), 1),
+                                        on_conflict=["song_id", "model_name", "model_version", "emotion"])
+    print("EMOTIONAL RESULTS: ", written)
+
+
+def _insert_skipped(dataframe, slq3_instance) -> None:
+    written = slq3_instance.insert_many(table="skipped_song", data=dataframe,
+                                        columns=["song_id", "model_name", "model_version", "reason"],
+                                        batch_size=max(len(dataframe), 1),
+                                        on_conflict=["song_id", "model_name", "model_version"])
+    print("SKIPPED SONGS: ", written)
+
+
+def _preprocessing_train(dataframe, column, pp, pipeline, feature_keys) -> pd.DataFrame|dict:
+    dataframe = pipeline.run(dataframe, column)
+
+    input_ids = pp.encode_full(dataframe.lyrics)
+    features = build_features(pp, input_ids, feature_keys)
+
+    return dataframe, features
+
+
+def _put(queue, item, stop) -> bool:
+    """
+    Puts an item in a bounded queue, giving up if the pipeline was stopped.
+
+    Returns:
+    - bool: True if the item was queued.
+    """
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=0.5)
+            return True
+        except Full:
+            continue
+    return False
+
+
+def _split_cached(chunk, scorers) -> pd.DataFrame|tuple:
+    """
+    Separates the songs of a chunk whose predictions of every model are in the prediction caches.
+
+    Returns:
+    - tuple: The songs to be scored, and the cached songs with the predicts of each model.
+    """
+    chunk['lyrics_hash'] = [PredictionCache.text_hash(lyrics) for lyrics in chunk['lyrics']]
+    cached = (chunk.iloc[:0].drop(['lyrics'], axis=1), [])
+    if not scorers or any(scorer.prediction_cache is None for scorer in scorers):
+        return chunk, cached
+
+    hashes = chunk['lyrics_hash'].tolist()
+    found = [scorer.prediction_cache.get_many(hashes) for scorer in scorers]
+    hit = np.logical_and.reduce([chunk['lyrics_hash'].isin(model_found).to_numpy() for model_found in found])
+    if hit.any():
+        cached_songs = chunk[hit].drop(['lyrics'], axis=1).reset_index(drop=True)
+        cached = (cached_songs, [np.stack([model_found[lyrics_hash] for lyrics_hash in cached_songs['lyrics_hash']])
+                                 for model_found in found])
+        chunk = chunk[~hit].reset_index(drop=True)
+    return chunk, cached
+
+
+def _read_and_preprocess(pool, chunk_size, batches, stop, errors, scorers, windows=None, query=SONGS_QUERY,
+                         params=()) -> None:
+    """
+    Producer thread: reads the songs in chunks, looks them up in the prediction caches, preprocesses
+    and tokenizes the missing ones once for every model, and queues the (songs, features, cached, dropped)
+    batches, dropped being the song_id of the songs dropped by the preprocessing.
+    A None is queued at the end. An exception is appended to errors and stops the pipeline.
+    """
+    try:
+        pp = PreProcessing(token_cache=TokenCache(pool))
+        pipeline = Pipeline(LYRICS_STAGES, pre_processing=pp)
+        feature_keys = [scorer.spec.feature_key(windows) for scorer in scorers]
+        stats = []
+        with pipeline.start(int(os.environ.get('PREPROCESSING_JOBS', 1))):
+            for chunk in pool.reader().iter_select(query, params, chunk_size=chunk_size):
+                chunk, cached = _split_cached(chunk, scorers)
+                songs, features, dropped = chunk, None, []
+                if len(chunk):
+                    songs, features = _preprocessing_train(chunk, 'lyrics', pp, pipeline, feature_keys)
+                    dropped = chunk['song_id'][~chunk['song_id'].isin(songs['song_id'])].tolist()
+                    stats.append(pd.DataFrame(pipeline.stats))
+                if len(songs) == 0 and len(cached[0]) == 0 and not dropped: continue
+                if not _put(batches, (songs.drop(['lyrics'], axis=1), features, cached, dropped), stop): return
+
+        if stats:
+            print(pd.concat(stats).groupby('stage', sort=False).sum())
+        print(f"TOKEN CACHE: {pp.token_cache.hits} hits, {pp.token_cache.misses} misses")
+    except Exception as error:
+        errors.append(error)
+        stop.set()
+    finally:
+        batches.put(None)
+
+
+def _write_results(pool, results, csv_path, stop, errors) -> None:
+    """
+    Consumer thread: appends each chunk of results to the CSV file and commits it to emotional_result,
+    with the skipped songs of the chunk, in one transaction. An exception is appended to errors and
+    stops the pipeline.
+    """
     try:
-        for i in range(dataframe.shape[0]):
-            song_id = dataframe['song_id'][i]
-            song_name = dataframe['song_name'][i]
-            model_name = dataframe['model_name'][i]
-            emotion = dataframe['emotion'][i]
-            value = dataframe['value'][i]
-
-            values = str((song_id, song_name, model_name, 
-                                  emotion, value))
-            inputs_query = f"INSERT INTO emotional_result {inputs_cols} VALUES {values};"
-            slq3_instance.insert(query=inputs_query)
-            
-            print(inputs_query)
-            
+        header = True
+        while (item := results.get()) is not None:
+            df_final, df_skipped = item
+            if len(df_final):
+                df_final.to_csv(csv_path, mode='w' if header else 'a', header=header, index=False)
+                header = False
+            with pool.writer() as slq3_instance, slq3_instance.transaction():
+                if len(df_final):
+                    _insert_and_search(df_final.drop(["artist_full_name"], axis=1), slq3_instance)
+                if len(df_skipped):
+                    _insert_skipped(df_skipped, slq3_instance)
     except Exception as error:
-        print("-->", error)
-        return None
-
-
-def _preprocessing_train(dataframe, column) -> pd.DataFrame|list:
-    pp = PreProcessing()
-    for i in range(dataframe.shape[0]):
-        txt = dataframe[column][i].replace('|', ' ')
-        dataframe.at[i, column] = txt
-    dataframe = pp.dropnan_and_lowercase(dataframe, column)
-    dataframe = pp.change_abbreviations_dataframe(dataframe, column)
-    dataframe = pp.drop_size(dataframe, column, 3)
-    dataframe = pp.apply_regex_dataframe(dataframe, column)
-    dataframe = pp.remove_stopwords_dataframe(dataframe, column)
-
-    texts_val = dataframe.lyrics
-    inputs_val = np.array([pp.convert_to_tokenizer(text, 512) for text in texts_val])
-
-    return dataframe, inputs_val
-
-
-def _fix_results(df) -> pd.DataFrame:
-    array_cols = ['song_id', 'song_name', 'model_name','emotion', 'value']
-    df_final = pd.DataFrame(columns=array_cols)
-    for _, row in df.iterrows():
-        song_name = row['song_name']
-        song_id = int(row['song_id'])
-        artist_full_name = row['artist_full_name']
-        for emotion in df.columns[3:]:
-            value = row[emotion]
-            dict_values = {'song_id': song_id, 'song_name': song_name, 
-                           'model_name': 'DCNN', 'artist_full_name':artist_full_name,
-                           'emotion': emotion, 'value': value}
-            df_final = df_final.append(dict_values, ignore_index=True)
-    return df_final 
-
-
-def main() -> None:
-    model_path = path+'/model/DCNN.keras'
-    model = load(model_path)
+        errors.append(error)
+        stop.set()
+        while results.get() is not None: pass
+
+
+def _build_results(songs, predicts, emotions, model_name='DCNN', model_version='') -> pd.DataFrame:
+    """
+    Builds the long-format emotional_result rows straight from the prediction matrix.
+
+    Parameters:
+    - songs: pd.DataFrame - One row per predicted song, with song_id, song_name and artist_full_name.
+    - predicts: np.ndarray - The (songs, emotions) prediction matrix, in the same row order as songs.
+    - emotions: list - The emotion name of each prediction column.
+    - model_name: str - The model recorded in each row.
+    - model_version: str - The version of the model recorded in each row.
+
+    Returns:
+    - pd.DataFrame - One row per song and emotion: song_id, song_name, model_name, model_version, emotion,
+      value, artist_full_name.
+    """
+    n_songs, n_emotions = predicts.shape
+    return pd.DataFrame({'song_id': np.repeat(songs['song_id'].to_numpy().astype(int), n_emotions),
+                         'song_name': np.repeat(songs['song_name'].to_numpy(), n_emotions),
+                         'model_name': model_name,
+                         'model_version': model_version,
+                         'emotion': np.tile(np.asarray(emotions, dtype=object), n_songs),
+                         'value': np.asarray(predicts, dtype=np.float64).reshape(-1),
+                         'artist_full_name': np.repeat(songs['artist_full_name'].to_numpy(), n_emotions)})
+
+
+def _build_skipped(song_ids, scorers, reason=DROPPED_REASON) -> pd.DataFrame:
+    """
+    Builds the skipped_song rows of songs that no model of the run can score.
+
+    Parameters:
+    - song_ids: list - The song_id of the skipped songs.
+    - scorers: list - The _Scorer of each model of the run.
+    - reason: str - Why the songs were skipped.
+
+    Returns:
+    - pd.DataFrame - One row per model and song: song_id, model_name, model_version, reason.
+    """
+    return pd.DataFrame({'song_id': np.tile(np.asarray(song_ids, dtype=int), len(scorers)),
+                         'model_name': np.repeat([scorer.spec.name for scorer in scorers], len(song_ids)),
+                         'model_version': np.repeat([scorer.version for scorer in scorers], len(song_ids)),
+                         'reason': reason})
+
+
+def main(argv=None) -> None:
+    """
+    Scores the songs without results of the current version of each selected model, or every song
+    with --rescore, and upserts their results. Songs dropped by the preprocessing are recorded in
+    skipped_song for each model version, and are not selected again until --rescore. The version of a model is the hash of its file unless
+    MODEL_VERSION is set. Each song is preprocessed and tokenized once, and the features are shared by
+    every model; the results of all models of a chunk are written in one transaction.
+
+    Scoring runs as a stream: a producer thread reads the songs in chunks,
+    preprocesses and tokenizes them, the main thread predicts, and a consumer thread writes and
+    commits the results of each chunk. Bounded queues between the stages keep the memory constant
+    and let preprocessing overlap with inference.
+
+    Configuration (environment variables):
+    - MODELS: Comma-separated names of libs.model_registry.MODEL_REGISTRY, same as --models. Default is 'DCNN'.
+    - INFERENCE_CHUNK_SIZE: Songs read, preprocessed and committed at a time. Default is 256.
+    - INFERENCE_BATCH_SIZE: Batch size of model.predict. Default is 32.
+    - INFERENCE_QUEUE_SIZE: Chunks buffered between two stages. Default is 2.
+    - PREPROCESSING_JOBS: Worker processes of the preprocessing pipeline, started once for the run. Default is 1.
+    - SCORING_MODE: 'truncate' scores the first max_length tokens of each song, 'window' scores whole songs
+      split in token windows packed in length-sorted batches (DCNN only). Default is 'truncate'.
+    - WINDOW_SIZE, WINDOW_STRIDE: Tokens per window and between window starts. Default is 64 and 32,
+      the input length the DCNN was trained on.
+    - WINDOW_AGGREGATION: 'mean', 'max' or 'weighted' (by window length). Default is 'mean'.
+    - MODEL_VERSION: Version recorded with the results. Default is the hash of the model file.
+    - PREDICTION_CACHE: '0' disables the cache of predictions keyed by the model file, the preprocessing
+      configuration (stages, stopwords, tokenizer version) and the lyrics. Default is '1'.
+    - AFFECTIVE_METRICS, AFFECTIVE_PROFILE: '1' writes the time, rows and bytes of each stage to
+      metrics/model_run.json and .prom, and with AFFECTIVE_PROFILE a cProfile/tracemalloc capture
+      (see libs.metrics). 'model_run.wait_preprocessing' and 'model_run.wait_writer' are the time the
+      inference waited for the producer and the consumer threads.
+
+    Raises:
+    - Exception: The first error of the producer or consumer thread, after both were stopped and joined.
+    """
+    parser = argparse.ArgumentParser(description="Scores the emotions of the songs with the registered models.")
+    parser.add_argument('--rescore', action='store_true', help="Score every song, overwriting existing results.")
+    parser.add_argument('--models', default=os.environ.get('MODELS', 'DCNN'),
+                        help=f"Comma-separated models, among {', '.join(MODEL_REGISTRY)}.")
+    args = parser.parse_args(argv)
+
+    chunk_size = int(os.environ.get('INFERENCE_CHUNK_SIZE', 256))
+    batch_size = int(os.environ.get('INFERENCE_BATCH_SIZE', 32))
+    queue_size = int(os.environ.get('INFERENCE_QUEUE_SIZE', 2))
+    aggregation = os.environ.get('WINDOW_AGGREGATION', 'mean')
+    windows = None
+    if os.environ.get('SCORING_MODE', 'truncate') == 'window':
+        windows = {'window': int(os.environ.get('WINDOW_SIZE', 64)), 'stride': int(os.environ.get('WINDOW_STRIDE', 32)),
+                   'batch_size': batch_size, 'min_width': 8}
+
+    names = [name.strip() for name in args.models.split(',') if name.strip()]
+    unknown = [name for name in names if name not in MODEL_REGISTRY]
+    if unknown:
+        sys.exit(f"Unknown models: {', '.join(unknown)}. Registered: {', '.join(MODEL_REGISTRY)}")
+    scorers = [_Scorer(MODEL_REGISTRY[name], os.environ.get('MODEL_VERSION')) for name in names]
 
     database_path = path+'/songs_database.db'
-    slq3_instance = slq3(database=database_path)
-    
-    query = 'SELECT song.song_id, song.song_name, song.lyrics, artist.artist_full_name FROM song INNER JOIN artist ON song.song_id = artist.song_id;'
-    inputs = slq3_instance.get_by_select(query=query)
-    songs, inputs_val =  _preprocessing_train(inputs, 'lyrics')
+    with SqlitePool(database_path) as pool:
+        with pool.writer() as slq3_instance:
+            slq3_instance.migrate(MIGRATIONS_PATH)
+        query, params = _songs_query(scorers, args.rescore)
+
+        emotion_name = pool.reader().get_by_select(query="SELECT name_emotion FROM emotion;")
+        emotion_name = emotion_name.to_dict()["name_emotion"]
+        emotions = [emotion_name[i] for i in range(len(emotion_name))]
 
-    emotion_name = slq3_instance.get_by_select(query="SELECT name_emotion FROM emotion;")
-    emotion_name = emotion_name.to_dict()["name_emotion"]
-    
-    predicts = model.predict(inputs_val)
-    df_results = pd.DataFrame(predicts, columns=[emotion_name[i] for i in range(len(emotion_name))])
+        if os.environ.get('PREDICTION_CACHE', '1') != '0':
+            pp = PreProcessing()
+            preprocessing = {'stages': LYRICS_STAGES, 'abbreviations': pp.abbreviations,
+                             'values_regex': list(pp.values_regex.items()),
+                             'stopwords': sorted(resources.stopwords('portuguese')),
+                             'tokenizer': pp.tokenizer_version()}
+            # The batch size of the windows only groups them for predict, it does not change the results.
+            window_config = {key: value for key, value in (windows or {}).items() if key != 'batch_size'}
+            for scorer in scorers:
+                windowed = windows is not None and scorer.spec.windowed
+                config = {**preprocessing, 'max_length': scorer.spec.max_length,
+                          'windows': window_config if windowed else None,
+                          'aggregation': aggregation if windowed else None}
+                scorer.prediction_cache = PredictionCache(pool, scorer.model_hash, PredictionCache.config_hash(config))
 
-    df_results = pd.concat([songs.drop(['lyrics'], axis=1), df_results], axis=1)
-    df_final = _fix_results(df_results)
+        stop, errors = Event(), []
+        batches, results = Queue(maxsize=queue_size), Queue(maxsize=queue_size)
+        producer = Thread(target=metrics.profiled(_read_and_preprocess),
+                          args=(pool, chunk_size, batches, stop, errors, scorers, windows, query, params), daemon=True)
+        consumer = Thread(target=metrics.profiled(_write_results),
+                          args=(pool, results, "songs_results.csv", stop, errors), daemon=True)
+        producer.start()
+        consumer.start()
 
-    df_final.to_csv("songs_results.csv", index=False)
-    df_final.drop(["artist_full_name"], axis=1, inplace=True)
+        scored, batch = 0, ()
+        try:
+            while True:
+                with metrics.stage('model_run.wait_preprocessing'):
+                    batch = batches.get()
+                if batch is None: break
+                songs, features, (cached_songs, cached_predicts), dropped = batch
+                frames = []
+                for index, scorer in enumerate(scorers):
+                    spec = scorer.spec
+                    if len(songs):
+                        predicts = spec.predict(scorer.model, features[spec.feature_key(windows)], len(emotions),
+                                                batch_size, aggregation)
+                        if scorer.prediction_cache is not None:
+                            scorer.prediction_cache.put_many(songs['lyrics_hash'].tolist(), predicts)
+                        frames.append(_build_results(songs, predicts, emotions, spec.name, scorer.version))
+                    if len(cached_songs):
+                        frames.append(_build_results(cached_songs, cached_predicts[index], emotions,
+                                                     spec.name, scorer.version))
+                frame = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+                with metrics.stage('model_run.wait_writer'):
+                    queued = _put(results, (frame, _build_skipped(dropped, scorers)), stop)
+                if not queued: break
+                scored += len(songs) + len(cached_songs)
+                print(f"SCORED: {scored} songs ({', '.join(f'{s.spec.name} {s.version}' for s in scorers)})")
+        finally:
+            stop.set()
+            while batch is not None: batch = batches.get()
+            results.put(None)
+            consumer.join()
+            producer.join()
+        if errors:
+            raise errors[0]
 
-    _insert_and_search(df_final, slq3_instance)
+        for scorer in scorers:
+            cache = scorer.prediction_cache
+            if cache is not None:
+                print(f"PREDICTION CACHE {scorer.spec.name}: {cache.hits} hits, {cache.misses} misses "
+                      f"({cache.hit_rate():.1%})")
 
 
-if __name__ == "__main__": main()
\ No newline at end of file
+if __name__ == "__main__":
+    with metrics.session('model_run'): main()
@@ -0,0 +1,225 @@
+from tempfile import TemporaryDirectory
+from warnings import filterwarnings
+import argparse
+import numpy as np
+import os, sys
+filterwarnings("ignore")
+
+
+path = os.path.abspath(__file__)
+path = path[:path.find('/scripts')]
+sys.path.insert(1, path)
+from libs.pre_processing import PreProcessing
+from libs.pipeline import Pipeline, LYRICS_STAGES
+from libs.sqlite_manager import Sqlite as slq3
+from libs.model_registry import MODEL_REGISTRY, build_features
+from libs.benchmark import Benchmark, compare, load_report
+from libs.training_data import split_rows
+
+
+BASELINE_PATH = path+'/benchmarks/baseline.json'
+INPUTS_QUERY = "SELECT inputs_id, text_name, emotion_id FROM inputs ORDER BY inputs_id LIMIT ?;"
+SONGS_QUERY = "SELECT song_id, lyrics FROM song ORDER BY song_id LIMIT ?;"
+
+
+def _preprocessing_cases(benchmark, pp, songs) -> None:
+    """
+    Every PreProcessing *_dataframe method, row by row and columnar, and the fused Pipeline, on the raw
+    lyrics of the song sample. The texts of 'inputs' are stored already preprocessed, so they would
+    make every pass a near no-op. The methods get the lyrics with their '|' line separators replaced,
+    as the first stage of LYRICS_STAGES does, and the pipeline gets them untouched.
+    """
+    lines = songs.assign(lyrics=songs['lyrics'].str.replace('|', ' ', regex=False))
+    methods = [('change_abbreviations', pp.change_abbreviations_dataframe, {}),
+               ('apply_regex', pp.apply_regex_dataframe, {}),
+               ('drop_size', pp.drop_size, {'n_size': 3}),
+               ('dropnan_and_lowercase', pp.dropnan_and_lowercase, {}),
+               ('remove_stopwords', pp.remove_stopwords_dataframe, {})]
+    for name, method, kwargs in methods:
+        for columnar in (False, True):
+            case = f"preprocessing.{name}" + (".columnar" if columnar else "")
+            benchmark.measure(case, lambda: method(lines.copy(), 'lyrics', columnar=columnar, **kwargs),
+                              rows=len(lines), group='preprocessing')
+
+    pipeline = Pipeline(LYRICS_STAGES, pre_processing=pp)
+    benchmark.measure("preprocessing.pipeline", lambda: pipeline.run(songs.copy(), 'lyrics'),
+                      rows=len(songs), group='preprocessing')
+
+
+def _tokenization_cases(benchmark, pp, texts, lyrics) -> None:
+    benchmark.measure("tokenization.tokenize_batch_64", lambda: pp.tokenize_batch(texts, 64),
+                      rows=len(texts), group='tokenization')
+    benchmark.measure("tokenization.lyrics_512", lambda: pp.tokenize_batch(lyrics, 512, padding='max_length'),
+                      rows=len(lyrics), group='tokenization')
+    benchmark.measure("tokenization.lyrics_encode_full", lambda: pp.encode_full(lyrics),
+                      rows=len(lyrics), group='tokenization')
+    input_ids = pp.encode_full(lyrics)
+    benchmark.measure("tokenization.lyrics_windows_64", lambda: list(pp.pack_windows(input_ids, 64, 32)),
+                      rows=len(lyrics), group='tokenization')
+
+
+def _database_cases(benchmark, slq3_instance, n_rows) -> None:
+    """
+    Reads through Sqlite from songs_database.db, and writes to a temporary database so the real one is untouched.
+    """
+    benchmark.measure("database.get_by_select", lambda: slq3_instance.get_by_select(INPUTS_QUERY, (n_rows,)),
+                      rows=n_rows, group='database')
+    benchmark.measure("database.iter_select",
+                      lambda: sum(len(chunk) for chunk in slq3_instance.iter_select(INPUTS_QUERY, (n_rows,), 500)),
+                      rows=n_rows, group='database')
+
+    inputs = slq3_instance.get_by_select(INPUTS_QUERY, (n_rows,))
+    with TemporaryDirectory() as directory:
+        target = slq3(os.path.join(directory, 'benchmark.db'))
+        target.cur.execute("CREATE TABLE inputs (inputs_id INTEGER PRIMARY KEY, text_name TEXT, emotion_id INTEGER)")
+        benchmark.measure("database.insert_many",
+                          lambda: target.insert_many('inputs', inputs, batch_size=1000, on_conflict='replace'),
+                          rows=len(inputs), group='database')
+        target.close()
+
+
+def _accuracy(predicts, labels) -> float:
+    return float(np.mean(np.argmax(predicts, axis=1) == labels))
+
+
+def _fit_description(spec, epochs) -> str:
+    return 'sklearn: full fit' if spec.kind == 'sklearn' else f"keras: {epochs} epoch{'s' if epochs > 1 else ''}"
+
+
+def _train(spec, model, features, labels, n_emotions, epochs=1):
+    """
+    Refits a copy of a model: sklearn models are cloned with their hyperparameters (the best estimator
+    of a grid search) and fit to convergence, Keras models are cloned from their architecture and
+    trained for `epochs` epochs.
+    """
+    if spec.kind == 'sklearn':
+        from sklearn.base import clone
+        estimator = clone(getattr(model, 'best_estimator_', model))
+        return estimator.fit(features, labels)
+    import keras
+    clone = keras.models.clone_model(model)
+    clone.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
+    clone.fit(features, np.eye(n_emotions)[labels], epochs=epochs, batch_size=32, verbose=0)
+    return clone
+
+
+def _model_cases(benchmark, pp, names, texts, labels, inputs_id, lyrics, n_emotions, training=True, epochs=1) -> None:
+    """
+    Load and inference over lyrics and texts of each model, and its refit on the train split of the
+    inputs sample with its accuracy on the held-out split (libs.training_data.split_rows). The
+    pretrained models are not scored: the sample may overlap the data they were trained on.
+    """
+    text_ids, lyrics_ids = pp.encode_full(texts), pp.encode_full(lyrics)
+    order, n_train = split_rows(inputs_id)
+    train_rows, holdout_rows = order[:n_train], order[n_train:]
+    for name in names:
+        spec = MODEL_REGISTRY[name]
+        if not os.path.exists(spec.model_path):
+            print(f"{name}: {spec.model_path} not found, skipped")
+            continue
+        benchmark.measure(f"model.{name}.load", spec.load, group='model', repeats=1, warmup=0)
+        model = spec.load()
+        key = spec.feature_key()
+        text_features = build_features(pp, text_ids, [key])[key]
+        lyrics_features = build_features(pp, lyrics_ids, [key])[key]
+
+        benchmark.measure(f"model.{name}.inference_lyrics",
+                          lambda: spec.predict(model, lyrics_features, n_emotions), rows=len(lyrics), group='inference')
+        benchmark.measure(f"model.{name}.inference_texts",
+                          lambda: spec.predict(model, text_features, n_emotions), rows=len(texts), group='inference')
+        if training:
+            train_features = build_features(pp, [text_ids[row] for row in train_rows], [key])[key]
+            holdout_features = build_features(pp, [text_ids[row] for row in holdout_rows], [key])[key]
+            fitted = []
+            result = benchmark.measure(f"model.{name}.training",
+                                       lambda: fitted.append(_train(spec, model, train_features, labels[train_rows],
+                                                                    n_emotions, epochs)),
+                                       rows=len(train_rows), group='training', repeats=1, warmup=0)
+            result['fit'] = _fit_description(spec, epochs)
+            if fitted:
+                predicts = spec.predict(fitted[-1], holdout_features, n_emotions)
+                result.update({'holdout_rows': len(holdout_rows),
+                               'holdout_accuracy': _accuracy(predicts, labels[holdout_rows])})
+
+
+def main(argv=None) -> None:
+    """
+    Measures throughput and latency of every stage on fixed samples of songs_database.db (the first rows of
+    'inputs' and 'song' by id), writes the JSON report and compares it with the stored baseline.
+
+    Stages: each PreProcessing method and the Pipeline on the raw lyrics, tokenization, Sqlite reads and writes, and the load,
+    inference and training of each registered model whose file is in model/.
+
+    The training case refits each model on the train split of the 'inputs' sample and stores its accuracy
+    on the held-out split ('holdout_accuracy'). Its time is one fit, described by 'fit': sklearn models
+    are fit to convergence, Keras models for --epochs epochs, so training times are only comparable
+    between models of the same kind; the inference cases are comparable between every model.
+
+    No baseline is committed, since timings only compare on the same machine: store one with
+    --save-baseline on the machine that runs --check (benchmarks/baseline.json). --check exits with
+    an error if there is none.
+
+    Example:
+
+        $ python scripts/run_benchmarks.py --save-baseline
+        $ python scripts/run_benchmarks.py --check          # exits with an error on a regression
+    """
+    parser = argparse.ArgumentParser(description="Reproducible benchmark of the preprocessing, database and models.")
+    parser.add_argument('--rows', type=int, default=2000, help="Rows of the 'inputs' sample.")
+    parser.add_argument('--songs', type=int, default=80, help="Songs of the lyrics sample.")
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--models', default=','.join(MODEL_REGISTRY))
+    parser.add_argument('--skip-training', action='store_true')
+    parser.add_argument('--epochs', type=int, default=1, help="Epochs of the refit of the Keras models.")
+    parser.add_argument('--output', default=path+'/benchmarks/latest.json')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help="Store this run as the new baseline.")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Accepted slowdown before a regression.")
+    parser.add_argument('--check', action='store_true', help="Exit with an error if a case regressed.")
+    args = parser.parse_args(argv)
+
+    slq3_instance = slq3(database=path+'/songs_database.db')
+    inputs = slq3_instance.get_by_select(INPUTS_QUERY, (args.rows,))
+    songs = slq3_instance.get_by_select(SONGS_QUERY, (args.songs,))
+    n_emotions = len(slq3_instance.get_by_select("SELECT name_emotion FROM emotion;"))
+
+    pp = PreProcessing()
+    lyrics_pipeline = Pipeline(LYRICS_STAGES, pre_processing=pp)
+    texts = [txt for txt in inputs.text_name.astype(str)]
+    labels = inputs.emotion_id.to_numpy().astype(int)
+    lyrics = [lyrics_pipeline.process(txt) or "" for txt in songs.lyrics]
+
+    benchmark = Benchmark(repeats=args.repeats)
+    _preprocessing_cases(benchmark, pp, songs[['lyrics']])
+    _tokenization_cases(benchmark, pp, texts, lyrics)
+    _database_cases(benchmark, slq3_instance, args.rows)
+    names = [name.strip() for name in args.models.split(',') if name.strip() in MODEL_REGISTRY]
+    _model_cases(benchmark, pp, names, texts, labels, inputs.inputs_id.to_numpy(), lyrics, n_emotions,
+                 training=not args.skip_training, epochs=args.epochs)
+
+    metadata = {'rows': len(inputs), 'songs': len(songs), 'repeats': args.repeats, 'models': names,
+                'epochs': args.epochs}
+    report = benchmark.save(args.output, **metadata)
+    print("REPORT:", args.output)
+
+    if args.save_baseline:
+        benchmark.save(args.baseline, **metadata)
+        print("BASELINE:", args.baseline)
+        return
+
+    baseline = load_report(args.baseline)
+    if baseline is None:
+        message = f"No baseline at {args.baseline} - run with --save-baseline on this machine to store one."
+        if args.check:
+            sys.exit(message)
+        print(message)
+        return
+    if baseline['metadata'] != metadata or baseline['environment']['platform'] != report['environment']['platform']:
+        print("WARNING: the baseline was measured on other samples or another platform.")
+    comparison = compare(report, baseline, args.tolerance)
+    print(comparison.to_string(index=False))
+    if args.check and comparison.regression.any():
+        sys.exit("Regressions in: " + ", ".join(comparison[comparison.regression]['name']))
+
+
+if __name__ == "__main__": main()
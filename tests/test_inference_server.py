@@ -0,0 +1,146 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Lock
+from urllib.error import HTTPError
+from urllib.request import urlopen
+import json, sqlite3
+import os, sys
+
+import numpy as np
+import pytest
+
+path = os.path.abspath(__file__)
+path = path[:path.find('/tests')]
+sys.path.insert(1, path)
+from libs.micro_batcher import MicroBatcher
+from libs.model_registry import RegisteredModel
+from libs.pre_processing import PreProcessing
+from libs.resources import resources
+from libs.sqlite_manager import SqlitePool
+from scripts.inference_server import _Scorer, _Handler, _HTTPServer
+
+EMOTIONS = ['alegria', 'tristeza', 'raiva']
+LYRICS = 'Todos os dias quando acordo|Não tenho mais|O tempo que passou'
+
+
+class _StubTokenizer:
+    """
+    Stub of the pretrained tokenizer: one id per word, its length, between [CLS] and [SEP].
+    """
+    pad_token_id = 0
+
+    def __call__(self, texts, max_length=None, **kwargs) -> dict:
+        return {'input_ids': [[101] + [len(token) for token in txt.split()] + [102] for txt in texts]}
+
+
+class _StubModel:
+    """
+    Stub of a Keras model: the emotion vector of a text only depends on its number of tokens.
+    """
+    def __init__(self) -> None:
+        self.batch_sizes = []
+        self._lock = Lock()
+
+    def predict(self, features, batch_size=32, verbose=0) -> np.ndarray:
+        with self._lock:
+            self.batch_sizes.append(len(features))
+        n_tokens = (np.asarray(features) != 0).sum(axis=1).astype(np.float64)
+        return np.stack([n_tokens, np.ones_like(n_tokens), np.zeros_like(n_tokens)], axis=1)
+
+
+class _StubSpec(RegisteredModel):
+    def __init__(self) -> None:
+        super().__init__('Stub', 'stub.keras', 'keras', 'token_ids', max_length=16)
+        self.model = _StubModel()
+
+    def load(self):
+        return self.model
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    """
+    Serves the stub model on a free local port, over a database with a song and a lyrics too short to be scored.
+
+    Returns:
+    - tuple: The base URL, the micro-batcher and the stub model.
+    """
+    monkeypatch.setitem(resources._stopwords, 'portuguese', frozenset(['os', 'o', 'que', 'de']))
+    monkeypatch.setitem(resources._tokenizers, PreProcessing().tokenizer_name, _StubTokenizer())
+    database = str(tmp_path / 'songs_database.db')
+    with sqlite3.connect(database) as conn:
+        conn.execute("CREATE TABLE emotion (emotion_id INTEGER PRIMARY KEY, name_emotion TEXT);")
+        conn.execute("CREATE TABLE song (song_id INTEGER PRIMARY KEY, lyrics TEXT);")
+        conn.executemany("INSERT INTO emotion VALUES (?, ?);", list(enumerate(EMOTIONS)))
+        conn.executemany("INSERT INTO song VALUES (?, ?);", [(1, LYRICS), (2, 'oi')])
+
+    spec = _StubSpec()
+    with SqlitePool(database) as pool:
+        with MicroBatcher(_Scorer(spec, pool), max_batch_size=16, max_wait=0.02) as batcher:
+            monkeypatch.setattr(_Handler, 'batcher', batcher)
+            http_server = _HTTPServer(('127.0.0.1', 0), _Handler)
+            thread = Thread(target=http_server.serve_forever, daemon=True)
+            thread.start()
+            try:
+                yield f'http://127.0.0.1:{http_server.server_address[1]}', batcher, spec.model
+            finally:
+                http_server.shutdown()
+                http_server.server_close()
+
+
+def _post(url, body) -> int|dict:
+    """
+    Posts a JSON body to /score.
+
+    Returns:
+    - tuple: The HTTP status and the decoded JSON reply.
+    """
+    try:
+        with urlopen(url + '/score', data=json.dumps(body).encode('utf-8'), timeout=5) as response:
+            return response.status, json.load(response)
+    except HTTPError as error:
+        return error.code, json.load(error)
+
+
+def test_text_and_song_id_are_scored(server):
+    url, _, _ = server
+    status, reply = _post(url, {'text': 'todos os dias quando acordo'})
+    assert status == 200
+    assert list(reply['emotions']) == EMOTIONS
+    assert reply['emotions']['alegria'] == 6.0
+    status, reply = _post(url, {'song_id': 1})
+    assert status == 200
+    assert reply['emotions']['tristeza'] == 1.0
+
+
+def test_unknown_song_id_is_404(server):
+    url, _, _ = server
+    assert _post(url, {'song_id': 99}) == (404, {'error': 'song_id 99 not found'})
+
+
+@pytest.mark.parametrize('body', [{'text': 'oi'}, {'song_id': 2}])
+def test_text_dropped_by_the_preprocessing_is_422(server, body):
+    url, _, _ = server
+    assert _post(url, body) == (422, {'error': 'text dropped by the preprocessing'})
+
+
+def test_invalid_request_is_400(server):
+    url, _, _ = server
+    assert _post(url, {'lyrics': 'oi'})[0] == 400
+    assert _post(url, {'song_id': 'três'})[0] == 400
+
+
+def test_concurrent_requests_are_batched(server):
+    url, batcher, model = server
+    bodies = [{'text': f'todos os dias quando acordo {i}'} for i in range(64)] + [{'song_id': 1}] * 16
+    with ThreadPoolExecutor(32) as executor:
+        replies = list(executor.map(lambda body: _post(url, body), bodies))
+    assert all(status == 200 for status, _ in replies)
+    assert max(model.batch_sizes) > 1
+    assert sum(model.batch_sizes) == len(bodies)
+
+    with urlopen(url + '/stats', timeout=5) as response:
+        stats = json.load(response)
+    assert stats['items'] == len(bodies)
+    assert stats['batches'] < len(bodies)
+    assert 0 < stats['p50_ms'] <= stats['p99_ms'] <= stats['max_ms'] < 5000
+    assert stats == pytest.approx(batcher.latency())
@@ -0,0 +1,59 @@
+from concurrent.futures import Future
+import os, sys
+
+import pytest
+
+path = os.path.abspath(__file__)
+path = path[:path.find('/tests')]
+sys.path.insert(1, path)
+from libs.micro_batcher import MicroBatcher
+
+
+def _double(items) -> list:
+    """
+    Doubles each item; 'short' returns one result for the whole batch and 'fail' raises.
+    """
+    if 'short' in items:
+        return [0]
+    if 'fail' in items:
+        raise RuntimeError('batch failed')
+    return [item * 2 for item in items]
+
+
+def test_items_of_a_batch_get_their_results():
+    with MicroBatcher(_double, max_batch_size=8, max_wait=0.05) as batcher:
+        futures = [batcher.submit(item) for item in range(20)]
+        assert [future.result(timeout=5) for future in futures] == [item * 2 for item in range(20)]
+    assert batcher.items == 20
+    assert batcher.batches >= 3
+
+
+def test_missing_results_fail_every_item_and_keep_the_worker_alive():
+    with MicroBatcher(_double, max_batch_size=8, max_wait=0.2) as batcher:
+        futures = [batcher.submit('short'), batcher.submit(1)]
+        for future in futures:
+            with pytest.raises(ValueError, match='1 results for a batch of 2'):
+                future.result(timeout=5)
+        assert batcher.submit(3).result(timeout=5) == 6
+
+
+def test_error_fails_the_batch_and_keeps_the_worker_alive():
+    with MicroBatcher(_double, max_batch_size=8, max_wait=0.2) as batcher:
+        future = batcher.submit('fail')
+        with pytest.raises(RuntimeError, match='batch failed'):
+            future.result(timeout=5)
+        assert batcher.submit(4).result(timeout=5) == 8
+
+
+def test_cancelled_future_does_not_stop_the_worker():
+    def slow_double(items):
+        cancelled.result(timeout=5)
+        return _double(items)
+
+    cancelled = Future()
+    with MicroBatcher(slow_double, max_batch_size=8, max_wait=0.2) as batcher:
+        first, second = batcher.submit(1), batcher.submit(2)
+        assert first.cancel()
+        cancelled.set_result(None)
+        assert second.result(timeout=5) == 4
+        assert batcher.submit(5).result(timeout=5) == 10
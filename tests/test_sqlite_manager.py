@@ -0,0 +1,59 @@
+import os, sys
+
+import pytest
+
+path = os.path.abspath(__file__)
+path = path[:path.find('/tests')]
+sys.path.insert(1, path)
+from libs.sqlite_manager import Sqlite
+
+
+@pytest.fixture
+def database(tmp_path) -> Sqlite:
+    slq3_instance = Sqlite(str(tmp_path / 'test.db'))
+    slq3_instance.cur.execute("CREATE TABLE emotion (emotion_id INTEGER PRIMARY KEY, name_emotion TEXT NOT NULL);")
+    slq3_instance.conn.commit()
+    yield slq3_instance
+    slq3_instance.close()
+
+
+def _names(slq3_instance) -> list:
+    return slq3_instance.get_by_select("SELECT name_emotion FROM emotion ORDER BY emotion_id;").name_emotion.tolist()
+
+
+def test_transaction_rolls_back_insert_and_update(database):
+    database.insert("INSERT INTO emotion VALUES (0, 'alegria');")
+    with pytest.raises(RuntimeError):
+        with database.transaction():
+            database.insert("INSERT INTO emotion VALUES (1, 'tristeza');")
+            database.update("UPDATE emotion SET name_emotion = 'raiva' WHERE emotion_id = 0;")
+            database.insert_many('emotion', [(2, 'medo')], columns=['emotion_id', 'name_emotion'])
+            raise RuntimeError('abort')
+    assert _names(database) == ['alegria']
+
+
+def test_transaction_commits_at_the_end(database):
+    with database.transaction():
+        database.insert("INSERT INTO emotion VALUES (0, 'alegria');")
+        database.insert_many('emotion', [(1, 'tristeza')], columns=['emotion_id', 'name_emotion'])
+    database.conn.rollback()
+    assert _names(database) == ['alegria', 'tristeza']
+
+
+def test_transaction_joins_an_open_transaction(database):
+    database.cur.execute("INSERT INTO emotion VALUES (0, 'alegria');")
+    assert database.conn.in_transaction
+    with database.transaction():
+        database.insert("INSERT INTO emotion VALUES (1, 'tristeza');")
+    assert not database.conn.in_transaction
+    assert _names(database) == ['alegria', 'tristeza']
+
+
+def test_nested_transaction_is_part_of_the_outer_one(database):
+    with pytest.raises(RuntimeError):
+        with database.transaction():
+            with database.transaction():
+                database.insert("INSERT INTO emotion VALUES (0, 'alegria');")
+            assert database.conn.in_transaction
+            raise RuntimeError('abort')
+    assert _names(database) == []
@@ -0,0 +1,161 @@
+from collections import Counter
+import asyncio, json
+import os, sys
+
+import pytest
+
+path = os.path.abspath(__file__)
+path = path[:path.find('/tests')]
+sys.path.insert(1, path)
+from libs.vagalume import AsyncLyricsFetcher, ResponseCache
+
+aiohttp = pytest.importorskip('aiohttp')
+from aiohttp import web
+
+REQUESTS = web.AppKey('requests', Counter)
+
+FOUND = {'type': 'exact',
+         'art': {'id': '3ade68b3g1f86eda3', 'name': 'Legião Urbana'},
+         'mus': [{'id': '3ade68b8gb7a1c0b3', 'name': 'Tempo Perdido',
+                  'url': 'https://www.vagalume.com.br/legiao-urbana/tempo-perdido.html',
+                  'text': 'Todos os dias quando acordo\n\nNão tenho mais\n'}]}
+
+
+async def _stub_handler(request) -> web.Response:
+    """
+    Stub of the Vagalume search API: the behaviour is chosen by the song name ('mus').
+    """
+    song_name = request.query['mus']
+    request.app[REQUESTS][song_name] += 1
+    calls = request.app[REQUESTS][song_name]
+    if song_name == 'found':
+        return web.json_response(FOUND)
+    if song_name == 'song_notfound':
+        return web.json_response({'type': 'song_notfound'})
+    if song_name == 'no_artist':
+        return web.json_response({key: value for key, value in FOUND.items() if key != 'art'})
+    if song_name == 'http_404':
+        return web.Response(status=404)
+    if song_name == 'throttled_once':
+        return web.Response(status=429) if calls == 1 else web.json_response(FOUND)
+    if song_name == 'throttled':
+        return web.Response(status=429)
+    if song_name == 'slow':
+        await asyncio.sleep(1)
+        return web.json_response(FOUND)
+    return web.Response(status=500)
+
+
+async def _fetch(song_names, max_retries=2, cache=None) -> dict|Counter:
+    """
+    Starts the stub server on a free local port and fetches the songs through it.
+
+    Returns:
+    - tuple: The (dict_song, dict_artist) of each song name, and the number of requests per song name.
+    """
+    app = web.Application()
+    app[REQUESTS] = Counter()
+    app.router.add_get('/search.php', _stub_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    try:
+        port = runner.addresses[0][1]
+        fetcher = AsyncLyricsFetcher('test-key', api_url=f'http://127.0.0.1:{port}/search.php', concurrency=4,
+                                     rate=1000, max_retries=max_retries, backoff=0.01, timeout=0.3,
+                                     cache=cache)
+        fetched = {}
+        async for i, dict_song, dict_artist in fetcher.fetch_all(('Legião Urbana', song_name) for song_name in song_names):
+            fetched[song_names[i]] = (dict_song, dict_artist)
+        return fetched, app[REQUESTS]
+    finally:
+        await runner.cleanup()
+
+
+def test_found_song_is_parsed():
+    fetched, requests = asyncio.run(_fetch(['found']))
+    dict_song, dict_artist = fetched['found']
+    assert dict_song['song_name'] == 'Tempo Perdido'
+    assert dict_song['lyrics'] == 'Todos os dias quando acordo|Não tenho mais'
+    assert dict_artist == {'artist_full_name': 'Legião Urbana', 'vagalume_artist_id': '3ade68b3g1f86eda3'}
+    assert requests['found'] == 1
+
+
+def test_song_notfound_response_is_not_retried():
+    fetched, requests = asyncio.run(_fetch(['song_notfound']))
+    assert fetched['song_notfound'] == (False, False)
+    assert requests['song_notfound'] == 1
+
+
+def test_http_404_fails_without_retry():
+    fetched, requests = asyncio.run(_fetch(['http_404']))
+    assert fetched['http_404'] == (None, None)
+    assert requests['http_404'] == 1
+
+
+def test_429_is_retried_until_it_succeeds():
+    fetched, requests = asyncio.run(_fetch(['throttled_once']))
+    assert fetched['throttled_once'][0]['song_name'] == 'Tempo Perdido'
+    assert requests['throttled_once'] == 2
+
+
+def test_429_gives_up_after_max_retries():
+    fetched, requests = asyncio.run(_fetch(['throttled'], max_retries=2))
+    assert fetched['throttled'] == (None, None)
+    assert requests['throttled'] == 3
+
+
+def test_timeout_is_retried_then_fails():
+    fetched, requests = asyncio.run(_fetch(['slow'], max_retries=1))
+    assert fetched['slow'] == (None, None)
+    assert requests['slow'] == 2
+
+
+def test_error_of_a_worker_is_raised_by_fetch_all():
+    class FailingFetcher(AsyncLyricsFetcher):
+        async def fetch(self, session, artist_name, song_name):
+            if song_name == 'boom':
+                raise RuntimeError('worker failed')
+            return await super().fetch(session, artist_name, song_name)
+
+    async def fetch_all():
+        fetcher = FailingFetcher('test-key', api_url='http://127.0.0.1:9/search.php', concurrency=2, rate=1000)
+        return [item async for item in fetcher.fetch_all([('Legião Urbana', 'boom')] * 10)]
+
+    with pytest.raises(RuntimeError, match='worker failed'):
+        asyncio.run(asyncio.wait_for(fetch_all(), 5))
+
+
+def test_every_pair_is_yielded_once():
+    song_names = ['found', 'song_notfound', 'http_404', 'throttled_once']
+    fetched, _ = asyncio.run(_fetch(song_names))
+    assert sorted(fetched) == sorted(song_names)
+
+
+def test_cached_response_without_artist_is_fetched_again(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    cache.put('Legião Urbana', 'found', {key: value for key, value in FOUND.items() if key != 'art'})
+    fetched, requests = asyncio.run(asyncio.wait_for(_fetch(['found'], cache=cache), 5))
+    assert fetched['found'][0]['song_name'] == 'Tempo Perdido'
+    assert requests['found'] == 1
+    assert cache.get('Legião Urbana', 'found') == FOUND
+
+
+def test_unparsable_response_is_not_cached(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    fetched, requests = asyncio.run(asyncio.wait_for(_fetch(['no_artist'], cache=cache), 5))
+    assert fetched['no_artist'] == (None, None)
+    assert requests['no_artist'] == 1
+    assert not os.path.exists(cache._file('Legião Urbana', 'no_artist'))
+
+
+@pytest.mark.parametrize('entry', [{}, {'results': FOUND}, {'stored_at': 0}, [], {'results': [], 'stored_at': 0}])
+def test_malformed_cache_entries_are_misses(tmp_path, entry):
+    cache = ResponseCache(str(tmp_path))
+    file = cache._file('Legião Urbana', 'found')
+    os.makedirs(os.path.dirname(file), exist_ok=True)
+    with open(file, 'w') as cached:
+        json.dump(entry, cached)
+    assert cache.get('Legião Urbana', 'found') is None
+    assert cache.misses == 1